@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# Inverted file (IVF) index for approximate nearest neighbours of unit length word vectors.
+#
+# Vectors are clustered with spherical k-means; every vector is stored once, grouped by its closest
+# centroid, so a query scores the centroids, scans the nprobe best lists with one matrix product each
+# and keeps the top N with argpartition. With prefix P the index is saved as
+#   P.centroids.npy  float32 [num_lists, dim]
+#   P.offsets.npy    int64   [num_lists + 1], list l holds rows offsets[l]: offsets[l + 1]
+#   P.ids.npy        int32   [vocab_size], row ids of the vectors file (vectors_io.py) grouped by list
+#   P.vectors.npy    float32 [vocab_size, dim], the vectors in the same order
+#   P.meta           json with sizes
+# and loaded with memory maps.
+#
+#   python eval/python/ann_index.py build --vectors_file vectors.txt --vocab_file vocab.txt --index vectors.ivf
+#   python eval/python/ann_index.py bench --vectors_file vectors.txt --vocab_file vocab.txt --index vectors.ivf
+import argparse
+import json
+import sys
+import time
+import numpy as np
+from vectors_io import load_vectors
+
+CHUNK_ROWS = 1 << 16
+
+
+def assign(W, centroids):
+    # closest centroid (largest dot product) of every row, a chunk of rows at a time
+    labels = np.empty(W.shape[0], dtype=np.int64)
+    for lo in range(0, W.shape[0], CHUNK_ROWS):
+        labels[lo: lo + CHUNK_ROWS] = np.argmax(np.dot(W[lo: lo + CHUNK_ROWS], centroids.T), 1)
+    return labels
+
+
+def spherical_kmeans(X, num_lists, num_iter=20, seed=1234):
+    rng = np.random.RandomState(seed)
+    centroids = X[rng.choice(X.shape[0], num_lists, replace=False)].copy()
+    for it in range(num_iter):
+        labels = assign(X, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, X)
+        counts = np.bincount(labels, minlength=num_lists)
+        empty = counts == 0
+        sums[empty] = X[rng.choice(X.shape[0], int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+class IVFIndex(object):
+    def __init__(self, centroids, offsets, ids, vectors):
+        self.centroids, self.offsets, self.ids, self.vectors = centroids, offsets, ids, vectors
+
+    @classmethod
+    def build(cls, W, num_lists=0, num_iter=20, sample_size=0, seed=1234):
+        start = time.time()
+        num_lists = num_lists or max(1, int(4 * np.sqrt(W.shape[0])))
+        num_lists = min(num_lists, W.shape[0])
+        sample_size = min(W.shape[0], sample_size or 64 * num_lists)
+        rng = np.random.RandomState(seed)
+        sample = np.asarray(W[np.sort(rng.choice(W.shape[0], sample_size, replace=False))], dtype=np.float32)
+        centroids = spherical_kmeans(sample, num_lists, num_iter, seed)
+        labels = assign(W, centroids)
+        order = np.argsort(labels, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=num_lists))]).astype(np.int64)
+        vectors = np.empty(W.shape, dtype=np.float32)
+        for lo in range(0, W.shape[0], CHUNK_ROWS):
+            vectors[lo: lo + CHUNK_ROWS] = W[order[lo: lo + CHUNK_ROWS]]
+        print('built IVF index of %d vectors, %d lists in %.1fs' % (W.shape[0], num_lists, time.time() - start))
+        return cls(centroids, offsets, order.astype(np.int32), vectors)
+
+    def save(self, prefix):
+        np.save(prefix + '.centroids.npy', self.centroids)
+        np.save(prefix + '.offsets.npy', self.offsets)
+        np.save(prefix + '.ids.npy', self.ids)
+        np.save(prefix + '.vectors.npy', self.vectors)
+        with open(prefix + '.meta', 'w') as f:
+            json.dump({'num_lists': len(self.centroids), 'num_vectors': len(self.ids), 'dim': self.vectors.shape[1]}, f)
+
+    @classmethod
+    def load(cls, prefix):
+        return cls(np.load(prefix + '.centroids.npy'), np.load(prefix + '.offsets.npy'),
+                   np.load(prefix + '.ids.npy', mmap_mode='r'), np.load(prefix + '.vectors.npy', mmap_mode='r'))
+
+    def most_similar(self, vec, topn=10, nprobe=8, exclude=()):
+        # [(row id, score)] of the topn best vectors in the nprobe closest lists, best first
+        vec = np.asarray(vec, dtype=np.float32)
+        nprobe = min(nprobe, len(self.centroids))
+        probes = np.argpartition(-np.dot(self.centroids, vec), nprobe - 1)[:nprobe]
+        ids = np.concatenate([self.ids[self.offsets[l]: self.offsets[l + 1]] for l in probes])
+        scores = np.concatenate([np.dot(self.vectors[self.offsets[l]: self.offsets[l + 1]], vec) for l in probes])
+        if len(exclude):
+            scores[np.isin(ids, list(exclude))] = -np.inf
+        topn = min(topn, len(scores))
+        if topn == 0:
+            return []
+        top = np.argpartition(-scores, topn - 1)[:topn]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top if scores[i] > -np.inf]
+
+
+def exact_most_similar(W, vec, topn=10, exclude=()):
+    scores = np.dot(W, vec)
+    if len(exclude):
+        scores[list(exclude)] = -np.inf
+    top = np.argpartition(-scores, min(topn, len(scores)) - 1)[:topn]
+    top = top[np.argsort(-scores[top])]
+    return [(int(i), float(scores[i])) for i in top]
+
+
+def benchmark(W, index, num_queries=1000, topn=10, nprobes=(1, 4, 16, 64), seed=1234):
+    rng = np.random.RandomState(seed)
+    queries = rng.choice(W.shape[0], min(num_queries, W.shape[0]), replace=False)
+    start = time.time()
+    exact = [set(i for i, _ in exact_most_similar(W, W[q], topn, (q,))) for q in queries]
+    exact_ms = (time.time() - start) * 1000 / len(queries)
+    print('exact search: %.3f ms/query' % exact_ms)
+    for nprobe in nprobes:
+        start = time.time()
+        approx = [index.most_similar(W[q], topn, nprobe, (q,)) for q in queries]
+        ms = (time.time() - start) * 1000 / len(queries)
+        recall = np.mean([len(truth & set(i for i, _ in res)) / float(topn) for truth, res in zip(exact, approx)])
+        print('nprobe %d: recall@%d %.4f, %.3f ms/query (%.1fx)' % (nprobe, topn, recall, ms, exact_ms / ms))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['build', 'bench'])
+    parser.add_argument('--vocab_file', default='', type=str)
+    parser.add_argument('--vectors_file', default='vectors.txt', type=str)
+    parser.add_argument('--index', default='vectors.ivf', type=str)
+    parser.add_argument('--num_lists', default=0, type=int, help='default 4 * sqrt(vocab size)')
+    parser.add_argument('--num_iter', default=20, type=int)
+    parser.add_argument('--queries', default=1000, type=int)
+    parser.add_argument('--topn', default=10, type=int)
+    parser.add_argument('--nprobe', default='1,4,16,64', type=str)
+    args = parser.parse_args()
+
+    W, vocab, ivocab = load_vectors(args.vectors_file, args.vocab_file)
+    if args.command == 'build':
+        IVFIndex.build(W, args.num_lists, args.num_iter).save(args.index)
+    else:
+        benchmark(W, IVFIndex.load(args.index), args.queries, args.topn, [int(x) for x in args.nprobe.split(',')])
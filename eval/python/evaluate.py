@@ -1,62 +1,97 @@
 import argparse
+import time
 import numpy as np
+from vectors_io import load_vectors
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--vocab_file', default='vocab.txt', type=str)
     parser.add_argument('--vectors_file', default='vectors.txt', type=str)
+    parser.add_argument('--method', default='add', choices=['add', 'mul'], help='3CosAdd or 3CosMul')
+    parser.add_argument('--memory_mb', default=1024, type=int, help='budget of the similarity blocks')
+    parser.add_argument('--benchmark', action='store_true', help='also time the original per-file loop')
     args = parser.parse_args()
 
-    with open(args.vocab_file, 'r') as f:
-        words = [x.rstrip().split(' ')[0] for x in f.readlines()]
-    with open(args.vectors_file, 'r') as f:
-        vectors = {}
-        for line in f:
-            vals = line.rstrip().split(' ')
-            vectors[vals[0]] = [float(x) for x in vals[1:]]
-
-    vocab_size = len(words)
-    vocab = {w: idx for idx, w in enumerate(words)}
-    ivocab = {idx: w for idx, w in enumerate(words)}
-
-    vector_dim = len(vectors[ivocab[0]])
-    W = np.zeros((vocab_size, vector_dim))
-    for word, v in vectors.items():
-        if word == '<unk>':
-            continue
-        W[vocab[word], :] = v
-
-    # normalize each word vector to unit length
-    W_norm = np.zeros(W.shape)
-    d = (np.sum(W ** 2, 1) ** (0.5))
-    W_norm = (W.T / d).T
-    evaluate_vectors(W_norm, vocab, ivocab)
-
-
-def evaluate_vectors(W, vocab, ivocab):
-    """Evaluate the trained word vectors on a variety of tasks"""
+    W_norm, vocab, ivocab = load_vectors(args.vectors_file, args.vocab_file)
+    if args.benchmark:
+        benchmark(W_norm, vocab, ivocab, args.memory_mb)
+    else:
+        evaluate_vectors(W_norm, vocab, ivocab, args.method, args.memory_mb)
+
 
-    filenames = [
-        'capital-common-countries.txt', 'capital-world.txt', 'currency.txt',
-        'city-in-state.txt', 'family.txt', 'gram1-adjective-to-adverb.txt',
-        'gram2-opposite.txt', 'gram3-comparative.txt', 'gram4-superlative.txt',
-        'gram5-present-participle.txt', 'gram6-nationality-adjective.txt',
-        'gram7-past-tense.txt', 'gram8-plural.txt', 'gram9-plural-verbs.txt',
-        ]
-    prefix = './eval/question-data/'
+filenames = [
+    'capital-common-countries.txt', 'capital-world.txt', 'currency.txt',
+    'city-in-state.txt', 'family.txt', 'gram1-adjective-to-adverb.txt',
+    'gram2-opposite.txt', 'gram3-comparative.txt', 'gram4-superlative.txt',
+    'gram5-present-participle.txt', 'gram6-nationality-adjective.txt',
+    'gram7-past-tense.txt', 'gram8-plural.txt', 'gram9-plural-verbs.txt',
+    ]
+prefix = './eval/question-data/'
+
+
+def read_questions(vocab):
+    # ([index array [n, 4] per file], number of questions including those with unknown words)
+    indices, full_count = [], 0
+    for i in range(len(filenames)):
+        with open('%s/%s' % (prefix, filenames[i]), 'r') as f:
+            full_data = [line.rstrip().split(' ') for line in f]
+            full_count += len(full_data)
+            data = [x for x in full_data if all(word in vocab for word in x)]
+        indices.append(np.array([[vocab[word] for word in row] for row in data], dtype=np.int64).reshape(-1, 4))
+    return indices, full_count
+
+
+def predict_batch(W, ind1, ind2, ind3, method='add'):
+    # one GEMM per batch, [batch, vocab] scores with the three query words masked
+    rows = np.arange(len(ind1))
+    if method == 'add':
+        pred_vec = W[ind2] - W[ind1] + W[ind3]
+        dist = np.dot(pred_vec, W.T)
+    else:
+        # 3CosMul (Levy and Goldberg, 2014) on cosines shifted to [0, 1]
+        sims = np.dot(np.concatenate([W[ind1], W[ind2], W[ind3]]), W.T)
+        sims += 1
+        sims *= 0.5
+        sim1, sim2, sim3 = np.split(sims, 3)
+        dist = sim2 * sim3
+        sim1 += 1e-3
+        dist /= sim1
+    dist[rows, ind1] = -np.inf
+    dist[rows, ind2] = -np.inf
+    dist[rows, ind3] = -np.inf
+    return np.argmax(dist, 1)
+
+
+def evaluate_vectors(W, vocab, ivocab, method='add', memory_mb=1024):
+    """Evaluate the trained word vectors on all question files in large float32 batches"""
+    W = np.asarray(W, dtype=np.float32)
+    indices, full_count = read_questions(vocab)
+    all_indices = np.concatenate(indices)
+    ind1, ind2, ind3, ind4 = all_indices.T
+
+    # float32 scores per question: 1 block for 3CosAdd, 3 blocks plus the product for 3CosMul
+    blocks = 2 if method == 'add' else 5
+    batch_size = max(1, int(memory_mb * (1 << 20) / (4 * blocks * W.shape[0])))
+    predictions = np.zeros(len(all_indices), dtype=np.int64)
+    for lo in range(0, len(all_indices), batch_size):
+        hi = lo + batch_size
+        predictions[lo: hi] = predict_batch(W, ind1[lo: hi], ind2[lo: hi], ind3[lo: hi], method)
+
+    bounds = np.cumsum([0] + [len(item) for item in indices])
+    report([(ind4 == predictions)[bounds[i]: bounds[i + 1]] for i in range(len(filenames))], full_count)
+    return predictions
+
+
+def evaluate_vectors_loop(W, vocab, ivocab):
+    """Evaluate the trained word vectors on a variety of tasks"""
 
     # to avoid memory overflow, could be increased/decreased
     # depending on system and vocab size
     split_size = 100
 
-    correct_sem = 0 # count correct semantic questions
-    correct_syn = 0 # count correct syntactic questions
-    correct_tot = 0 # count correct questions
-    count_sem = 0 # count all semantic questions
-    count_syn = 0 # count all syntactic questions
-    count_tot = 0 # count all questions
     full_count = 0 # count all questions, including those with unknown words
+    all_vals = []
 
     for i in range(len(filenames)):
         with open('%s/%s' % (prefix, filenames[i]), 'r') as f:
@@ -78,34 +113,65 @@ def evaluate_vectors(W, vocab, ivocab):
             dist = np.dot(W, pred_vec.T)
 
             for k in range(len(subset)):
-                dist[ind1[subset[k]], k] = -np.Inf
-                dist[ind2[subset[k]], k] = -np.Inf
-                dist[ind3[subset[k]], k] = -np.Inf
+                dist[ind1[subset[k]], k] = -np.inf
+                dist[ind2[subset[k]], k] = -np.inf
+                dist[ind3[subset[k]], k] = -np.inf
 
             # predicted word index
             predictions[subset] = np.argmax(dist, 0).flatten()
 
         val = (ind4 == predictions) # correct predictions
-        count_tot = count_tot + len(ind1)
+        all_vals.append(val)
+
+    report(all_vals, full_count)
+    return all_vals
+
+
+def report(all_vals, full_count):
+    correct_sem = 0 # count correct semantic questions
+    correct_syn = 0 # count correct syntactic questions
+    correct_tot = 0 # count correct questions
+    count_sem = 0 # count all semantic questions
+    count_syn = 0 # count all syntactic questions
+    count_tot = 0 # count all questions
+
+    for i, val in enumerate(all_vals):
+        count_tot = count_tot + len(val)
         correct_tot = correct_tot + sum(val)
         if i < 5:
-            count_sem = count_sem + len(ind1)
+            count_sem = count_sem + len(val)
             correct_sem = correct_sem + sum(val)
         else:
-            count_syn = count_syn + len(ind1)
+            count_syn = count_syn + len(val)
             correct_syn = correct_syn + sum(val)
 
         print("%s:" % filenames[i])
         print('ACCURACY TOP1: %.2f%% (%d/%d)' %
-            (np.mean(val) * 100, np.sum(val), len(val)))
+            (np.mean(val) * 100 if len(val) else 0, np.sum(val), len(val)))
 
     print('Questions seen/total: %.2f%% (%d/%d)' %
         (100 * count_tot / float(full_count), count_tot, full_count))
     print('Semantic accuracy: %.2f%%  (%i/%i)' %
-        (100 * correct_sem / float(count_sem), correct_sem, count_sem))
+        (100 * correct_sem / float(max(1, count_sem)), correct_sem, count_sem))
     print('Syntactic accuracy: %.2f%%  (%i/%i)' %
-        (100 * correct_syn / float(count_syn), correct_syn, count_syn))
-    print('Total accuracy: %.2f%%  (%i/%i)' % (100 * correct_tot / float(count_tot), correct_tot, count_tot))
+        (100 * correct_syn / float(max(1, count_syn)), correct_syn, count_syn))
+    print('Total accuracy: %.2f%%  (%i/%i)' % (100 * correct_tot / float(max(1, count_tot)), correct_tot, count_tot))
+
+
+def benchmark(W, vocab, ivocab, memory_mb=1024):
+    start = time.time()
+    loop_vals = evaluate_vectors_loop(W, vocab, ivocab)
+    loop_seconds = time.time() - start
+    results = []
+    for method in ['add', 'mul']:
+        start = time.time()
+        predictions = evaluate_vectors(W, vocab, ivocab, method, memory_mb)
+        results.append((method, time.time() - start, predictions))
+    print('per-file loop (split_size 100): %.2fs' % loop_seconds)
+    truth = np.concatenate([read_questions(vocab)[0][i][:, 3] for i in range(len(filenames))])
+    for method, seconds, predictions in results:
+        print('batched 3Cos%s: %.2fs (%.1fx), accuracy %.2f%%' %
+              (method.capitalize(), seconds, loop_seconds / seconds, 100 * np.mean(truth == predictions) if len(truth) else 0))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# Compressed export of unit length word vectors with search on the codes.
+#
+#   float16  2 bytes per dimension
+#   int8     1 byte per dimension, one symmetric scale per dimension
+#   pq       product quantization, 1 byte per sub-vector of dim / num_subspaces dimensions
+#
+# Scores are computed asymmetrically: the float32 query is compared with the codes directly (a lookup
+# table of query / centroid products for pq), so the full float matrix is never rebuilt. Rows keep the
+# order of the vectors_io.py cache, and with prefix P the export is
+#   P.codes.npy  the codes, memory-mapped on load
+#   P.book.npy   the int8 scales or the pq codebooks [num_subspaces, 256, sub_dim]
+#   P.vocab      one word per line
+#   P.meta       json with the kind and sizes
+#
+#   python eval/python/quantize.py --vectors_file vectors.txt --vocab_file vocab.txt --kind pq --num_subspaces 50
+import argparse
+import codecs
+import json
+import os
+import sys
+import time
+import numpy as np
+from vectors_io import load_vectors
+
+CHUNK_ROWS = 1 << 16
+
+
+def kmeans(X, k, num_iter=15, seed=1234):
+    rng = np.random.RandomState(seed)
+    centroids = X[rng.choice(X.shape[0], k, replace=X.shape[0] < k)].copy()
+    for it in range(num_iter):
+        labels = nearest(X, centroids)
+        order = np.argsort(labels, kind='stable')
+        counts = np.bincount(labels, minlength=k)
+        empty = counts == 0
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[~empty]
+        centroids[~empty] = np.add.reduceat(X[order], starts) / counts[~empty, None]
+        centroids[empty] = X[rng.choice(X.shape[0], int(empty.sum()))]
+    return centroids
+
+
+def nearest(X, centroids):
+    # argmin of the squared euclidean distance, without the constant |x|^2
+    return np.argmin(np.einsum('ij,ij->i', centroids, centroids)[None, :] - 2 * np.dot(X, centroids.T), 1)
+
+
+class QuantizedVectors(object):
+    def __init__(self, kind, codes, book=None, words=None):
+        self.kind, self.codes, self.book, self.words = kind, codes, book, words
+        self.vocab = {w: idx for idx, w in enumerate(words)} if words is not None else None
+
+    @classmethod
+    def train(cls, W, kind='pq', num_subspaces=0, sample_size=1 << 16, num_iter=15, seed=1234, words=None):
+        start = time.time()
+        if kind == 'float16':
+            codes = np.empty(W.shape, dtype=np.float16)
+            for lo in range(0, W.shape[0], CHUNK_ROWS):
+                codes[lo: lo + CHUNK_ROWS] = W[lo: lo + CHUNK_ROWS]
+            res = cls(kind, codes, np.zeros(0, np.float32), words)
+        elif kind == 'int8':
+            scale = np.zeros(W.shape[1], dtype=np.float32)
+            for lo in range(0, W.shape[0], CHUNK_ROWS):
+                scale = np.maximum(scale, np.abs(W[lo: lo + CHUNK_ROWS]).max(0))
+            scale = np.where(scale > 0, scale / 127, 1).astype(np.float32)
+            codes = np.empty(W.shape, dtype=np.int8)
+            for lo in range(0, W.shape[0], CHUNK_ROWS):
+                codes[lo: lo + CHUNK_ROWS] = np.clip(np.rint(W[lo: lo + CHUNK_ROWS] / scale), -127, 127)
+            res = cls(kind, codes, scale, words)
+        elif kind == 'pq':
+            num_subspaces = num_subspaces or max(1, W.shape[1] // 4)
+            if W.shape[1] % num_subspaces:
+                raise ValueError('dim %d is not divisible by %d subspaces' % (W.shape[1], num_subspaces))
+            sub_dim = W.shape[1] // num_subspaces
+            rng = np.random.RandomState(seed)
+            sample = np.asarray(W[np.sort(rng.choice(W.shape[0], min(sample_size, W.shape[0]), replace=False))], dtype=np.float32)
+            book = np.stack([kmeans(sample[:, m * sub_dim: (m + 1) * sub_dim], 256, num_iter, seed + m)
+                             for m in range(num_subspaces)]).astype(np.float32)
+            codes = np.empty((W.shape[0], num_subspaces), dtype=np.uint8)
+            for lo in range(0, W.shape[0], CHUNK_ROWS):
+                chunk = np.asarray(W[lo: lo + CHUNK_ROWS], dtype=np.float32)
+                for m in range(num_subspaces):
+                    codes[lo: lo + CHUNK_ROWS, m] = nearest(chunk[:, m * sub_dim: (m + 1) * sub_dim], book[m])
+            res = cls(kind, codes, book, words)
+        else:
+            raise ValueError('unknown quantization %s' % kind)
+        print('trained %s codes for %d vectors in %.1fs' % (kind, W.shape[0], time.time() - start))
+        return res
+
+    def save(self, prefix):
+        np.save(prefix + '.codes.npy', self.codes)
+        np.save(prefix + '.book.npy', self.book)
+        if self.words is not None:
+            with codecs.open(prefix + '.vocab', 'w', 'utf-8') as f:
+                f.write(''.join(w + '\n' for w in self.words))
+        with open(prefix + '.meta', 'w') as f:
+            json.dump({'kind': self.kind, 'num_vectors': len(self.codes), 'dim': self.dim()}, f)
+
+    @classmethod
+    def load(cls, prefix):
+        with open(prefix + '.meta') as f:
+            meta = json.load(f)
+        words = None
+        if os.path.exists(prefix + '.vocab'):
+            with codecs.open(prefix + '.vocab', 'r', 'utf-8') as f:
+                words = [line.rstrip('\n') for line in f]
+        return cls(meta['kind'], np.load(prefix + '.codes.npy', mmap_mode='r'), np.load(prefix + '.book.npy'), words)
+
+    def dim(self):
+        return self.book.shape[0] * self.book.shape[2] if self.kind == 'pq' else self.codes.shape[1]
+
+    def nbytes(self):
+        return self.codes.nbytes + self.book.nbytes
+
+    def decode(self, ids):
+        codes = np.asarray(self.codes[ids])
+        if self.kind == 'float16':
+            return codes.astype(np.float32)
+        if self.kind == 'int8':
+            return codes.astype(np.float32) * self.book
+        return self.book[np.arange(self.book.shape[0]), codes].reshape(len(codes), -1)
+
+    def scores(self, Q):
+        # [num_queries, num_vectors] float32 inner products of float queries with the codes
+        Q = np.atleast_2d(np.asarray(Q, dtype=np.float32))
+        out = np.empty((Q.shape[0], len(self.codes)), dtype=np.float32)
+        if self.kind == 'pq':
+            num_subspaces = self.book.shape[0]
+            tables = np.einsum('bmd,mkd->bmk', Q.reshape(Q.shape[0], num_subspaces, -1), self.book)
+        else:
+            Q = Q * self.book if self.kind == 'int8' else Q
+        for lo in range(0, len(self.codes), CHUNK_ROWS):
+            codes = np.asarray(self.codes[lo: lo + CHUNK_ROWS])
+            if self.kind == 'pq':
+                chunk = tables[:, 0, codes[:, 0]]
+                for m in range(1, num_subspaces):
+                    chunk += tables[:, m, codes[:, m]]
+                out[:, lo: lo + len(codes)] = chunk
+            else:
+                out[:, lo: lo + len(codes)] = np.dot(Q, codes.astype(np.float32).T)
+        return out
+
+    def most_similar(self, vec, topn=10, exclude=()):
+        scores = self.scores(vec)[0]
+        if len(exclude):
+            scores[list(exclude)] = -np.inf
+        top = np.argpartition(-scores, min(topn, len(scores)) - 1)[:topn]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+
+def analogy_accuracy(score_fn, decode_fn, indices, batch_size=256):
+    # 3CosAdd top-1 accuracy of [n, 4] question ids, query vectors from decode_fn
+    correct = 0
+    for lo in range(0, len(indices), batch_size):
+        ind1, ind2, ind3, ind4 = indices[lo: lo + batch_size].T
+        dist = score_fn(decode_fn(ind2) - decode_fn(ind1) + decode_fn(ind3))
+        rows = np.arange(len(ind1))
+        dist[rows, ind1] = dist[rows, ind2] = dist[rows, ind3] = -np.inf
+        correct += int(np.sum(np.argmax(dist, 1) == ind4))
+    return correct / float(max(1, len(indices)))
+
+
+def report(W, vocab, quantized, num_queries=200, topn=10, seed=1234):
+    W = np.asarray(W, dtype=np.float32)
+    print('%s: %.1f MB vs %.1f MB float32 (%.1fx smaller)' %
+          (quantized.kind, quantized.nbytes() / 1048576.0, W.nbytes / 1048576.0, W.nbytes / float(quantized.nbytes())))
+    queries = np.random.RandomState(seed).choice(W.shape[0], min(num_queries, W.shape[0]), replace=False)
+    start = time.time()
+    exact = [set(np.argpartition(-np.dot(W, W[q]), topn)[:topn + 1].tolist()) - {q} for q in queries]
+    exact_ms = (time.time() - start) * 1000 / len(queries)
+    start = time.time()
+    approx = [set(i for i, _ in quantized.most_similar(W[q], topn, (q,))) for q in queries]
+    ms = (time.time() - start) * 1000 / len(queries)
+    recall = np.mean([len(e & a) / float(len(e)) for e, a in zip(exact, approx)])
+    print('query latency %.3f ms vs %.3f ms exact, recall@%d %.4f' % (ms, exact_ms, topn, recall))
+
+    try:
+        from evaluate import read_questions
+        indices = np.concatenate(read_questions(vocab)[0])
+    except IOError:
+        print('no question files, skipping the analogy accuracy')
+        sys.stdout.flush()
+        return
+    exact_acc = analogy_accuracy(lambda Q: np.dot(Q, W.T), lambda ids: W[ids], indices)
+    quant_acc = analogy_accuracy(quantized.scores, quantized.decode, indices)
+    print('analogy accuracy %.2f%% vs %.2f%% float32 (%.2f points lost) on %d questions' %
+          (100 * quant_acc, 100 * exact_acc, 100 * (exact_acc - quant_acc), len(indices)))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab_file', default='', type=str)
+    parser.add_argument('--vectors_file', default='vectors.txt', type=str)
+    parser.add_argument('--kind', default='pq', choices=['pq', 'int8', 'float16'])
+    parser.add_argument('--num_subspaces', default=0, type=int, help='pq sub-vectors, default dim / 4')
+    parser.add_argument('--output', default='', type=str, help='default <vectors_file>.<kind>')
+    parser.add_argument('--no_report', action='store_true')
+    args = parser.parse_args()
+
+    W, vocab, ivocab = load_vectors(args.vectors_file, args.vocab_file)
+    quantized = QuantizedVectors.train(W, args.kind, args.num_subspaces, words=ivocab)
+    quantized.save(args.output or '%s.%s' % (args.vectors_file, args.kind))
+    if not args.no_report:
+        report(W, vocab, quantized)
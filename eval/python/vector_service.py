@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+# Local similarity service over memory-mapped word vectors.
+#
+# Every model is loaded once through vectors_io.py. Requests are JSON lines over a TCP port on localhost
+# or a Unix socket, one response line per request:
+#   {"op": "most_similar", "model": "mlm", "words": ["ice"], "topn": 10}     sum of the words as query
+#   {"op": "analogy", "model": "mlm", "words": ["man", "king", "woman"]}     king - man + woman
+#   {"op": "similarity", "model": "mlm", "words": ["ice", "water"]}
+#   {"op": "stats"}
+# Concurrent requests of a model are collected for up to --max_wait_ms (at most --max_batch of them) and
+# answered with one matrix product in a worker thread.
+#
+#   python eval/python/vector_service.py serve --vectors mlm=mlm.vectors.txt,glove=glove.vectors.txt --port 8765
+#   python eval/python/vector_service.py bench --vectors mlm=mlm.vectors.txt --clients 32 --requests 200
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import deque
+import numpy as np
+from vectors_io import load_vectors
+
+
+class Counters(object):
+    def __init__(self, window=10000):
+        self.start = time.time()
+        self.requests, self.errors, self.batches, self.batched = 0, 0, 0, 0
+        self.latencies = deque(maxlen=window)
+
+    def add_batch(self, size):
+        self.batches += 1
+        self.batched += size
+
+    def add_request(self, seconds, error=False):
+        self.requests += 1
+        self.errors += int(error)
+        self.latencies.append(seconds)
+
+    def snapshot(self):
+        lat = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        elapsed = time.time() - self.start
+        return {'requests': self.requests, 'errors': self.errors, 'batches': self.batches,
+                'mean_batch': self.batched / float(max(1, self.batches)), 'qps': self.requests / elapsed,
+                'p50_ms': float(np.percentile(lat, 50)), 'p99_ms': float(np.percentile(lat, 99)),
+                'uptime_s': elapsed}
+
+
+class Batcher(object):
+    # micro-batches the requests of one model
+    def __init__(self, W, vocab, ivocab, counters, max_batch=64, max_wait_ms=2.0):
+        self.W, self.vocab, self.ivocab = W, vocab, ivocab
+        self.counters = counters
+        self.max_batch, self.max_wait = max_batch, max_wait_ms / 1000.0
+        self.queue = asyncio.Queue()
+
+    async def submit(self, request):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((request, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.counters.add_batch(len(batch))
+            try:
+                results = await loop.run_in_executor(None, self.answer, [request for request, _ in batch])
+            except Exception as e:
+                results = [{'error': repr(e)}] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def answer(self, requests):
+        results = [None] * len(requests)
+        queries, query_pos, pairs, pair_pos = [], [], [], []
+        for pos, request in enumerate(requests):
+            words = request.get('words', [])
+            missing = [w for w in words if w not in self.vocab]
+            if missing or not words:
+                results[pos] = {'error': 'unknown words: %s' % ' '.join(missing) if missing else 'no words'}
+                continue
+            ids = [self.vocab[w] for w in words]
+            op = request.get('op')
+            if op == 'similarity' and len(ids) == 2:
+                pairs.append(ids)
+                pair_pos.append(pos)
+            elif op == 'most_similar' or (op == 'analogy' and len(ids) == 3):
+                queries.append(ids)
+                query_pos.append(pos)
+            else:
+                results[pos] = {'error': 'bad request'}
+
+        if pairs:
+            pairs = np.array(pairs)
+            sims = np.einsum('ij,ij->i', self.W[pairs[:, 0]], self.W[pairs[:, 1]])
+            for pos, sim in zip(pair_pos, sims.tolist()):
+                results[pos] = {'similarity': sim}
+
+        if queries:
+            Q = np.empty((len(queries), self.W.shape[1]), dtype=np.float32)
+            for row, (ids, pos) in enumerate(zip(queries, query_pos)):
+                if requests[pos]['op'] == 'analogy':
+                    Q[row] = self.W[ids[1]] - self.W[ids[0]] + self.W[ids[2]]
+                else:
+                    Q[row] = self.W[ids].sum(0)
+            Q /= np.maximum(np.linalg.norm(Q, axis=1, keepdims=True), 1e-12)
+            dist = np.dot(Q, self.W.T)
+            for row, (ids, pos) in enumerate(zip(queries, query_pos)):
+                topn = min(int(requests[pos].get('topn', 10)), dist.shape[1] - len(ids))
+                scores = dist[row]
+                scores[ids] = -np.inf
+                top = np.argpartition(-scores, topn - 1)[:topn]
+                top = top[np.argsort(-scores[top])]
+                results[pos] = {'most_similar': [[self.ivocab[i], float(scores[i])] for i in top]}
+        return results
+
+
+def check_request(request):
+    # malformed fields are answered here, before they can fail a whole batch of other clients' requests
+    if not isinstance(request, dict):
+        return 'request must be a JSON object'
+    words = request.get('words', [])
+    if not isinstance(words, list) or not all(isinstance(w, str) for w in words):
+        return 'words must be a list of strings'
+    if not isinstance(request.get('model', ''), str):
+        return 'model must be a string'
+    topn = request.get('topn', 10)
+    if isinstance(topn, bool) or int(topn) < 1:  # int() raises ValueError / TypeError
+        return 'topn must be a positive integer'
+    return None
+
+
+class Service(object):
+    def __init__(self, models, max_batch=64, max_wait_ms=2.0):
+        self.counters = Counters()
+        self.batchers = {name: Batcher(W, vocab, ivocab, self.counters, max_batch, max_wait_ms)
+                         for name, (W, vocab, ivocab) in models.items()}
+        self.default = next(iter(self.batchers))
+        self.clients = 0
+
+    async def handle_request(self, request):
+        error = check_request(request)
+        if error:
+            return {'error': error}
+        if request.get('op') == 'stats':
+            return dict(self.counters.snapshot(), models=sorted(self.batchers))
+        batcher = self.batchers.get(request.get('model', self.default))
+        if batcher is None:
+            return {'error': 'unknown model %s' % request.get('model')}
+        return await batcher.submit(request)
+
+    async def handle_client(self, reader, writer):
+        self.clients += 1
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            start = time.time()
+            try:
+                response = await self.handle_request(json.loads(line))
+            except (ValueError, KeyError, TypeError) as e:
+                response = {'error': '%s: %s' % (type(e).__name__, e)}
+            self.counters.add_request(time.time() - start, 'error' in response)
+            writer.write((json.dumps(response) + '\n').encode('utf-8'))
+            await writer.drain()
+        writer.close()
+        self.clients -= 1
+
+    async def start(self, port=0, socket_path=''):
+        for batcher in self.batchers.values():
+            asyncio.ensure_future(batcher.run())
+        if socket_path:
+            return await asyncio.start_unix_server(self.handle_client, path=socket_path)
+        return await asyncio.start_server(self.handle_client, '127.0.0.1', port)
+
+
+async def open_client(port=0, socket_path=''):
+    if socket_path:
+        return await asyncio.open_unix_connection(socket_path)
+    return await asyncio.open_connection('127.0.0.1', port)
+
+
+async def load_generator(port, socket_path, words, model, num_clients=32, num_requests=200, seed=1234):
+    # num_clients connections, each sending num_requests requests one after the other
+    rng = np.random.RandomState(seed)
+    ops = ['most_similar', 'analogy', 'similarity']
+    latencies = []
+
+    async def client(client_id):
+        reader, writer = await open_client(port, socket_path)
+        for _ in range(num_requests):
+            op = ops[rng.randint(len(ops))]
+            request = {'op': op, 'model': model, 'topn': 10,
+                       'words': [words[i] for i in rng.choice(len(words), {'most_similar': 1, 'analogy': 3, 'similarity': 2}[op])]}
+            start = time.time()
+            writer.write((json.dumps(request) + '\n').encode('utf-8'))
+            await writer.drain()
+            await reader.readline()
+            latencies.append(time.time() - start)
+        writer.close()
+        await writer.wait_closed()
+
+    start = time.time()
+    await asyncio.gather(*[client(i) for i in range(num_clients)])
+    elapsed = time.time() - start
+    lat = np.array(latencies) * 1000
+    print('%d clients x %d requests: %.1f requests/s, latency p50 %.2f ms, p99 %.2f ms' %
+          (num_clients, num_requests, len(latencies) / elapsed, np.percentile(lat, 50), np.percentile(lat, 99)))
+    reader, writer = await open_client(port, socket_path)
+    writer.write(b'{"op": "stats"}\n')
+    print('server:', (await reader.readline()).decode('utf-8').strip())
+    writer.close()
+    await writer.wait_closed()
+    sys.stdout.flush()
+
+
+def load_models(spec, vocab_file=''):
+    # 'name=path,name=path' (or a single path)
+    models = {}
+    for item in spec.split(','):
+        name, path = item.split('=', 1) if '=' in item else ('default', item)
+        models[name] = load_vectors(path, vocab_file)
+    return models
+
+
+async def main(args):
+    service = Service(load_models(args.vectors, args.vocab_file), args.max_batch, args.max_wait_ms)
+    server = await service.start(args.port, args.socket)
+    port = server.sockets[0].getsockname()[1] if not args.socket else 0
+    print('serving %s on %s' % (', '.join(sorted(service.batchers)), args.socket or '127.0.0.1:%d' % port))
+    sys.stdout.flush()
+    if args.command == 'bench':
+        batcher = service.batchers[service.default]
+        words = batcher.ivocab[:min(len(batcher.ivocab), 50000)]
+        await load_generator(port, args.socket, words, service.default, args.clients, args.requests)
+        server.close()
+        while service.clients:
+            await asyncio.sleep(0.01)
+    else:
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['serve', 'bench'])
+    parser.add_argument('--vectors', default='vectors.txt', type=str, help='name=path,... of the models')
+    parser.add_argument('--vocab_file', default='', type=str)
+    parser.add_argument('--port', default=8765, type=int)
+    parser.add_argument('--socket', default='', type=str, help='Unix socket path instead of the TCP port')
+    parser.add_argument('--max_batch', default=64, type=int)
+    parser.add_argument('--max_wait_ms', default=2.0, type=float)
+    parser.add_argument('--clients', default=32, type=int)
+    parser.add_argument('--requests', default=200, type=int)
+    args = parser.parse_args()
+    asyncio.run(main(args))
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+# Word vector loading shared by the eval scripts and src/visulization.py.
+#
+# The text output of glove.c (optionally with the word2vec '<vocab> <dim>' header) or its -binary output
+# (float64 word and context rows with biases, needs the vocab file) is converted once into a float32
+# '<vectors>.f32.npy' matrix plus a '<vectors>.f32.vocab' word list; the unit length copy used by the
+# evaluations is cached next to it as '<vectors>.f32.norm.npy'. Later loads only memory-map the cache.
+# '<vectors>.f32.meta' records the vocab file (path, mtime, sha1) and -model the cache was built with; the cache
+# is rebuilt when the vectors file is newer or any of them differs.
+#
+#   python eval/python/vectors_io.py --vectors_file vectors.txt [--vocab_file vocab.txt]
+import argparse
+import codecs
+import hashlib
+import json
+import os
+import sys
+import time
+import numpy as np
+
+CHUNK_ROWS = 1 << 16
+
+
+def read_words(vocab_file):
+    with codecs.open(vocab_file, 'r', 'utf-8') as f:
+        return [x.rstrip().split(' ')[0] for x in f]
+
+
+def count_lines(path):
+    with open(path, 'rb') as f:
+        return sum(block.count(b'\n') for block in iter(lambda: f.read(1 << 24), b''))
+
+
+def has_header(first_line):
+    parts = first_line.split()
+    return len(parts) == 2 and parts[0].isdigit() and parts[1].isdigit()
+
+
+def text_to_npy(vectors_file, npy_path, words=None):
+    # rows follow the vocab file when given (missing words stay zero), else the vectors file; <unk> is skipped
+    with codecs.open(vectors_file, 'r', 'utf-8') as f:
+        first = f.readline()
+        header = has_header(first)
+        if header:
+            first = f.readline()
+        dim = len(first.rstrip().split(' ')) - 1
+    num_rows = len(words) if words is not None else count_lines(vectors_file) - int(header)
+    vocab = {w: idx for idx, w in enumerate(words)} if words is not None else None
+    W = np.lib.format.open_memmap(npy_path, mode='w+', dtype=np.float32, shape=(num_rows, dim))
+    file_words = []
+
+    def flush(rows, rests):
+        if rests:
+            W[rows] = np.fromstring(' '.join(rests), dtype=np.float32, sep=' ').reshape(len(rests), dim)
+
+    with codecs.open(vectors_file, 'r', 'utf-8') as f:
+        if header:
+            f.readline()
+        rows, rests = [], []
+        for line in f:
+            parts = line.rstrip().split(' ', 1)
+            if len(parts) < 2 or parts[0] == '<unk>':  # blank or word-only lines have no vector
+                continue
+            word, rest = parts
+            if vocab is None:
+                rows.append(len(file_words))
+                file_words.append(word)
+            elif word in vocab:
+                rows.append(vocab[word])
+            else:
+                continue
+            rests.append(rest)
+            if len(rests) >= CHUNK_ROWS:
+                flush(rows, rests)
+                rows, rests = [], []
+        flush(rows, rests)
+    W.flush()
+    del W
+    if words is None:
+        words = file_words
+        if len(words) < num_rows:  # trailing <unk> or empty lines
+            shrink_npy(npy_path, len(words))
+    return words
+
+
+def shrink_npy(npy_path, num_rows):
+    W = np.load(npy_path, mmap_mode='r')
+    tmp_path = npy_path + '.tmp'
+    out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=W.dtype, shape=(num_rows, W.shape[1]))
+    for lo in range(0, num_rows, CHUNK_ROWS):
+        out[lo: lo + CHUNK_ROWS] = W[lo: min(lo + CHUNK_ROWS, num_rows)]
+    out.flush()
+    del W, out
+    os.replace(tmp_path, npy_path)
+
+
+def binary_to_npy(vectors_file, npy_path, words, model=2):
+    # glove.c -binary: [2 * vocab_size, vector_size + 1] float64, word rows then context rows
+    vocab_size = len(words)
+    params = np.memmap(vectors_file, dtype=np.float64, mode='r')
+    params = params.reshape(2 * vocab_size, -1)
+    dim = params.shape[1] - 1
+    out_dim = 2 * (dim + 1) if model == 0 else dim
+    W = np.lib.format.open_memmap(npy_path, mode='w+', dtype=np.float32, shape=(vocab_size, out_dim))
+    for lo in range(0, vocab_size, CHUNK_ROWS):
+        hi = min(lo + CHUNK_ROWS, vocab_size)
+        if model == 0:
+            W[lo: hi] = np.hstack([params[lo: hi], params[vocab_size + lo: vocab_size + hi]])
+        elif model == 1:
+            W[lo: hi] = params[lo: hi, :dim]
+        else:
+            W[lo: hi] = params[lo: hi, :dim] + params[vocab_size + lo: vocab_size + hi, :dim]
+    W.flush()
+    del W
+    return words
+
+
+def normalize_rows(W):
+    # unit length rows in place, a chunk of rows at a time; all-zero rows stay zero
+    for lo in range(0, W.shape[0], CHUNK_ROWS):
+        chunk = W[lo: lo + CHUNK_ROWS]
+        d = np.sqrt(np.einsum('ij,ij->i', chunk, chunk))
+        d[d == 0] = 1
+        chunk /= d[:, None]
+    return W
+
+
+def is_fresh(path, source):
+    return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(source)
+
+
+def file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 24), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def cache_meta(vectors_file, vocab_file, model):
+    # what the cache depends on besides the vectors file itself
+    meta = {'vocab_file': os.path.abspath(vocab_file) if vocab_file else '', 'vocab_mtime': 0.0, 'vocab_sha1': '',
+            'model': model if vectors_file.endswith('.bin') else None}
+    if vocab_file:
+        meta.update(vocab_mtime=os.path.getmtime(vocab_file), vocab_sha1=file_sha1(vocab_file))
+    return meta
+
+
+def read_meta(meta_path):
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        return json.load(f)
+
+
+def load_vectors(vectors_file, vocab_file='', normalize=True, model=2):
+    # -> (W float32 [vocab_size, dim] read-only memmap, vocab {word: row}, ivocab [word])
+    npy_path = vectors_file + '.f32.npy'
+    words_path = vectors_file + '.f32.vocab'
+    norm_path = vectors_file + '.f32.norm.npy'
+    meta_path = vectors_file + '.f32.meta'
+    start = time.time()
+    meta = cache_meta(vectors_file, vocab_file, model)
+    if not (is_fresh(npy_path, vectors_file) and is_fresh(words_path, vectors_file) and read_meta(meta_path) == meta):
+        words = read_words(vocab_file) if vocab_file else None
+        if vectors_file.endswith('.bin'):
+            if words is None:
+                raise ValueError('binary vectors %s need a vocab file' % vectors_file)
+            words = binary_to_npy(vectors_file, npy_path, words, model)
+        else:
+            words = text_to_npy(vectors_file, npy_path, words)
+        with codecs.open(words_path, 'w', 'utf-8') as f:
+            f.write(''.join(w + '\n' for w in words))
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+        if os.path.exists(norm_path):
+            os.remove(norm_path)
+        print('converted %s to %s in %.1fs' % (vectors_file, npy_path, time.time() - start))
+    if normalize and not is_fresh(norm_path, npy_path):
+        W = np.load(npy_path, mmap_mode='r')
+        W_norm = np.lib.format.open_memmap(norm_path, mode='w+', dtype=np.float32, shape=W.shape)
+        for lo in range(0, W.shape[0], CHUNK_ROWS):
+            W_norm[lo: lo + CHUNK_ROWS] = W[lo: lo + CHUNK_ROWS]
+        normalize_rows(W_norm).flush()
+        del W, W_norm
+
+    W = np.load(norm_path if normalize else npy_path, mmap_mode='r')
+    ivocab = read_words(words_path)
+    vocab = {w: idx for idx, w in enumerate(ivocab)}
+    print('loaded %d x %d vectors in %.2fs' % (W.shape[0], W.shape[1], time.time() - start))
+    sys.stdout.flush()
+    return W, vocab, ivocab
+
+
+class Vectors(object):
+    # the small part of gensim's KeyedVectors used by src/visulization.py
+    def __init__(self, W, vocab, ivocab):
+        self.W, self.vocab, self.ivocab = W, vocab, ivocab
+        self._norms = None
+
+    @classmethod
+    def load(cls, vectors_file, vocab_file='', normalize=False):
+        return cls(*load_vectors(vectors_file, vocab_file, normalize))
+
+    def norms(self):
+        if self._norms is None:
+            self._norms = np.concatenate([np.sqrt(np.einsum('ij,ij->i', self.W[lo: lo + CHUNK_ROWS], self.W[lo: lo + CHUNK_ROWS]))
+                                          for lo in range(0, self.W.shape[0], CHUNK_ROWS)])
+            self._norms[self._norms == 0] = 1
+        return self._norms
+
+    def __contains__(self, word):
+        return word in self.vocab
+
+    def __getitem__(self, word):
+        return np.asarray(self.W[self.vocab[word]])
+
+    def __len__(self):
+        return len(self.ivocab)
+
+    def similarity(self, word1, word2):
+        v1, v2 = self[word1], self[word2]
+        return float(np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2)))
+
+    def most_similar(self, word, topn=10):
+        idx = self.vocab[word]
+        dist = np.dot(self.W, self.W[idx]) / (self.norms() * self.norms()[idx])
+        dist[idx] = -np.inf
+        top = np.argpartition(-dist, topn)[:topn]
+        top = top[np.argsort(-dist[top])]
+        return [(self.ivocab[i], float(dist[i])) for i in top]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab_file', default='', type=str)
+    parser.add_argument('--vectors_file', default='vectors.txt', type=str)
+    parser.add_argument('--model', default=2, type=int, help='for glove.c -binary output, same as its -model')
+    args = parser.parse_args()
+    load_vectors(args.vectors_file, args.vocab_file, True, args.model)
@@ -1,40 +1,23 @@
 import argparse
 import numpy as np
 import sys
+from vectors_io import load_vectors
+from ann_index import IVFIndex
 
 def generate():
     parser = argparse.ArgumentParser()
     parser.add_argument('--vocab_file', default='vocab.txt', type=str)
     parser.add_argument('--vectors_file', default='vectors.txt', type=str)
+    parser.add_argument('--index', default='', type=str, help='IVF index of ann_index.py for approximate search')
+    parser.add_argument('--nprobe', default=16, type=int)
     args = parser.parse_args()
 
-    with open(args.vocab_file, 'r') as f:
-        words = [x.rstrip().split(' ')[0] for x in f.readlines()]
-    with open(args.vectors_file, 'r') as f:
-        vectors = {}
-        for line in f:
-            vals = line.rstrip().split(' ')
-            vectors[vals[0]] = [float(x) for x in vals[1:]]
+    W, vocab, ivocab = load_vectors(args.vectors_file, args.vocab_file)
+    index = IVFIndex.load(args.index) if args.index else None
+    return (W, vocab, ivocab, index, args.nprobe)
 
-    vocab_size = len(words)
-    vocab = {w: idx for idx, w in enumerate(words)}
-    ivocab = {idx: w for idx, w in enumerate(words)}
 
-    vector_dim = len(vectors[ivocab[0]])
-    W = np.zeros((vocab_size, vector_dim))
-    for word, v in vectors.items():
-        if word == '<unk>':
-            continue
-        W[vocab[word], :] = v
-
-    # normalize each word vector to unit variance
-    W_norm = np.zeros(W.shape)
-    d = (np.sum(W ** 2, 1) ** (0.5))
-    W_norm = (W.T / d).T
-    return (W_norm, vocab, ivocab)
-
-
-def distance(W, vocab, ivocab, input_term):
+def distance(W, vocab, ivocab, input_term, index=None, nprobe=16):
     vecs = {}
     if len(input_term.split(' ')) < 3:
         print("Only %i words were entered.. three words are needed at the input to perform the calculation\n" % len(input_term.split(' ')))
@@ -54,27 +37,29 @@ def distance(W, vocab, ivocab, input_term):
         d = (np.sum(vec_result ** 2,) ** (0.5))
         vec_norm = (vec_result.T / d).T
 
-        dist = np.dot(W, vec_norm.T)
-
-        for term in input_term.split(' '):
-            index = vocab[term]
-            dist[index] = -np.Inf
-
-        a = np.argsort(-dist)[:N]
+        exclude = [vocab[term] for term in input_term.split(' ')]
+        if index is not None:
+            top = index.most_similar(vec_norm, N, nprobe, exclude)
+        else:
+            dist = np.dot(W, vec_norm.T)
+            dist[exclude] = -np.inf
+            a = np.argpartition(-dist, min(N, len(dist)) - 1)[:N]
+            a = a[np.argsort(-dist[a])]
+            top = [(x, dist[x]) for x in a]
 
         print("\n                               Word       Cosine distance\n")
         print("---------------------------------------------------------\n")
-        for x in a:
-            print("%35s\t\t%f\n" % (ivocab[x], dist[x]))
+        for x, score in top:
+            print("%35s\t\t%f\n" % (ivocab[x], score))
 
 
 if __name__ == "__main__":
     N = 100;          # number of closest words that will be shown
-    W, vocab, ivocab = generate()
+    W, vocab, ivocab, index, nprobe = generate()
     while True:
         input_term = raw_input("\nEnter three words (EXIT to break): ")
         if input_term == 'EXIT':
             break
         else:
-            distance(W, vocab, ivocab, input_term)
+            distance(W, vocab, ivocab, input_term, index, nprobe)
 
@@ -0,0 +1,502 @@
+# -*- coding: utf-8 -*-
+# Micro benchmarks on synthetic data.
+#
+#   python src/benchmark.py --task reader --workers 1,2,4,8
+#   python src/benchmark.py --task compress --levels 1,6,9 --threads 1,4
+#   python src/benchmark.py --task pipeline --sentences 2000 --json pipeline.json
+#   python src/benchmark.py --task worker --shards 8 --sentences 500
+#   python src/benchmark.py --task static_graph --sentences 2000 --buckets 32,64,128
+#   python src/benchmark.py --task san_layers --sentences 1000 --layers 6 --layer_ranges 0-2,0-3,3-5
+#
+# The pipeline task needs no checkpoint or network: it writes a synthetic corpus, a GloVe vocab and a wordpiece vocab
+# and times every stage of bert_cooccur_mindspore.py with a tiny randomly initialized BertConfig model on CPU, then the
+# eval scripts on random vectors (the eval task runs only the latter). The worker task compares the per-shard overhead
+# of one run per shard (process start-up, model load and warm-up every time) with model_worker.py, which loads the
+# model once and prefetches the next shard. The static_graph task times the dynamic forward + TopK against the
+# bucketed compiled one of static_graph.py (compile seconds per bucket, steady state, break-even batches). The
+# san_layers task runs the banded SAN dump and aggregation with all layers and with every --layer_ranges range, and
+# reports the speedup with the pair overlap, top contexts overlap and Spearman correlation against the full depth.
+# --json writes the results with the settings.
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import block_io
+import parallel_reader
+import san_layers
+
+
+def timeit(fn, *args, **kwargs):
+    start = time.time()
+    res = fn(*args, **kwargs)
+    return time.time() - start, res
+
+
+def synthetic_words(num_words, seed=1234):
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    return ['%s%d' % (''.join(rng.choice(letters) for _ in range(rng.randint(2, 8))), idx) for idx in range(num_words)]
+
+
+def write_synthetic_coo(path, num_lines, vocab_size=20000, seed=1234):
+    rng = random.Random(seed)
+    words = synthetic_words(vocab_size, seed)
+    with open(path, 'w') as fout:
+        for _ in range(num_lines):
+            fout.write('%s\t%s\t%.8f\n' % (words[min(int(rng.paretovariate(1.0)) - 1, vocab_size - 1)],
+                                         words[rng.randrange(vocab_size)], rng.random()))
+    return path
+
+
+def write_synthetic_mlm_dump(path, num_sentences, top_k=11, vocab_size=5000, seed=1234):
+    rng = random.Random(seed)
+    words = synthetic_words(vocab_size, seed)
+    with open(path, 'w') as fout:
+        for _ in range(num_sentences):
+            sentence = [rng.choice(words) for _ in range(rng.randint(5, 40))]
+            fout.write('###' + ' '.join(sentence) + '\n')
+            for token in sentence:
+                scores = sorted((rng.uniform(0, 20) for _ in range(top_k)), reverse=True)
+                fout.write(token + ' ' + ' '.join('%s:%s' % (rng.choice(words), score) for score in scores) + '\n')
+    return path
+
+
+def write_synthetic_san_dump(path, num_sentences, vocab_size=5000, seed=1234):
+    rng = random.Random(seed)
+    words = synthetic_words(vocab_size, seed)
+    with open(path, 'w') as fout:
+        for _ in range(num_sentences):
+            sentence = [rng.choice(words) for _ in range(rng.randint(5, 40))]
+            fout.write('###' + ' '.join(sentence) + '\n')
+            for word_i in range(len(sentence)):
+                fout.write(f'{word_i}###' + ' '.join(f'{word_j}:{rng.random()}' for word_j in range(len(sentence))) + '\n')
+    return path
+
+
+def bench_reader(tmp_dir, worker_counts, num_lines):
+    import bert_cooccur_mindspore as bc
+
+    coo_path = write_synthetic_coo(os.path.join(tmp_dir, 'bench.coo'), num_lines)
+    mlm_path = write_synthetic_mlm_dump(os.path.join(tmp_dir, 'bench.mlm.dump'), num_lines // 20)
+    san_path = write_synthetic_san_dump(os.path.join(tmp_dir, 'bench.san.dump'), num_lines // 200)
+    configs = [(5, 'divide', os.path.join(tmp_dir, 'bench.out.coo'))]
+    jobs = [
+        ('read_pair_count', coo_path, lambda n: bc.read_pair_count(coo_path, n)),
+        ('read_word_pair', coo_path, lambda n: bc.read_word_pair(coo_path, n)),
+        ('read_coo_matrix', coo_path, lambda n: bc.read_coo_matrix(coo_path, {}, n)),
+        ('mlm_dump', mlm_path, lambda n: bc.get_mlm_bpe_cooccurr_sweep_from_dump_file(configs, mlm_path, num_workers=n)),
+        ('san_dump', san_path, lambda n: bc.cal_san_word_coo_sweep(san_path, configs, num_workers=n)),
+    ]
+
+    results = []
+    for name, path, job in jobs:
+        size_mb = os.path.getsize(path) / float(1 << 20)
+        base = None
+        for num_workers in worker_counts:
+            seconds, _ = timeit(job, num_workers)
+            base = seconds if base is None else base
+            results.append({'task': name, 'workers': num_workers, 'seconds': seconds, 'mb': size_mb,
+                            'mb_per_s': size_mb / seconds, 'speedup': base / seconds})
+    return results
+
+
+def bench_compress(tmp_dir, levels, thread_counts, num_lines):
+    sources = [('coo', write_synthetic_coo(os.path.join(tmp_dir, 'bench.coo'), num_lines)),
+               ('mlm_dump', write_synthetic_mlm_dump(os.path.join(tmp_dir, 'bench.mlm.dump'), num_lines // 20))]
+    results = []
+    for name, src_path in sources:
+        lines = [line + '\n' for line in parallel_reader.iter_lines(src_path)]
+        settings = [(0, 1)] + [(level, threads) for level in levels for threads in thread_counts]
+        for level, threads in settings:
+            out_path = os.path.join(tmp_dir, 'bench.out' + (block_io.SUFFIX if level > 0 else ''))
+            block_io.configure(level > 0, level, threads)
+
+            def write():
+                fout = block_io.open_output(out_path)
+                for line in lines:
+                    fout.write(line)
+                fout.close()
+
+            write_seconds, _ = timeit(write)
+            read_seconds, _ = timeit(lambda: sum(1 for _ in parallel_reader.iter_lines(out_path)))
+            results.append({'task': name, 'level': level, 'threads': threads, 'bytes': os.path.getsize(out_path),
+                            'write_seconds': write_seconds, 'read_seconds': read_seconds})
+    block_io.configure(False)
+    return results
+
+
+def write_synthetic_corpus(path, num_sentences, vocab_size=5000, seed=1234):
+    rng = random.Random(seed)
+    words = synthetic_words(vocab_size, seed)
+    with open(path, 'w') as fout:
+        for _ in range(num_sentences):
+            fout.write(' '.join(rng.choice(words) for _ in range(rng.randint(5, 40))) + '\n')
+    return path
+
+
+def write_synthetic_vocabs(tmp_dir, vocab_size=5000, seed=1234):
+    # GloVe vocab (word count) and a local BERT directory whose wordpiece vocab splits half of the words in two
+    words = synthetic_words(vocab_size, seed)
+    vocab_path = os.path.join(tmp_dir, 'vocab.txt')
+    with open(vocab_path, 'w') as fout:
+        fout.write(''.join('%s %d\n' % (word, vocab_size - idx) for idx, word in enumerate(words)))
+    pieces = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]']
+    for idx, word in enumerate(words):
+        pieces.extend([word] if idx % 2 else [word[:2], '##' + word[2:]])
+    pieces = list(dict.fromkeys(pieces))
+    bert_dir = os.path.join(tmp_dir, 'tiny-bert')
+    if not os.path.exists(bert_dir):
+        os.makedirs(bert_dir)
+    with open(os.path.join(bert_dir, 'vocab.txt'), 'w') as fout:
+        fout.write(''.join(piece + '\n' for piece in pieces))
+    with open(os.path.join(bert_dir, 'config.json'), 'w') as fout:
+        json.dump({'model_type': 'bert', 'vocab_size': len(pieces)}, fout)
+    with open(os.path.join(bert_dir, 'tokenizer_config.json'), 'w') as fout:
+        json.dump({'do_lower_case': True}, fout)
+    return vocab_path, bert_dir, len(pieces)
+
+
+def write_synthetic_vectors(path, words, dim=50, seed=1234):
+    rng = np.random.RandomState(seed)
+    with open(path, 'w') as fout:
+        for word, row in zip(words, rng.randn(len(words), dim).tolist()):
+            fout.write(word + ' ' + ' '.join('%.6f' % x for x in row) + '\n')
+    return path
+
+
+def write_synthetic_questions(question_dir, filenames, words, num_questions=500, seed=1234):
+    rng = random.Random(seed)
+    if not os.path.exists(question_dir):
+        os.makedirs(question_dir)
+    for filename in filenames:
+        with open(os.path.join(question_dir, filename), 'w') as fout:
+            fout.write(''.join(' '.join(rng.sample(words, 4)) + '\n' for _ in range(num_questions)))
+    return question_dir
+
+
+class StageResults(object):
+    def __init__(self, task):
+        self.task = task
+        self.results = []
+
+    def run(self, stage, items, fn, *args, **kwargs):
+        print('==> %s' % stage)
+        sys.stdout.flush()
+        seconds, res = timeit(fn, *args, **kwargs)
+        self.results.append({'task': self.task, 'stage': stage, 'seconds': seconds, 'items': items,
+                             'items_per_s': items / seconds if seconds > 0 else 0.0})
+        return res
+
+
+def bench_eval(tmp_dir, num_words=20000, dim=50, stages=None):
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'eval', 'python'))
+    import evaluate
+    from ann_index import IVFIndex
+    from vectors_io import load_vectors
+
+    stages = stages or StageResults('eval')
+    words = synthetic_words(num_words)
+    vectors_path = write_synthetic_vectors(os.path.join(tmp_dir, 'bench.vectors.txt'), words, dim)
+    evaluate.prefix = write_synthetic_questions(os.path.join(tmp_dir, 'question-data'), evaluate.filenames, words)
+    num_questions = 500 * len(evaluate.filenames)
+    W, vocab, ivocab = stages.run('eval_load_vectors', num_words, load_vectors, vectors_path)
+    stages.run('eval_load_vectors_cached', num_words, load_vectors, vectors_path)
+    stages.run('eval_analogy_add', num_questions, evaluate.evaluate_vectors, W, vocab, ivocab, 'add')
+    stages.run('eval_analogy_mul', num_questions, evaluate.evaluate_vectors, W, vocab, ivocab, 'mul')
+    index = stages.run('eval_ann_build', num_words, IVFIndex.build, W)
+    stages.run('eval_ann_query', 1000, lambda: [index.most_similar(W[i], 10) for i in range(1000)])
+    return stages.results
+
+
+def bench_pipeline(tmp_dir, num_sentences=2000, batch_size=32, top_k=11, num_layers=2, hidden_size=64, vocab_size=5000):
+    import mindspore
+    from cybertron import BertConfig, BertForMaskedLM
+    from torch.utils.data.dataloader import DataLoader
+    from transformers import BertTokenizer
+    import bert_cooccur_mindspore as bc
+
+    stages = StageResults('pipeline')
+    corpus_path = write_synthetic_corpus(os.path.join(tmp_dir, 'bench.corpus'), num_sentences, vocab_size)
+    vocab_path, bert_dir, num_pieces = write_synthetic_vocabs(tmp_dir, vocab_size)
+    tokenizer = BertTokenizer.from_pretrained(bert_dir)
+    config = BertConfig(vocab_size=num_pieces, hidden_size=hidden_size, num_hidden_layers=num_layers, num_attention_heads=2,
+                        intermediate_size=4 * hidden_size, max_position_embeddings=bc.BERT_MAX_LEN)
+    model = BertForMaskedLM(config)
+    model.set_train(False)
+    # dump_mlm_predictions reads the model name set in __main__ of bert_cooccur_mindspore
+    bc.model_name = bert_dir
+
+    def collate_batches():
+        dataset = bc.CustomDataset(bert_dir, bc.load_data(corpus_path), tokenizer)
+        return list(DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=0, collate_fn=bc.collate_fn))
+
+    def predict(batches):
+        return [model(input_ids=batch['wordpiece_ids'], attention_mask=batch['wordpiece_masks'])[0] for batch in batches]
+
+    def topk(all_logits):
+        op = mindspore.ops.TopK(sorted=True)
+        return [[item.asnumpy().tolist() for item in op(logits, top_k)] for logits in all_logits]
+
+    def format_dump(batches, predictions, path):
+        fout = bc.open_output(path)
+        for batch, (top_scores, top_ids) in zip(batches, predictions):
+            wordpieces = [tokenizer.convert_ids_to_tokens(item, skip_special_tokens=True) for item in batch['wordpiece_ids'].asnumpy().tolist()]
+            for line in bc.format_mlm_predictions(batch['line_text'], wordpieces, top_ids, top_scores, tokenizer):
+                fout.write(line + '\n')
+        fout.close()
+
+    dump_path = os.path.join(tmp_dir, 'bench.mlm.dump')
+    batches = stages.run('tokenize_collate', num_sentences, collate_batches)
+    all_logits = stages.run('forward', num_sentences, predict, batches)
+    predictions = stages.run('topk', num_sentences, topk, all_logits)
+    stages.run('dump_format', num_sentences, format_dump, batches, predictions, dump_path)
+    stages.run('dump_mlm_predictions', num_sentences, bc.dump_mlm_predictions, corpus_path, dump_path, batch_size, model,
+               tokenizer, top_k - 1)
+
+    num_dump_lines = sum(1 for _ in parallel_reader.iter_lines(dump_path))
+    bpe_coo_path = os.path.join(tmp_dir, 'bench.bpe.coo')
+    stages.run('aggregate_mlm', num_dump_lines, bc.get_mlm_bpe_cooccurr_from_dump_file, top_k - 1, True, False, dump_path, bpe_coo_path)
+    san_path = write_synthetic_san_dump(os.path.join(tmp_dir, 'bench.san.dump'), num_sentences // 10, vocab_size)
+    stages.run('aggregate_san', num_sentences // 10, bc.cal_san_word_coo, san_path, os.path.join(tmp_dir, 'bench.san.coo'), 5, True, False)
+
+    word_pair_path = write_synthetic_coo(os.path.join(tmp_dir, 'bench.word.pairs'), num_sentences * 50, vocab_size)
+    word_coo_path = os.path.join(tmp_dir, 'bench.word.coo')
+    stages.run('bpe_to_word', num_sentences * 50, bc.cal_word_pair_count_from_bpe_pair_count, word_pair_path, bpe_coo_path,
+               word_coo_path, 1, vocab_path, tokenizer)
+    num_pairs = sum(1 for _ in parallel_reader.iter_lines(word_coo_path))
+    stages.run('txt2bin', num_pairs, bc.convert_txt_to_bin, vocab_path, word_coo_path, word_coo_path + '.bin')
+    stages.run('bin2txt', num_pairs, bc.convert_bin_to_txt, vocab_path, word_coo_path + '.bin', word_coo_path + '.back')
+
+    merge_dir = os.path.join(tmp_dir, 'merge')
+    if not os.path.exists(merge_dir):
+        os.makedirs(merge_dir)
+    for idx in range(4):
+        write_synthetic_coo(os.path.join(merge_dir, 'part%d.coo' % idx), num_sentences * 50, vocab_size, seed=idx)
+    stages.run('merge', num_sentences * 200, bc.merge_coo_matrix, merge_dir)
+
+    bench_eval(tmp_dir, vocab_size, stages=stages)
+    return stages.results
+
+
+def bench_worker(tmp_dir, num_shards=4, num_sentences=500, batch_size=32, num_layers=2, hidden_size=64, vocab_size=5000):
+    import subprocess
+    from cybertron import BertConfig, BertModel, BertForMaskedLM
+    from transformers import BertTokenizer
+    import model_worker
+
+    stages = StageResults('worker')
+    # interpreter and imports of bert_cooccur_mindspore, paid again by every separate run
+    stages.run('process_startup', 1, subprocess.check_call, [sys.executable, '-c', 'import bert_cooccur_mindspore'],
+               cwd=os.path.dirname(os.path.abspath(__file__)))
+    startup_seconds = stages.results[-1]['seconds']
+    corpus_dir = os.path.join(tmp_dir, 'shards')
+    if not os.path.exists(corpus_dir):
+        os.makedirs(corpus_dir)
+    names = ['x%03d' % idx for idx in range(num_shards)]
+    for idx, name in enumerate(names):
+        write_synthetic_corpus(os.path.join(corpus_dir, name), num_sentences, vocab_size, seed=idx)
+    _, bert_dir, num_pieces = write_synthetic_vocabs(tmp_dir, vocab_size)
+
+    def load_worker(spool):
+        tokenizer = BertTokenizer.from_pretrained(bert_dir)
+        config = BertConfig(vocab_size=num_pieces, hidden_size=hidden_size, num_hidden_layers=num_layers, num_attention_heads=2,
+                            intermediate_size=4 * hidden_size, max_position_embeddings=512)
+        model, masked_model = BertModel(config), BertForMaskedLM(config)
+        model.set_train(False)
+        masked_model.set_train(False)
+        worker = model_worker.ModelWorker(spool, bert_dir, model, masked_model, tokenizer, exit_when_idle=True)
+        worker.warm_up()
+        return worker
+
+    def shard_jobs(save_path):
+        return [dict(model_worker.JOB_DEFAULTS, corpus_path=corpus_dir, corpus_name=name, save_path=save_path,
+                     sweep_windows='5,10', batch_size=batch_size) for name in names]
+
+    # before: every shard is its own run
+    separate_seconds, separate_jobs, separate_loads = 0.0, 0.0, 0.0
+    for job in shard_jobs(os.path.join(tmp_dir, 'separate')):
+        load_seconds, worker = timeit(load_worker, os.path.join(tmp_dir, 'spool.separate'))
+        job_seconds, _ = timeit(worker.run_job, job)
+        separate_loads += load_seconds
+        separate_jobs += job_seconds
+        separate_seconds += startup_seconds + load_seconds + job_seconds
+
+    # after: one worker loads the model once and serves all the shards from a spool
+    spool = os.path.join(tmp_dir, 'spool')
+    model_worker.submit(spool, shard_jobs(os.path.join(tmp_dir, 'resident')))
+    start = time.time()
+    worker = load_worker(spool)
+    worker.serve()
+    resident_seconds = time.time() - start
+    done_dir = model_worker.spool_dirs(spool)['done']
+    done = [json.load(open(os.path.join(done_dir, name))) for name in os.listdir(done_dir)]
+    resident_jobs = sum(item['seconds'] for item in done)
+
+    for stage, seconds, items in [('model_load_warmup', separate_loads / num_shards, 1),
+                                  ('shards_separate', separate_seconds, num_shards),
+                                  ('shards_resident', resident_seconds, num_shards),
+                                  ('overhead_per_shard_separate', (separate_seconds - separate_jobs) / num_shards, 1),
+                                  ('overhead_per_shard_resident', (resident_seconds - resident_jobs) / num_shards, 1)]:
+        stages.results.append({'task': 'worker', 'stage': stage, 'seconds': seconds, 'items': items,
+                               'items_per_s': items / seconds if seconds > 0 else 0.0})
+    print('model busy %.1f%% of the resident run, %d of %d shards done' %
+          (100.0 * resident_jobs / resident_seconds, len(done), num_shards))
+    return stages.results
+
+
+def bench_static_graph(tmp_dir, num_sentences=2000, batch_size=32, top_k=11, num_layers=2, hidden_size=64, vocab_size=5000,
+                       buckets=(32, 64, 128, 256, 512)):
+    import mindspore
+    from cybertron import BertConfig, BertForMaskedLM
+    from torch.utils.data.dataloader import DataLoader
+    from transformers import BertTokenizer
+    import bert_cooccur_mindspore as bc
+    import static_graph
+
+    stages = StageResults('static_graph')
+    corpus_path = write_synthetic_corpus(os.path.join(tmp_dir, 'bench.corpus'), num_sentences, vocab_size)
+    _, bert_dir, num_pieces = write_synthetic_vocabs(tmp_dir, vocab_size)
+    tokenizer = BertTokenizer.from_pretrained(bert_dir)
+    config = BertConfig(vocab_size=num_pieces, hidden_size=hidden_size, num_hidden_layers=num_layers, num_attention_heads=2,
+                        intermediate_size=4 * hidden_size, max_position_embeddings=bc.BERT_MAX_LEN)
+    model = BertForMaskedLM(config)
+    model.set_train(False)
+    dataset = bc.CustomDataset(bert_dir, bc.load_data(corpus_path), tokenizer)
+    batches = list(DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=0, collate_fn=bc.collate_fn))
+
+    def dynamic():
+        op = mindspore.ops.TopK(sorted=True)
+        return [[item.asnumpy() for item in op(model(input_ids=batch['wordpiece_ids'], attention_mask=batch['wordpiece_masks'])[0], top_k)]
+                for batch in batches]
+
+    static_graph.configure(True, buckets)
+    forward = static_graph.masked_lm_topk(model, top_k, batch_size)
+
+    def static():
+        return [forward(batch['wordpiece_ids'], batch['wordpiece_masks']) for batch in batches]
+
+    stages.run('dynamic_warm_up', num_sentences, dynamic)
+    dynamic_outputs = stages.run('dynamic_forward_topk', num_sentences, dynamic)
+    stages.run('static_first_pass', num_sentences, static)
+    static_outputs = stages.run('static_forward_topk', num_sentences, static)
+
+    same = total = 0
+    for batch, (_, dynamic_ids), (_, static_ids) in zip(batches, dynamic_outputs, static_outputs):
+        mask = batch['wordpiece_masks'].asnumpy().astype(bool)
+        same += int((dynamic_ids[:, :, 0] == static_ids[:, :, 0])[mask].sum())
+        total += int(mask.sum())
+    compile_seconds = sum(row['compile_s'] for row in forward.summary())
+    saving = (stages.results[1]['seconds'] - stages.results[3]['seconds']) / len(batches)
+    forward.report()
+    print('top-1 agreement with the dynamic forward: %.4f' % (same / float(max(1, total))))
+    print('compile %.1fs for %d buckets, %.1f ms saved per batch -> pays off after %s batches' %
+          (compile_seconds, len(forward.stats), 1000 * saving, '%d' % (compile_seconds / saving) if saving > 0 else 'no'))
+    for row in forward.summary():
+        stages.results.append({'task': 'static_graph', 'stage': 'compile_bucket_%d' % row['bucket'], 'seconds': row['compile_s'],
+                               'items': 1, 'items_per_s': 1 / row['compile_s'] if row['compile_s'] > 0 else 0.0})
+    return stages.results
+
+
+def bench_san_layers(tmp_dir, layer_ranges, num_sentences=1000, batch_size=32, window_size=5, num_layers=2, hidden_size=64,
+                     vocab_size=5000):
+    from cybertron import BertConfig, BertModel
+    from transformers import BertTokenizer
+    import bert_cooccur_mindspore as bc
+
+    corpus_path = write_synthetic_corpus(os.path.join(tmp_dir, 'bench.corpus'), num_sentences, vocab_size)
+    _, bert_dir, num_pieces = write_synthetic_vocabs(tmp_dir, vocab_size)
+    tokenizer = BertTokenizer.from_pretrained(bert_dir)
+    config = BertConfig(vocab_size=num_pieces, hidden_size=hidden_size, num_hidden_layers=num_layers, num_attention_heads=2,
+                        intermediate_size=4 * hidden_size, max_position_embeddings=bc.BERT_MAX_LEN)
+    model = BertModel(config)
+    model.set_train(False)
+    dataset = bc.load_data(corpus_path)
+
+    def run(layer_range):
+        name = san_layers.layer_range_name(layer_range)
+        dump_path = os.path.join(tmp_dir, 'bench.%s.san.band' % name)
+        coo_path = os.path.join(tmp_dir, 'bench.%s.san.coo' % name)
+        seconds, _ = timeit(bc.dump_self_attention_weights, bert_dir, corpus_path, batch_size, dump_path, model, tokenizer,
+                            band_window=window_size, dataset=dataset, layer_range=layer_range)
+        bc.cal_san_word_coo_banded(dump_path, [(window_size, 'divide', coo_path)])
+        return seconds, coo_path
+
+    results = []
+    run(None)  # warm-up, so the full-depth time is not charged with the first forward passes
+    full_seconds, full_coo = run(None)
+    for layer_range in [None] + layer_ranges:
+        seconds, coo_path = (full_seconds, full_coo) if layer_range is None else run(layer_range)
+        res = san_layers.compare_coo(full_coo, coo_path)
+        san_layers.print_comparison(san_layers.layer_range_name(layer_range), res)
+        results.append({'task': 'san_layers', 'stage': san_layers.layer_range_name(layer_range), 'seconds': seconds,
+                        'items': num_sentences, 'items_per_s': num_sentences / seconds if seconds > 0 else 0.0,
+                        'speedup': full_seconds / seconds if seconds > 0 else 0.0, 'pair_jaccard': res['pair_jaccard'],
+                        'top_overlap': res['top_overlap'], 'spearman': res['spearman']})
+    return results
+
+
+def write_json(path, task, args, results):
+    with open(path, 'w') as fout:
+        json.dump({'task': task, 'args': args, 'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+                   'numpy': np.__version__, 'machine': platform.machine(), 'cpus': os.cpu_count(), 'results': results},
+                  fout, indent=1)
+    print('wrote %s' % path)
+
+
+def print_results(results):
+    keys = list(results[0].keys()) if results else []
+    print('\t'.join(keys))
+    for item in results:
+        print('\t'.join('%.3f' % item[k] if isinstance(item[k], float) else str(item[k]) for k in keys))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='SemGloVe micro benchmarks')
+    parser.add_argument('--task', default='reader',
+                        choices=['reader', 'compress', 'pipeline', 'eval', 'worker', 'static_graph', 'san_layers'])
+    parser.add_argument('--workers', default='1,2,4,8')
+    parser.add_argument('--levels', default='1,6,9')
+    parser.add_argument('--threads', default='1,4')
+    parser.add_argument('--lines', default=1000000, type=int)
+    parser.add_argument('--sentences', default=2000, type=int, help='pipeline: synthetic corpus size')
+    parser.add_argument('--batch_size', default=32, type=int)
+    parser.add_argument('--layers', default=2, type=int, help='pipeline: layers of the random BERT')
+    parser.add_argument('--hidden', default=64, type=int, help='pipeline: hidden size of the random BERT')
+    parser.add_argument('--words', default=20000, type=int, help='eval: synthetic vocabulary size')
+    parser.add_argument('--shards', default=4, type=int, help='worker: corpus shards of --sentences sentences')
+    parser.add_argument('--buckets', default='32,64,128,256,512', help='static_graph: wordpiece length buckets')
+    parser.add_argument('--layer_ranges', default='0-0', help='san_layers: comma separated FIRST-LAST ranges, 0-based')
+    parser.add_argument('--tmp_dir', default='')
+    parser.add_argument('--json', default='', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    tmp_dir = args.tmp_dir or tempfile.mkdtemp(prefix='semglove_bench_')
+    worker_counts = [int(item) for item in args.workers.split(',')]
+    if args.task == 'reader':
+        results = bench_reader(tmp_dir, worker_counts, args.lines)
+    elif args.task == 'compress':
+        results = bench_compress(tmp_dir, [int(item) for item in args.levels.split(',')],
+                                 [int(item) for item in args.threads.split(',')], args.lines)
+    elif args.task == 'pipeline':
+        results = bench_pipeline(tmp_dir, args.sentences, args.batch_size, num_layers=args.layers, hidden_size=args.hidden)
+    elif args.task == 'static_graph':
+        results = bench_static_graph(tmp_dir, args.sentences, args.batch_size, num_layers=args.layers, hidden_size=args.hidden,
+                                     buckets=tuple(int(item) for item in args.buckets.split(',')))
+    elif args.task == 'san_layers':
+        layer_ranges = [san_layers.parse_layer_range(item) for item in args.layer_ranges.split(',') if item.strip()]
+        results = bench_san_layers(tmp_dir, layer_ranges, args.sentences, args.batch_size, num_layers=args.layers, hidden_size=args.hidden)
+    elif args.task == 'worker':
+        results = bench_worker(tmp_dir, args.shards, args.sentences, args.batch_size, num_layers=args.layers, hidden_size=args.hidden)
+    else:
+        results = bench_eval(tmp_dir, args.words)
+    print_results(results)
+    if args.json:
+        write_json(args.json, args.task, vars(args), results)
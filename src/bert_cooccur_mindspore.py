@@ -16,10 +16,23 @@ from torch.multiprocessing import Pool
 from allennlp.data.token_indexers import PretrainedTransformerIndexer
 from torch.utils.data.dataset import Dataset
 from torch.utils.data.dataloader import DataLoader
+from san_band import BandDumpWriter, word_attention_band, cal_san_word_coo_banded
+from coo_sketch import BoundedPairTable
+from coo_store import text_to_records
+from crec_shuffle import report_mixing
+from block_io import open_output, open_binary, output_path, resume_output
+import block_io
+import checkpoint
+import metrics
+import static_graph
+from san_layers import parse_layer_range, layer_range_name
+from parallel_reader import (DUMP_HEADER, iter_lines, parallel_parse, parse_pair_count, parse_word_pair, parse_coo_matrix,
+                             split_ranges, update_dict, update_set, sum_dict, sum_dict_list)
 
 os.environ['TOKENIZERS_PARALLELISM']='false'
 
 BERT_MAX_LEN = 512
+CHECKPOINT_RANGE_BYTES = 256 << 20
 DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
 
 MODELS = {'bert-base-uncased'    : (BertModel,    BertForMaskedLM,    BertConfig,       BertTokenizer,     'bert-base-uncased'),
@@ -104,10 +117,11 @@ def collate_fn(batch_data):
     
     return output
 
-def load_data(corpus_path):
+def load_data(corpus_path, start_line=0):
     dataset = []
-    for linenum, line in tqdm(enumerate(codecs.open(corpus_path, 'r', 'utf-8', errors='ignore'))):
-        dataset.append((line, linenum))
+    for linenum, line in tqdm(enumerate(iter_lines(corpus_path, errors='ignore'))):
+        if linenum >= start_line:
+            dataset.append((line, linenum))
 
     return dataset
 
@@ -117,14 +131,14 @@ class CR(Structure):
 
 def read_from_bin(path):
     print('read from bin: ', path)
-    with open(path, 'rb') as fin:
+    with open_binary(path) as fin:
         x = CR()
         while fin.readinto(x) == sizeof(x):
             yield (x.word1, x.word2, x.val)
 
 def read_word_bpe_pair(word_bpe_pair_path):
     pairs = {}
-    for line in codecs.open(filename=word_bpe_pair_path, mode='r', encoding='utf-8'):
+    for line in iter_lines(word_bpe_pair_path):
         parts = line.strip().split('\t')
         if len(parts) <= 0:
             print('Read word bpe pair error line:', line)
@@ -137,7 +151,7 @@ def read_word_bpe_pair(word_bpe_pair_path):
 
 def build_vocab(vocab_path):
     vocab = {}
-    for index, line in enumerate(codecs.open(filename=vocab_path, mode='r', encoding='utf-8')):
+    for index, line in enumerate(iter_lines(vocab_path)):
         parts = line.strip().rsplit(maxsplit=1)
         if len(parts) != 2:
             print('Error line:', line)
@@ -165,17 +179,24 @@ def convert_bin_to_txt(vocab_path, path, outpath):
     iter = read_from_bin(path)
     vocab = build_vocab(vocab_path)
     vocab = dict(zip(vocab.values(), vocab.keys()))
-    fout = codecs.open(outpath, 'w', 'utf-8')
+    fout = open_output(outpath, 'w')
     for line in iter:
         fout.write('%s\t%s\t%.8f\n' % (vocab[line[0]], vocab[line[1]], line[2]))
     print('finish converting bin to text.')
     fout.close()
 
-def convert_txt_to_bin(vocab_path, coo_path, out_path):
+def convert_txt_to_bin(vocab_path, coo_path, out_path, shuffle=False, shuffle_memory_mb=2048, seed=1):
 
     vocab = build_vocab(vocab_path)
+    if shuffle:
+        # records in a seeded random order, glove reads them without build/shuffle
+        text_to_records(coo_path, vocab, out_path, shuffle_seed=seed, memory_mb=shuffle_memory_mb)
+        report_mixing(out_path)
+        print('finish converting txt to shuffled bin...')
+        return
+
     fout = codecs.open(out_path, 'wb')
-    for line in tqdm(codecs.open(coo_path, mode='r', encoding='utf-8')):
+    for line in tqdm(iter_lines(coo_path)):
         parts = line.strip().split('\t')
         x = CR()
         if parts[0] in vocab and parts[1] in vocab:
@@ -187,103 +208,137 @@ def convert_txt_to_bin(vocab_path, coo_path, out_path):
     fout.close()
     print('finish converting txt to bin...')
 
-def read_word_pair(path):
-    word_pairs = set()
-    for idx, line in enumerate(codecs.open(path, mode='r', encoding='utf-8')):
-        if (idx + 1) % 1e6 == 0:
-            print('processing %d number lines...' % (idx + 1))
-        parts = line.strip().split('\t')
-        if len(parts) != 3:
-            print('Read error line for pair count:', line)
-            continue
-        word1 = parts[0]
-        word2 = parts[1]
-        word_pairs.add((word1, word2))
-
+def read_word_pair(path, num_workers=1):
+    word_pairs = parallel_parse(path, parse_word_pair, update_set, num_workers)
     print('Finish reading pair from: %s and size: %d' % (path, len(word_pairs)))
     return word_pairs
 
 
-def read_pair_count(path):
+def read_pair_count(path, num_workers=1):
     print('read bpe pair count...')
-    pair_count = {}
-    for idx, line in enumerate(codecs.open(path, mode='r', encoding='utf-8')):
-        if (idx + 1) % 1e6 == 0:
-            print('processing %d number lines...' % (idx + 1))
-            sys.stdout.flush()
-        parts = line.strip().split('\t')
-        if len(parts) != 3:
-            print('Read error line for pair count:', line)
-            continue
-        word1 = parts[0]
-        word2 = parts[1]
-        count = float(parts[2])
-        pair_count[(word1, word2)] = count
-
+    pair_count = parallel_parse(path, parse_pair_count, update_dict, num_workers)
     print('Finish reading pair from: %s and size: %d' % (path, len(pair_count)))
     return pair_count
 
-def read_coo_matrix(file, res_coo):
-    for line in tqdm(codecs.open(file, 'r', 'utf-8')):
-        parts = line.strip().split('\t')
-        k = (parts[0], parts[1])
-        if k not in res_coo:
-            res_coo[k] = float(parts[-1])
-        else:
-            res_coo[k] = float(parts[-1]) + res_coo[k]
-    
+def read_coo_matrix(file, res_coo, num_workers=1):
+    coo = parallel_parse(file, parse_coo_matrix, sum_dict, num_workers)
+    if not res_coo:
+        res_coo.update(coo)
+        return res_coo
+    for k, v in coo.items():
+        res_coo[k] = res_coo.get(k, 0) + v
     return res_coo
 
-def merge_coo_matrix(path):
+def merge_coo_matrix(path, num_workers=1):
+    metrics.start('merge_coo')
     res_coo = {}
     for file in os.listdir(path):
+        if file.endswith(block_io.INDEX_SUFFIX):
+            continue
         coo_path = os.path.join(path, file)
         print("Merge coo path:", coo_path)
         sys.stdout.flush()
-        read_coo_matrix(coo_path, res_coo)
+        with metrics.timer('read'):
+            read_coo_matrix(coo_path, res_coo, num_workers)
+        metrics.count('files')
+        metrics.report()
     
-    save_path = os.path.join(path, 'word.san.coo')
+    save_path = output_path(os.path.join(path, 'word.san.coo'))
     print("final cooccurrence save path:", save_path)
     print("final cooccurrence size:", len(res_coo))
-    write_table_to_file(res_coo, save_path)
+    with metrics.timer('write_table'):
+        write_table_to_file(res_coo, save_path)
+    metrics.count('pairs', len(res_coo))
+    metrics.finish()
 
 #################### masked language model based glove ##############################################
-def dump_mlm_predictions(corpus, outpath, batch_size, model, tokenizer, window_size):
+def format_mlm_predictions(line_buffer, line_wordpieces_buffer, pred_ids_buffer, pred_scores_buffer, tokenizer):
+    # dump lines: '###' + sentence, then 'target context:score ...' for every wordpiece of the sentence
+    write_buffer = []
+    for i in range(len(line_buffer)):
+        # print("###" + line_buffer[i])
+        write_buffer.append('###' + line_buffer[i].strip())
+        target_tokens = line_wordpieces_buffer[i] #[max_wordpieces]
+        context_token_ids = pred_ids_buffer[i] #[max_wordpieces, top_k]
+        context_token_scores = pred_scores_buffer[i] #[max_wordpieces, top_k]
+        for j in range(0, len(target_tokens)):
+            target_token = target_tokens[j]
+            c_tokens = tokenizer.convert_ids_to_tokens(context_token_ids[j+1], skip_special_tokens=True)
+            c_tokens_len = len(c_tokens)
+            c_token_scores = context_token_scores[j+1][:c_tokens_len]
+            # print(f'target token: {target_token} and context_tokens: {c_tokens}')
+            condidate = target_token + ' ' + ' '.join([item[0] + ':' + str(item[1]) for item in list(zip(c_tokens, c_token_scores))])
+            write_buffer.append(condidate)
+    return write_buffer
+
+
+def count_batch(masks, batch_size):
+    # sentences, real and padded wordpieces of a batch, then a periodic metrics record
+    masks = masks.asnumpy() if hasattr(masks, 'asnumpy') else np.asarray(masks)
+    metrics.count('sentences', batch_size)
+    metrics.count('wordpieces', int(masks.sum()))
+    metrics.count('padded_wordpieces', int(masks.shape[0] * masks.shape[1]))
+    metrics.report()
+
+
+def finish_dump_metrics():
+    counters = metrics.job['counters']
+    padded = counters.get('padded_wordpieces', 0)
+    metrics.finish(padding_ratio=1 - counters.get('wordpieces', 0) / float(padded) if padded else 0.0)
+
+
+def dump_checkpoint(job, corpus, outpath, settings):
+    # -> (checkpoint path, key, saved state when resuming)
+    ckpt_path = checkpoint.checkpoint_path(outpath)
+    key = (job, os.path.abspath(corpus), os.path.getsize(corpus), settings)
+    return ckpt_path, key, checkpoint.load(ckpt_path, key)
+
+
+def save_dump_checkpoint(ckpt_path, key, fout, dataset, done, start_line):
+    # done: sentences of dataset already flushed to fout
+    next_line = dataset[done - 1][1] + 1 if done else start_line
+    if isinstance(fout, BandDumpWriter):
+        checkpoint.save(ckpt_path, key, next_line=next_line, band=fout.state())
+    else:
+        offset, block_offsets = checkpoint.output_offset(fout)
+        checkpoint.save(ckpt_path, key, next_line=next_line, offset=offset, block_offsets=block_offsets)
+
+
+def dump_mlm_predictions(corpus, outpath, batch_size, model, tokenizer, window_size, dataset=None):
+    # dataset: load_data(corpus) already read (by a model_worker.py prefetch), else it is read here
 
     if not os.path.exists(corpus):
         raise ValueError('corpus file does not exit: ', corpus)
 
-    dataset = load_data(corpus)
+    ckpt_path, ckpt_key, state = dump_checkpoint('dump_mlm_predictions', corpus, outpath, window_size)
+    if state and state['complete']:
+        print('dump already complete:', outpath)
+        return
+    start_line = state['next_line'] if state else 0
+    metrics.start('dump_mlm_predictions')
+    with metrics.timer('load_data'):
+        dataset = load_data(corpus, start_line) if dataset is None else [item for item in dataset if item[1] >= start_line]
     custom_dataset = CustomDataset(model_name, dataset, tokenizer)
     dataloader = DataLoader(custom_dataset, batch_size=batch_size, shuffle=False, num_workers=0, collate_fn=collate_fn)
     print("Finish building custom dataset!")
-    fout = codecs.open(outpath, 'w+', 'utf-8')
-    start = time.time()
+    fout = resume_output(outpath, state['offset'], state['block_offsets']) if state else open_output(outpath)
+    static_forward = static_graph.masked_lm_topk(model, window_size + 1, batch_size) if static_graph.settings['enabled'] else None
+    start, done = time.time(), 0
     line_buffer, line_wordpieces_buffer, pred_ids_buffer, pred_scores_buffer = [], [], [], []
 
-    for batch_idx, batch_data in tqdm(enumerate(dataloader), total=len(dataloader)):
-        if (batch_idx + 1) % 1e3 == 0:
-            write_buffer = []
-            for i in range(len(line_buffer)):
-                # print("###" + line_buffer[i])
-                write_buffer.append('###' + line_buffer[i].strip())
-                target_tokens = line_wordpieces_buffer[i] #[max_wordpieces]
-                context_token_ids = pred_ids_buffer[i] #[max_wordpieces, top_k]
-                context_token_scores = pred_scores_buffer[i] #[max_wordpieces, top_k]
-                for j in range(0, len(target_tokens)):
-                    target_token = target_tokens[j]
-                    c_tokens = tokenizer.convert_ids_to_tokens(context_token_ids[j+1], skip_special_tokens=True)
-                    c_tokens_len = len(c_tokens)
-                    c_token_scores = context_token_scores[j+1][:c_tokens_len]
-                    # print(f'target token: {target_token} and context_tokens: {c_tokens}')
-                    condidate = target_token + ' ' + ' '.join([item[0] + ':' + str(item[1]) for item in list(zip(c_tokens, c_token_scores))])
-                    write_buffer.append(condidate)
+    for batch_idx, batch_data in tqdm(enumerate(metrics.timed_iter('tokenize_collate', dataloader)), total=len(dataloader)):
+        if (batch_idx + 1) % 1e3 == 0 or checkpoint.due():
+            with metrics.timer('format'):
+                write_buffer = format_mlm_predictions(line_buffer, line_wordpieces_buffer, pred_ids_buffer, pred_scores_buffer, tokenizer)
 
             print('%.2fs writing %d batch dump data.' % (time.time() - start, batch_idx + 1))
-            [fout.write(item + '\n') for item in write_buffer]
+            with metrics.timer('write'):
+                [fout.write(item + '\n') for item in write_buffer]
+                fout.flush()
+            done += len(line_buffer)
+            save_dump_checkpoint(ckpt_path, ckpt_key, fout, dataset, done, start_line)
 
             sys.stdout.flush()
-            fout.flush()
             line_buffer, line_wordpieces_buffer, pred_ids_buffer, pred_scores_buffer = [], [], [], []
 
 
@@ -291,53 +346,98 @@ def dump_mlm_predictions(corpus, outpath, batch_size, model, tokenizer, window_s
         ori_tokenized_text = [tokenizer.convert_ids_to_tokens(item, skip_special_tokens=True) for item in input_ids]
         lengths, offsets = batch_data["lengths"], batch_data['offsets'] #[batch_size, max_word, 2]
         batch_size = len(lengths)
-        masked_lm_logits_scores = model(input_ids=input_ids, attention_mask=masks)[0]
-        # masked_lm_logits_scores = model(input_ids=input_ids, attention_mask=masks).logits #[batch_size, max_word, vocab_size]
-        topk = mindspore.ops.TopK(sorted=True)
-        top_scores, top_score_ids = topk(masked_lm_logits_scores,window_size+1) #[batch_size, max_wordpieces, top_k]
+        if static_forward is not None:
+            # padded to a length bucket, forward and TopK in one compiled graph
+            with metrics.timer('forward_topk'):
+                top_scores, top_score_ids = static_forward(input_ids, masks)
+                top_score_ids, top_scores = top_score_ids.tolist(), top_scores.tolist()
+        else:
+            with metrics.timer('forward'):
+                masked_lm_logits_scores = model(input_ids=input_ids, attention_mask=masks)[0]
+            # masked_lm_logits_scores = model(input_ids=input_ids, attention_mask=masks).logits #[batch_size, max_word, vocab_size]
+            with metrics.timer('topk'):
+                topk = mindspore.ops.TopK(sorted=True)
+                top_scores, top_score_ids = topk(masked_lm_logits_scores,window_size+1) #[batch_size, max_wordpieces, top_k]
+                top_score_ids, top_scores = top_score_ids.asnumpy().tolist(), top_scores.asnumpy().tolist()
 
         line_buffer.extend(line_texts)
         line_wordpieces_buffer.extend(ori_tokenized_text)
-        pred_ids_buffer.extend(top_score_ids.asnumpy().tolist())
-        pred_scores_buffer.extend(top_scores.asnumpy().tolist())
+        pred_ids_buffer.extend(top_score_ids)
+        pred_scores_buffer.extend(top_scores)
+        count_batch(masks, batch_size)
             
 
     print('writing final buffer data......')
-    write_buffer = []
-    for i in range(len(line_buffer)):
-        # print("###" + line_buffer[i])
-        write_buffer.append('###' + line_buffer[i].strip())
-        target_tokens = line_wordpieces_buffer[i] #[max_wordpieces]
-        context_token_ids = pred_ids_buffer[i] #[max_wordpieces, top_k]
-        context_token_scores = pred_scores_buffer[i] #[max_wordpieces, top_k]
-        for j in range(0, len(target_tokens)):
-            target_token = target_tokens[j]
-            c_tokens = tokenizer.convert_ids_to_tokens(context_token_ids[j+1], skip_special_tokens=True)
-            c_tokens_len = len(c_tokens)
-            c_token_scores = context_token_scores[j+1][:c_tokens_len]
-            # print(f'target token: {target_token} and context_tokens: {c_tokens}')
-            condidate = target_token + ' ' + ' '.join([item[0] + ':' + str(item[1]) for item in list(zip(c_tokens, c_token_scores))])
-            write_buffer.append(condidate)
+    with metrics.timer('format'):
+        write_buffer = format_mlm_predictions(line_buffer, line_wordpieces_buffer, pred_ids_buffer, pred_scores_buffer, tokenizer)
 
     print('%.2fs writing %d batch dump data.' % (time.time() - start, batch_idx + 1))
-    [fout.write(item + '\n') for item in write_buffer]
+    with metrics.timer('write'):
+        [fout.write(item + '\n') for item in write_buffer]
+        fout.close()
+    checkpoint.save(ckpt_path, ckpt_key, complete=True)
+    if static_forward is not None:
+        static_forward.report()
     sys.stdout.flush()
-    fout.close()
+    finish_dump_metrics()
 
 
-def get_mlm_bpe_cooccurr_from_dump_file(window_size, divide, reciprocal, dump_file, coo_path):
+def reweight_scores(top_scores, bench, weighting):
+    if weighting == 'reciprocal':
+        return np.reciprocal(np.linspace(1, len(top_scores), num=len(top_scores)))
+    elif weighting == 'divide':
+        return [item / bench for item in top_scores]
+    raise ValueError('Please specific reweight method!')
 
-    if not os.path.exists(dump_file):
-        raise ValueError('dump file does not exit: ', dump_file)
 
+def new_bigram_tables(num_tables, memory_mb=0, top_n=0):
+    # memory_mb > 0 switches to approximate aggregation sharing the budget between the tables
+    if memory_mb > 0:
+        return [BoundedPairTable(memory_mb / float(num_tables), top_n) for _ in range(num_tables)]
+    return [{} for _ in range(num_tables)]
+
+
+def add_pair_scores(bigram_table, target_token, context_tokens, scores):
+    if isinstance(bigram_table, BoundedPairTable):
+        for index, token in enumerate(context_tokens):
+            bigram_table.add((target_token, token), scores[index])
+        return
+    for index, pair in enumerate(zip([target_token] * len(context_tokens), context_tokens)):
+        if pair in bigram_table and scores[index] > 1e-9:
+            bigram_table[pair] += scores[index]
+        else:
+            bigram_table[pair] = scores[index]
+
+
+def parse_sweep_configs(window_sizes, weightings):
+    configs = []
+    for window_size in [int(item) for item in window_sizes.split(',') if item.strip()]:
+        for weighting in [item.strip() for item in weightings.split(',') if item.strip()]:
+            if weighting not in ('divide', 'reciprocal'):
+                raise ValueError('Unknown reweight method: %s' % weighting)
+            configs.append((window_size, weighting))
+    return configs
+
+
+def get_mlm_bpe_cooccurr_from_dump_file(window_size, divide, reciprocal, dump_file, coo_path, memory_mb=0, top_n=0,
+                                        num_workers=1):
+    weighting = 'reciprocal' if reciprocal else 'divide' if divide else None
+    get_mlm_bpe_cooccurr_sweep_from_dump_file([(window_size, weighting, coo_path)], dump_file, memory_mb, top_n, num_workers)
+
+
+def aggregate_mlm_dump_lines(lines, configs, bigram_tables=None):
+    # configs: [(window_size, weighting, coo_path)], every window must be <= the dump top-k - 1
     start = time.time()
-    bigram_table, line_num, pre_line = {}, 0, ''
+    max_window = max(item[0] for item in configs)
+    bigram_tables = [{} for _ in configs] if bigram_tables is None else bigram_tables
+    line_num = 0
 
-    for line in codecs.open(dump_file, 'r', 'utf-8'):
+    for line in lines:
 
         if line.startswith('###'):
             line_num += 1
-            pre_line = line
+            metrics.count('sentences')
+            metrics.report()
             if line_num % 1e5 == 0:
                 print('%.2fs processing %d line text.' % (time.time() - start, line_num))
                 sys.stdout.flush()
@@ -346,32 +446,38 @@ def get_mlm_bpe_cooccurr_from_dump_file(window_size, divide, reciprocal, dump_fi
             if len(parts) < 2:
                 print('wrong line: ', len(parts))
                 continue
-            else:
-                context_tokens, top_scores, target_token = [], [], parts[0]
-                bench = float(parts[1].rsplit(':', maxsplit=1)[1]) # use first predict token score as benchmark
-                filer_parts = list(filter(lambda x: x.rsplit(':')[0] != target_token, parts[1:]))
-                for item in filer_parts[ : window_size]:
-                    sub_parts = item.rsplit(':')
-                    if len(sub_parts) == 2:
-                        context_tokens.append(sub_parts[0])
-                        top_scores.append(float(sub_parts[1]))
 
-                if reciprocal:
-                    scores = np.reciprocal(np.linspace(1, len(context_tokens), num=len(context_tokens)))
+            target_token = parts[0]
+            bench = float(parts[1].rsplit(':', maxsplit=1)[1]) # use first predict token score as benchmark
+            filer_parts = list(filter(lambda x: x.rsplit(':')[0] != target_token, parts[1:]))
+            positions, context_tokens, top_scores = [], [], []
+            for position, item in enumerate(filer_parts[: max_window]):
+                sub_parts = item.rsplit(':')
+                if len(sub_parts) == 2:
+                    positions.append(position)
+                    context_tokens.append(sub_parts[0])
+                    top_scores.append(float(sub_parts[1]))
+
+            # reciprocal and divide weights of a shorter window are prefixes of the longest one
+            for (window_size, weighting, _), bigram_table in zip(configs, bigram_tables):
+                num = sum(1 for position in positions if position < window_size)
+                scores = reweight_scores(top_scores[: num], bench, weighting)
+                add_pair_scores(bigram_table, target_token, context_tokens[: num], scores)
 
-                elif divide:
-                    top_scores = [item / bench for item in top_scores]
-                    scores = top_scores
+    return bigram_tables
 
-                for index, pair in enumerate(zip([target_token] * len(context_tokens), context_tokens)):
-                    if pair == ("cat", "cat"):
-                        print('add <cat, cat> pair from: %s and target token: %s ...' % (pre_line, target_token))
-                    if pair in bigram_table and scores[index] > 1e-9:
-                        bigram_table[pair] += scores[index]
-                    else:
-                        bigram_table[pair] = scores[index]
 
-    write_table_to_file(bigram_table, coo_path)
+def get_mlm_bpe_cooccurr_sweep_from_dump_file(configs, dump_file, memory_mb=0, top_n=0, num_workers=1):
+    if not os.path.exists(dump_file):
+        raise ValueError('dump file does not exit: ', dump_file)
+
+    metrics.start('aggregate_mlm')
+    ckpt_path, ckpt_key = aggregate_checkpoint(dump_file, 'aggregate_mlm', configs, memory_mb, top_n)
+    with metrics.timer('aggregate'):
+        bigram_tables = aggregate_dump_file(dump_file, aggregate_mlm_dump_lines, configs, memory_mb, top_n, num_workers,
+                                            ckpt_path, ckpt_key)
+    write_aggregated_tables(dump_file, configs, bigram_tables, ckpt_path, ckpt_key)
+    metrics.finish(dump_mb=os.path.getsize(dump_file) / 1048576.0)
 
 
 def cal_word_pair_count_from_bpe_pair_count(word_pair_path, bpe_coo_path, save_path, coo_scale, vocab_path, tokenizer):
@@ -390,13 +496,13 @@ def cal_word_pair_count_from_bpe_pair_count(word_pair_path, bpe_coo_path, save_p
             pure_words.add(word)
     print('pure words len: %d' % len(pure_words))
 
-    for idx, line in enumerate(codecs.open(word_pair_path, 'r', 'utf-8')):
+    for idx, line in enumerate(iter_lines(word_pair_path)):
         if (idx + 1) % 1e6 == 0:
             print('processing %d number lines...' % (idx + 1))
             sys.stdout.flush()
 
         item = line.strip().split('\t')
-        c_word, t_word, coo_count = item[0], item[1], item[2]
+        c_word, t_word, coo_count = item[0], item[1], float(item[2])
 
         if coo_count < 1: # ignore rare word co-occurrence count
             continue
@@ -426,7 +532,7 @@ def cal_word_pair_count_from_bpe_pair_count(word_pair_path, bpe_coo_path, save_p
 
     print('add addition count %d.' % addition_count)
 
-    fout = codecs.open(save_path, mode='w+', encoding='utf-8')
+    fout = open_output(save_path)
     print('writing %d word pair count to %s...' % (len(word_pair_count), save_path))
     for pair, count in word_pair_count.items():
         fout.write('%s\t%s\t%.8f\n' % (pair[0], pair[1], count))
@@ -454,83 +560,204 @@ def extract_word_word_attn_weights(pool, total_weights, total_offsets, total_lin
                     start_j, end_j = cur_offset[word_j]
                     params.append((batch_weights, item_idx, word_i, word_j, start_i, end_i, start_j, end_j))
         
-        weight_res = {item[:-1]: item[-1] for item in list(pool.map(weight_sum, params))}
+        with metrics.timer('weight_sum'):
+            weight_res = {item[:-1]: item[-1] for item in list(pool.map(weight_sum, params))}
+        metrics.count('word_pairs', len(params))
         # print(weight_res)
-        for item_idx in range(batch_size):
-            length = batch_lengths[item_idx]
-            batch_write_res.append('###' + batch_lines[item_idx].strip())
-            for word_i in range(length):
-                res = []
-                for word_j in range(length):
-                    res.append(f'{word_j}:{weight_res[(item_idx, word_i, word_j)]}')
-                batch_write_res.append(f"{word_i}###" + ' '.join(res))
+        with metrics.timer('format'):
+            for item_idx in range(batch_size):
+                length = batch_lengths[item_idx]
+                batch_write_res.append('###' + batch_lines[item_idx].strip())
+                for word_i in range(length):
+                    res = []
+                    for word_j in range(length):
+                        res.append(f'{word_j}:{weight_res[(item_idx, word_i, word_j)]}')
+                    batch_write_res.append(f"{word_i}###" + ' '.join(res))
         write_res.extend(batch_write_res)
 
     return write_res
 
-def dump_self_attention_weights(model_name, corpus, batch_size, outpath, model, tokenizer):
-
-    dataset = load_data(corpus)
+def extract_word_attn_bands(writer, total_weights, total_offsets, total_lines, total_lengths):
+    for (batch_weights, batch_offsets, batch_lines, batch_lengths) in zip(total_weights, total_offsets, total_lines, total_lengths):
+        for item_idx in range(len(batch_lines)):
+            length = int(batch_lengths[item_idx])
+            band = word_attention_band(batch_weights[item_idx], batch_offsets[item_idx], length, writer.window_size)
+            writer.add(batch_lines[item_idx].strip().split(), band)
+    writer.flush()
+
+def sum_attention_weights(attentions, batch_size):
+    # (batch_size, head_num, max_len, max_len) * layer_num -> (batch_size, max_len, max_len)
+    layer_num = len(attentions)
+    layer_san_weights = torch.zeros(layer_num, batch_size, attentions[0].size(-1), attentions[0].size(-1))
+    # sum all head weights
+    for layer_idx in range(layer_num):
+        layer_san_weights[layer_idx] = attentions[layer_idx].sum(1)
+    return layer_san_weights.sum(0).numpy()  # (layer_num, batch_size, max_len, max_len) -> (batch_size, max_len, max_len)
+
+def dump_self_attention_weights(model_name, corpus, batch_size, outpath, model, tokenizer, band_window=0, dataset=None,
+                                layer_range=None):
+    # band_window > 0 writes the banded binary layout of san_band.py instead of full text rows;
+    # layer_range (first, last) sums only those layers and stops the encoder after the last one (san_layers.py)
+
+    ckpt_path, ckpt_key, state = dump_checkpoint('dump_self_attention_weights', corpus, outpath,
+                                                 band_window if layer_range is None else (band_window, layer_range))
+    if state and state['complete']:
+        print('dump already complete:', outpath)
+        return
+    start_line = state['next_line'] if state else 0
+    metrics.start('dump_self_attention_weights')
+    with metrics.timer('load_data'):
+        dataset = load_data(corpus, start_line) if dataset is None else [item for item in dataset if item[1] >= start_line]
     custom_dataset = CustomDataset(model_name, dataset, tokenizer)
     dataloader = DataLoader(custom_dataset, batch_size=batch_size, shuffle=False, num_workers=0, collate_fn=collate_fn)
     print("Finish building custom datast!")
 
-    pool = Pool(40)
-    fout = codecs.open(outpath, 'w+', 'utf-8')
+    if band_window > 0:
+        writer = BandDumpWriter(outpath, band_window, state['band'] if state else None)
+    else:
+        pool = Pool(40)
+        fout = resume_output(outpath, state['offset'], state['block_offsets']) if state else open_output(outpath)
+    static_forward = static_graph.attention_sum(model, batch_size, layer_range) if static_graph.settings['enabled'] else None
+    if layer_range is not None:
+        print('SAN layers %d-%d, the upper layers and the pooler are skipped' % layer_range)
+
+    def flush_buffer(*buffers):
+        if band_window > 0:
+            with metrics.timer('extract_bands'):
+                extract_word_attn_bands(writer, *buffers)
+        else:
+            write_res = extract_word_word_attn_weights(pool, *buffers)
+            with metrics.timer('write'):
+                [fout.write(item + '\n') for item in write_res]
+                fout.flush()
+
     total_weights, total_offsets, total_lines, total_lengths = [], [], [], []
+    done = 0
     with torch.no_grad():
-        for batch_idx, batch_data in tqdm(enumerate(dataloader), total=len(dataloader)):
-            if (batch_idx+1) % 1e2 == 0:
-                buffer = extract_word_word_attn_weights(pool, total_weights, total_offsets, total_lines, total_lengths)
-                [fout.write(item + '\n') for item in buffer]
-                fout.flush()
+        for batch_idx, batch_data in tqdm(enumerate(metrics.timed_iter('tokenize_collate', dataloader)), total=len(dataloader)):
+            if (batch_idx+1) % 1e2 == 0 or checkpoint.due():
+                flush_buffer(total_weights, total_offsets, total_lines, total_lengths)
+                done += sum(len(lines) for lines in total_lines)
+                save_dump_checkpoint(ckpt_path, ckpt_key, writer if band_window > 0 else fout, dataset, done, start_line)
                 total_weights, total_offsets, total_lines, total_lengths = [], [], [], []
 
             input_ids, masks, line_texts = batch_data['wordpiece_ids'], batch_data['wordpiece_masks'], batch_data['line_text']
             lengths, offsets = batch_data["lengths"], batch_data['offsets'] #[batch_size, max_word, 2]
             batch_size = len(lengths)
 
-            outputs = model(input_ids=input_ids, attention_mask=masks, output_attentions=True)
-            attentions = outputs.attentions # (batch_size, head_num, max_len, max_len) * layer_num
-            layer_num = len(attentions)  
-            layer_san_weights = torch.zeros(layer_num, batch_size, attentions[0].size(-1), attentions[0].size(-1))
-            # sum all head weights
-            for layer_idx in range(layer_num):
-                layer_san_weights[layer_idx] = attentions[layer_idx].sum(1)
-            batch_weights = layer_san_weights.sum(0).numpy()  # (layer_num, batch_size, max_len, max_len) -> (batch_size, max_len, max_len)
+            if static_forward is not None:
+                # padded to a length bucket, forward and head / layer sum in one compiled graph
+                with metrics.timer('forward_attention_sum'):
+                    batch_weights = static_forward(input_ids, masks)[0]
+            elif layer_range is not None:
+                with metrics.timer('forward'):
+                    attentions = static_graph.truncated_encoder(model, layer_range)(input_ids, masks)
+                with metrics.timer('attention_sum'):
+                    # MindSpore tensors of the selected layers, summed over heads and layers in numpy
+                    batch_weights = sum(item.asnumpy().sum(1) for item in attentions)
+            else:
+                with metrics.timer('forward'):
+                    outputs = model(input_ids=input_ids, attention_mask=masks, output_attentions=True)
+                with metrics.timer('attention_sum'):
+                    batch_weights = sum_attention_weights(outputs.attentions, batch_size)
             total_weights.append(batch_weights)
             total_offsets.append(offsets)
             total_lines.append(line_texts)
             total_lengths.append(lengths)
+            count_batch(masks, batch_size)
 
     print('writing final buffer data......')
-    buffer = extract_word_word_attn_weights(pool, total_weights, total_offsets, total_lines, total_lengths)
-    for item in buffer: fout.write(item + '\n')
+    flush_buffer(total_weights, total_offsets, total_lines, total_lengths)
     
     sys.stdout.flush()
-    pool.close()
-    fout.close()
+    if band_window > 0:
+        writer.close()
+    else:
+        pool.close()
+        fout.close()
+    checkpoint.save(ckpt_path, ckpt_key, complete=True)
+    if static_forward is not None:
+        static_forward.report()
+    finish_dump_metrics()
+
+
+def aggregate_checkpoint(dump_file, job, configs, memory_mb=0, top_n=0):
+    # approximate tables hash their str keys, so they only resume in a process with the same PYTHONHASHSEED
+    key = (job, os.path.abspath(dump_file), os.path.getsize(dump_file), [item[:2] for item in configs], memory_mb, top_n,
+           hash(job) if memory_mb > 0 else 0)
+    return checkpoint.checkpoint_path(dump_file, job), key
+
+
+def aggregate_dump_file(dump_file, parse_fn, configs, memory_mb, top_n, num_workers, ckpt_path, ckpt_key):
+    # parse_fn over the dump -> tables (None when a resumed checkpoint is already complete); with checkpoints the
+    # dump is parsed in '###' aligned ranges and the partial tables are saved every --checkpoint_interval seconds
+    parallel = num_workers > 1 and memory_mb <= 0
+    if not checkpoint.enabled():
+        if parallel:
+            return parallel_parse(dump_file, parse_fn, sum_dict_list, num_workers, args=(configs,), header=DUMP_HEADER)
+        return parse_fn(iter_lines(dump_file), configs, new_bigram_tables(len(configs), memory_mb, top_n))
+
+    state = checkpoint.load(ckpt_path, ckpt_key)
+    if state and state['complete']:
+        return None
+    if state:
+        ranges, done, bigram_tables = state['ranges'], state['done'], state['tables']
+    else:
+        num_ranges = max(num_workers * 4, os.path.getsize(dump_file) // CHECKPOINT_RANGE_BYTES + 1)
+        ranges, done = split_ranges(dump_file, num_ranges, DUMP_HEADER), 0
+        bigram_tables = None if parallel else new_bigram_tables(len(configs), memory_mb, top_n)
+
+    def save_partial(num_done, tables):
+        if checkpoint.due():
+            checkpoint.save(ckpt_path, ckpt_key, ranges=ranges, done=done + num_done, tables=tables)
+
+    if parallel:
+        bigram_tables = parallel_parse(dump_file, parse_fn, sum_dict_list, num_workers, args=(configs,), header=DUMP_HEADER,
+                                       ranges=ranges[done:], total=bigram_tables, on_partial=save_partial)
+    else:
+        for range_idx, (range_start, range_end) in enumerate(ranges[done:]):
+            bigram_tables = parse_fn(iter_lines(dump_file, range_start, range_end, header=DUMP_HEADER), configs, bigram_tables)
+            save_partial(range_idx + 1, bigram_tables)
+    return bigram_tables if bigram_tables is not None else [{} for _ in configs]
+
+
+def write_aggregated_tables(dump_file, configs, bigram_tables, ckpt_path, ckpt_key):
+    if bigram_tables is None:
+        print('co-occurrences already written from:', dump_file)
+        return
+    for (_, _, coo_path), bigram_table in zip(configs, bigram_tables):
+        with metrics.timer('write_table'):
+            write_table_to_file(bigram_table, coo_path)
+        metrics.count('pairs', len(bigram_table))
+        if isinstance(bigram_table, BoundedPairTable):
+            bigram_table.report()
+    checkpoint.save(ckpt_path, ckpt_key, complete=True)
 
 
 def write_table_to_file(table, path):
     print('writing table to:%s' % path)
-    fout = codecs.open(path, mode='w+', encoding='utf-8')
+    fout = open_output(path)
     for k, v in table.items():
         fout.write("%s\t%s\t%.8f\n" % (k[0], k[1], v))
     fout.close()
 
 
-def cal_san_word_coo(dump_file, coo_path, window_size, use_divide, use_reciprocal):
-    if not os.path.exists(dump_file):
-        print('dump file does not exit: ', dump_file)
-        exit()
+def cal_san_word_coo(dump_file, coo_path, window_size, use_divide, use_reciprocal, memory_mb=0, top_n=0, num_workers=1):
+    weighting = 'reciprocal' if use_reciprocal else 'divide' if use_divide else None
+    cal_san_word_coo_sweep(dump_file, [(window_size, weighting, coo_path)], memory_mb, top_n, num_workers)
+
 
+def aggregate_san_dump_lines(lines, configs, bigram_tables=None):
+    # configs: [(window_size, weighting, coo_path)], the SAN dump holds full rows so any window works
     start = time.time()
-    bigram_table, line_num = {}, 0
-    for line in codecs.open(dump_file, 'r', 'utf-8'):
+    bigram_tables = [{} for _ in configs] if bigram_tables is None else bigram_tables
+    line_num = 0
+    for line in lines:
         if line.startswith('###'):
             line_num += 1
             line_words = line[3:].strip().split()
+            metrics.count('sentences')
+            metrics.report()
             if line_num % 1e5 == 0:
                 print('%.2fs processing %d line text.' % (time.time() - start, line_num))
                 sys.stdout.flush()
@@ -550,38 +777,44 @@ def cal_san_word_coo(dump_file, coo_path, window_size, use_divide, use_reciproca
                 print('parts:', parts)
                 print(f'###{line_words}')
                 continue
-            
-            left = 0 if (word_position - window_size) < 0 else (word_position - window_size)
-            right = sen_len if (word_position + window_size + 1) > sen_len else (
-                        word_position + window_size + 1)
-            context = parts[left: word_position] + parts[word_position + 1: right]
-            context_scores = np.array([float(item.rsplit(':', maxsplit=1)[1]) for item in context])
-            context_words = [item.rsplit(':', maxsplit=1)[0] for item in context]
-            context_words = [line_words[int(item)] for item in context_words]
-
-            top_scores_idx = context_scores.argsort()[::-1][: window_size + 1]
-            top_scores = context_scores[top_scores_idx]
-            top_tokens = [context_words[idx] for idx in top_scores_idx]
-            if len(top_scores) < 1:
-                print("wrong line:", line_words)
-                print("wrong weight:", line)
-                continue
-            
-            bench = top_scores[0]  # use first predict token score as benchmark
 
-            if use_reciprocal:
-                scores = np.reciprocal(np.linspace(1, len(top_tokens), num=len(top_scores)))
+            row_scores = np.array([float(item.rsplit(':', maxsplit=1)[1]) for item in parts])
+            row_words = [line_words[int(item.rsplit(':', maxsplit=1)[0])] for item in parts]
+
+            for (window_size, weighting, _), bigram_table in zip(configs, bigram_tables):
+                left = 0 if (word_position - window_size) < 0 else (word_position - window_size)
+                right = sen_len if (word_position + window_size + 1) > sen_len else (
+                            word_position + window_size + 1)
+                context_scores = np.concatenate([row_scores[left: word_position], row_scores[word_position + 1: right]])
+                context_words = row_words[left: word_position] + row_words[word_position + 1: right]
+
+                top_scores_idx = context_scores.argsort()[::-1][: window_size + 1]
+                top_scores = context_scores[top_scores_idx]
+                top_tokens = [context_words[idx] for idx in top_scores_idx]
+                if len(top_scores) < 1:
+                    print("wrong line:", line_words)
+                    print("wrong weight:", line)
+                    continue
+
+                bench = top_scores[0]  # use first predict token score as benchmark
+                scores = reweight_scores(top_scores, bench, weighting)
+                add_pair_scores(bigram_table, target_token, top_tokens, scores)
 
-            elif use_divide:
-                scores = [item / bench for item in top_scores]
+    return bigram_tables
 
-            for index, pair in enumerate(zip([target_token] * len(top_tokens), top_tokens)):
-                if pair in bigram_table and scores[index] > 1e-9:
-                    bigram_table[pair] += scores[index]
-                else:
-                    bigram_table[pair] = scores[index]
 
-    write_table_to_file(bigram_table, coo_path)
+def cal_san_word_coo_sweep(dump_file, configs, memory_mb=0, top_n=0, num_workers=1):
+    if not os.path.exists(dump_file):
+        print('dump file does not exit: ', dump_file)
+        exit()
+
+    metrics.start('aggregate_san')
+    ckpt_path, ckpt_key = aggregate_checkpoint(dump_file, 'aggregate_san', configs, memory_mb, top_n)
+    with metrics.timer('aggregate'):
+        bigram_tables = aggregate_dump_file(dump_file, aggregate_san_dump_lines, configs, memory_mb, top_n, num_workers,
+                                            ckpt_path, ckpt_key)
+    write_aggregated_tables(dump_file, configs, bigram_tables, ckpt_path, ckpt_key)
+    metrics.finish(dump_mb=os.path.getsize(dump_file) / 1048576.0)
 
 
 def init_model(model_name, bert_path):
@@ -599,8 +832,8 @@ def init_model(model_name, bert_path):
 
 def self_attention_sem_glove(model_name, corpus_name, corpus_path, dump_path, coo_path, batch_size, model, tokenizer, vocab_path,
                              window_size, use_divide, use_reciprocal):
-    word_dump_path = os.path.join(dump_path, f'{model_name}.{corpus_name}.word.san.dump')
-    word_coo_path = os.path.join(coo_path, f'{model_name}.window{window_size}.{corpus_name}.word.san.coo')
+    word_dump_path = output_path(os.path.join(dump_path, f'{model_name}.{corpus_name}.word.san.dump'))
+    word_coo_path = output_path(os.path.join(coo_path, f'{model_name}.window{window_size}.{corpus_name}.word.san.coo'))
     print('Corpus file:', corpus_path)
     print('Word dump path:', word_dump_path)
     print('Word coo path:', word_coo_path)
@@ -614,13 +847,13 @@ def self_attention_sem_glove(model_name, corpus_name, corpus_path, dump_path, co
 def mlm_sem_glove(corpus_name, corpus_path, dump_path, coo_path, batch_size, model, tokenizer, window_size, reciprocal, 
                   divide, vocab_path, wordpairpath):
     if reciprocal:
-        bpe_dump_path = os.path.join(dump_path, "mlm.bpe.dump.%s.windowsize%d.reciprocal.txt" % (corpus_name, window_size)) # mlm.bpe.coo.xaa.windowsize10.reciprocal.txt
-        bpe_coo_path = os.path.join(coo_path, "mlm.bpe.coo.%s.windowsize%d.reciprocal.txt" % (corpus_name, window_size)) # mlm.bpe.coo.xaa.windowsize10.reciprocal.txt
-        word_coo_path = os.path.join(coo_path, "mlm.word.coo.%s.windowsize%d.reciprocal.txt" % (corpus_name, window_size)) # mlm.word.coo.xaa.windowsize10.reciprocal.txt
+        bpe_dump_path = output_path(os.path.join(dump_path, "mlm.bpe.dump.%s.windowsize%d.reciprocal.txt" % (corpus_name, window_size))) # mlm.bpe.coo.xaa.windowsize10.reciprocal.txt
+        bpe_coo_path = output_path(os.path.join(coo_path, "mlm.bpe.coo.%s.windowsize%d.reciprocal.txt" % (corpus_name, window_size))) # mlm.bpe.coo.xaa.windowsize10.reciprocal.txt
+        word_coo_path = output_path(os.path.join(coo_path, "mlm.word.coo.%s.windowsize%d.reciprocal.txt" % (corpus_name, window_size))) # mlm.word.coo.xaa.windowsize10.reciprocal.txt
     elif divide:
-        bpe_dump_path = os.path.join(dump_path, "mlm.bpe.dump.%s.windowsize%d.divide.txt" % (corpus_name, window_size)) # mlm.bpe.coo.xaa.windowsize10.reciprocal.txt
-        bpe_coo_path = os.path.join(coo_path, "mlm.bpe.coo.%s.windowsize%d.divide.txt" % (corpus_name, window_size))  # mlm.bpe.xaa.coo.windowsize10.reciprocal.txt
-        word_coo_path = os.path.join(coo_path, "mlm.word.coo.%s.windowsize%d.divide.txt" % (corpus_name, window_size))  # mlm.word.xaa.coo.windowsize10.reciprocal.txt
+        bpe_dump_path = output_path(os.path.join(dump_path, "mlm.bpe.dump.%s.windowsize%d.divide.txt" % (corpus_name, window_size))) # mlm.bpe.coo.xaa.windowsize10.reciprocal.txt
+        bpe_coo_path = output_path(os.path.join(coo_path, "mlm.bpe.coo.%s.windowsize%d.divide.txt" % (corpus_name, window_size)))  # mlm.bpe.xaa.coo.windowsize10.reciprocal.txt
+        word_coo_path = output_path(os.path.join(coo_path, "mlm.word.coo.%s.windowsize%d.divide.txt" % (corpus_name, window_size)))  # mlm.word.xaa.coo.windowsize10.reciprocal.txt
     else:
         raise ValueError('Please specific reweight method!')
 
@@ -634,6 +867,56 @@ def mlm_sem_glove(corpus_name, corpus_path, dump_path, coo_path, batch_size, mod
     # convert_txt_to_bin(vocab_path, word_coo_path, word_coo_path + '.bin')
 
 
+def self_attention_sem_glove_sweep(model_name, corpus_name, corpus_path, dump_path, coo_root, batch_size, model, tokenizer,
+                                   sweep_configs, banded=False, memory_mb=0, top_n=0, num_workers=1, dataset=None,
+                                   layer_range=None):
+    max_window = max(item[0] for item in sweep_configs)
+    san = 'san' if layer_range is None else 'san.' + layer_range_name(layer_range)
+    if banded:
+        word_dump_path = os.path.join(dump_path, f'{model_name}.{corpus_name}.window{max_window}.word.{san}.band')
+    else:
+        word_dump_path = output_path(os.path.join(dump_path, f'{model_name}.{corpus_name}.word.{san}.dump'))
+    configs = []
+    for window_size, weighting in sweep_configs:
+        coo_path = os.path.join(coo_root, f'window{window_size}', weighting)
+        if not os.path.exists(coo_path):
+            os.makedirs(coo_path)
+        configs.append((window_size, weighting, output_path(os.path.join(coo_path, f'{model_name}.window{window_size}.{corpus_name}.word.{san}.coo'))))
+
+    print('Corpus file:', corpus_path)
+    print('Word dump path:', word_dump_path)
+    for window_size, weighting, word_coo_path in configs:
+        print('Word coo path (window %d, %s): %s' % (window_size, weighting, word_coo_path))
+    if banded:
+        dump_self_attention_weights(model_name, corpus_path, batch_size, word_dump_path, model, tokenizer, band_window=max_window,
+                                    dataset=dataset, layer_range=layer_range)
+        cal_san_word_coo_banded(word_dump_path, configs, memory_mb=memory_mb, top_n=top_n)
+    else:
+        dump_self_attention_weights(model_name, corpus_path, batch_size, word_dump_path, model, tokenizer, dataset=dataset,
+                                    layer_range=layer_range)
+        cal_san_word_coo_sweep(word_dump_path, configs, memory_mb, top_n, num_workers)
+
+
+def mlm_sem_glove_sweep(corpus_name, corpus_path, dump_path, coo_root, batch_size, model, tokenizer, sweep_configs,
+                        memory_mb=0, top_n=0, num_workers=1, dataset=None):
+    # dump top-(max_window+1) predictions once and aggregate every (window, weighting) pair in one pass
+    max_window = max(item[0] for item in sweep_configs)
+    bpe_dump_path = output_path(os.path.join(dump_path, "mlm.bpe.dump.%s.windowsize%d.sweep.txt" % (corpus_name, max_window)))
+    configs = []
+    for window_size, weighting in sweep_configs:
+        coo_path = os.path.join(coo_root, f'window{window_size}')
+        if not os.path.exists(coo_path):
+            os.makedirs(coo_path)
+        configs.append((window_size, weighting, output_path(os.path.join(coo_path, "mlm.bpe.coo.%s.windowsize%d.%s.txt" % (corpus_name, window_size, weighting)))))
+
+    print('corpus file path:', corpus_path)
+    print('bpe dump path:', bpe_dump_path)
+    for window_size, weighting, bpe_coo_path in configs:
+        print('bpe coo path (window %d, %s): %s' % (window_size, weighting, bpe_coo_path))
+    dump_mlm_predictions(corpus_path, bpe_dump_path, batch_size, model, tokenizer, max_window, dataset=dataset)
+    get_mlm_bpe_cooccurr_sweep_from_dump_file(configs, bpe_dump_path, memory_mb, top_n, num_workers)
+
+
 if __name__=='__main__':
 
     print(datetime.datetime.now())
@@ -654,6 +937,26 @@ if __name__=='__main__':
     parser.add_argument('--san_glove', action='store_true')
     parser.add_argument('--mlm_glove', action='store_true')
     parser.add_argument('--txt2bin', action='store_true')
+    parser.add_argument('--shuffle_bin', action='store_true', help='write the --txt2bin records already shuffled')
+    parser.add_argument('--shuffle_memory_mb', default=2048, type=float)
+    parser.add_argument('--shuffle_seed', default=1, type=int)
+    parser.add_argument('--sweep_windows', default='', help='comma separated window sizes, e.g. 5,10,20')
+    parser.add_argument('--sweep_weightings', default='divide,reciprocal')
+    parser.add_argument('--san_band', action='store_true', help='dump SAN weights as a float16 band limited to the window')
+    parser.add_argument('--approx_memory_mb', default=0, type=float, help='bounded memory approximate aggregation, 0 is exact')
+    parser.add_argument('--approx_top_n', default=0, type=int, help='keep at most top-N contexts per target word')
+    parser.add_argument('--num_workers', default=1, type=int, help='processes used to parse dump and co-occurrence files')
+    parser.add_argument('--compress', action='store_true', help='write dumps and co-occurrences as block compressed .gz')
+    parser.add_argument('--compress_level', default=6, type=int)
+    parser.add_argument('--compress_threads', default=4, type=int)
+    parser.add_argument('--metrics_file', default='', help='append stage timers, counters and RSS as JSON lines')
+    parser.add_argument('--metrics_interval', default=30.0, type=float, help='seconds between periodic metrics records')
+    parser.add_argument('--profile', default='', choices=['', 'cprofile', 'sample'], help='profile the jobs into the metrics file')
+    parser.add_argument('--checkpoint_interval', default=900.0, type=float, help='seconds between dump / aggregation checkpoints, 0 is off')
+    parser.add_argument('--resume', action='store_true', help='continue the dump and aggregation jobs from their checkpoints')
+    parser.add_argument('--static_graph', action='store_true', help='compiled forward on batches padded to length buckets')
+    parser.add_argument('--buckets', default='32,64,128,256,512', help='wordpiece length buckets of --static_graph, 512 is always added')
+    parser.add_argument('--san_layers', default='', help='sum the SAN attention of layers FIRST-LAST only (0-based), default all')
 
     args = parser.parse_args()
 
@@ -673,13 +976,40 @@ if __name__=='__main__':
     word_pair_path = args.word_pair_path
     san_glove = args.san_glove
     mlm_glove = args.mlm_glove
+    sweep_configs = parse_sweep_configs(args.sweep_windows, args.sweep_weightings)
+    block_io.configure(args.compress, args.compress_level, args.compress_threads)
+    metrics.configure(args.metrics_file, args.profile, args.metrics_interval)
+    checkpoint.configure(args.checkpoint_interval, args.resume)
+    static_graph.configure(args.static_graph, static_graph.parse_buckets(args.buckets))
+    if (args.san_band or args.san_layers) and not sweep_configs:
+        # both only exist on the sweep path, so a single --window_size run becomes a one-setting sweep
+        sweep_configs = [(window_size, 'reciprocal' if use_reciprocal else 'divide')]
 
     sys.stdout.flush()
 
     print('model name:', model_name)
     model, masked_model, tokenizer = init_model(model_name, bert_path)
     if args.txt2bin:
-        convert_txt_to_bin(vocab_path, word_pair_path, os.path.join(word_pair_path, '.bin'))
+        convert_txt_to_bin(vocab_path, word_pair_path, os.path.join(word_pair_path, '.bin'), args.shuffle_bin,
+                           args.shuffle_memory_mb, args.shuffle_seed)
+    elif san_glove and sweep_configs:
+        print('-' * 50 + 'SAN GLOVE SWEEP' + '-' * 50)
+        dump_path = os.path.join(save_path, model_name, 'san', 'dump_weights')
+        if not os.path.exists(dump_path):
+            os.makedirs(dump_path)
+        self_attention_sem_glove_sweep(model_name, corpus_name, corpus_path, dump_path,
+                                       os.path.join(save_path, model_name, 'san', 'cooccur'),
+                                       batch_size, model, tokenizer, sweep_configs, banded=args.san_band,
+                                       memory_mb=args.approx_memory_mb, top_n=args.approx_top_n, num_workers=args.num_workers,
+                                       layer_range=parse_layer_range(args.san_layers))
+    elif mlm_glove and sweep_configs:
+        print('-' * 50 + 'MLM GLOVE SWEEP' + '-' * 50)
+        dump_path = os.path.join(save_path, model_name, 'mlm', 'dump_weights')
+        if not os.path.exists(dump_path):
+            os.makedirs(dump_path)
+        mlm_sem_glove_sweep(corpus_name, corpus_path, dump_path, os.path.join(save_path, model_name, 'mlm', 'cooccur'),
+                            batch_size, masked_model, tokenizer, sweep_configs,
+                            memory_mb=args.approx_memory_mb, top_n=args.approx_top_n, num_workers=args.num_workers)
     elif san_glove:
         print('-' * 50 + 'SAN GLOVE' + '-' * 50)
         dump_path = os.path.join(save_path, model_name, 'san', 'dump_weights')
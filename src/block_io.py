@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+# Block compressed text files.
+#
+# A '.gz' output is written as a sequence of independent gzip members of about block_size
+# uncompressed bytes, every member ending at a line boundary, so the file is still readable by
+# gzip/zcat. Members are compressed in a thread pool (zlib releases the GIL) and the compressed
+# offset of every member is stored in '<path>.idx', which lets parallel_reader split the file by
+# blocks. Compression of the dump and co-occurrence outputs is switched on with configure().
+import gzip
+import os
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+SUFFIX = '.gz'
+INDEX_SUFFIX = '.idx'
+BLOCK_SIZE = 4 << 20
+
+settings = {'enabled': False, 'level': 6, 'threads': 4}
+
+
+def configure(enabled=True, level=6, threads=4):
+    settings.update(enabled=enabled, level=level, threads=threads)
+
+
+def output_path(path):
+    return path + SUFFIX if settings['enabled'] and not path.endswith(SUFFIX) else path
+
+
+def is_compressed(path):
+    return path.endswith(SUFFIX)
+
+
+def compress_block(data, level):
+    return zlib.compress(data, level, wbits=31)
+
+
+def decompress_block(data):
+    return zlib.decompress(data, wbits=31)
+
+
+class BlockWriter(object):
+    def __init__(self, path, level=None, num_threads=None, block_size=BLOCK_SIZE, encoding='utf-8', offsets=None):
+        # offsets: block index of a file written up to its last block, the writer appends after it
+        self.level = settings['level'] if level is None else level
+        num_threads = settings['threads'] if num_threads is None else num_threads
+        self.block_size = block_size
+        self.encoding = encoding
+        self.index_path = path + INDEX_SUFFIX
+        if offsets is None:
+            self.fout = open(path, 'wb')
+            self.offsets = [0]
+        else:
+            self.fout = open(path, 'r+b')
+            self.fout.truncate(offsets[-1])
+            self.fout.seek(offsets[-1])
+            self.offsets = list(offsets)
+        self.buffer, self.buffered = [], 0
+        self.pool = ThreadPoolExecutor(max(1, num_threads))
+        self.pending = deque()
+        self.max_pending = 2 * max(1, num_threads)
+        self.bytes_in = 0
+
+    def write(self, text):
+        data = text.encode(self.encoding)
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.block_size:
+            self.cut_block()
+
+    def cut_block(self, force=False):
+        data = b''.join(self.buffer)
+        cut = len(data) if force else data.rfind(b'\n') + 1
+        if cut <= 0:
+            return
+        self.buffer = [data[cut:]] if cut < len(data) else []
+        self.buffered = len(data) - cut
+        self.bytes_in += cut
+        self.pending.append(self.pool.submit(compress_block, data[:cut], self.level))
+        while len(self.pending) > self.max_pending:
+            self.write_block(self.pending.popleft().result())
+
+    def write_block(self, block):
+        self.fout.write(block)
+        self.offsets.append(self.offsets[-1] + len(block))
+
+    def flush(self):
+        self.cut_block()
+        while self.pending:
+            self.write_block(self.pending.popleft().result())
+        self.fout.flush()
+
+    def close(self):
+        self.cut_block(force=True)
+        while self.pending:
+            self.write_block(self.pending.popleft().result())
+        self.pool.shutdown()
+        self.fout.close()
+        np.array(self.offsets, dtype=np.int64).tofile(self.index_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_output(path, mode='w+', encoding='utf-8'):
+    # text writer for path, block compressed when it ends with '.gz'
+    if is_compressed(path):
+        return BlockWriter(path, encoding=encoding)
+    return open(path, mode, encoding=encoding)
+
+
+def resume_output(path, offset, offsets=None, encoding='utf-8'):
+    # reopen an output written up to offset (a checkpoint): later bytes are dropped and writes append
+    if is_compressed(path):
+        return BlockWriter(path, encoding=encoding, offsets=offsets)
+    with open(path, 'r+b') as fout:
+        fout.truncate(offset)
+    return open(path, 'a', encoding=encoding)
+
+
+def open_binary(path):
+    if is_compressed(path):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def block_offsets(path):
+    index_path = path + INDEX_SUFFIX
+    if os.path.exists(index_path):
+        return np.fromfile(index_path, dtype=np.int64)
+    # no index: the whole file is a single (possibly multi member) range
+    return np.array([0, os.path.getsize(path)], dtype=np.int64)
+
+
+def num_blocks(path):
+    return len(block_offsets(path)) - 1
+
+
+def uncompressed_size(path):
+    # bytes of text in path; a block compressed file reads the size field (ISIZE) at the end of every member
+    if not is_compressed(path):
+        return os.path.getsize(path)
+    if not os.path.exists(path + INDEX_SUFFIX):
+        # ISIZE of a single member is modulo 4GB, so count the bytes of a file without index
+        return sum(len(block) for block in iter_blocks(path))
+    offsets = block_offsets(path)
+    total = 0
+    with open(path, 'rb') as fin:
+        for end in offsets[1:]:
+            fin.seek(end - 4)
+            total += int(np.frombuffer(fin.read(4), dtype='<u4')[0])
+    return total
+
+
+def iter_blocks(path, start_block=0, end_block=None, num_threads=None):
+    # decompressed blocks [start_block, end_block), decompressed ahead in a thread pool
+    offsets = block_offsets(path)
+    end_block = len(offsets) - 1 if end_block is None else end_block
+    num_threads = settings['threads'] if num_threads is None else num_threads
+    if len(offsets) == 2 and not os.path.exists(path + INDEX_SUFFIX):
+        with gzip.open(path, 'rb') as fin:
+            while True:
+                data = fin.read(BLOCK_SIZE)
+                if not data:
+                    return
+                yield data
+    with open(path, 'rb') as fin, ThreadPoolExecutor(max(1, num_threads)) as pool:
+        pending = deque()
+        for block_idx in range(start_block, end_block):
+            fin.seek(offsets[block_idx])
+            pending.append(pool.submit(decompress_block, fin.read(offsets[block_idx + 1] - offsets[block_idx])))
+            if len(pending) > 2 * num_threads:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_block_lines(path, start_block=0, end_block=None, header=None, encoding='utf-8', errors='strict'):
+    # lines of blocks [start_block, end_block); with a header, lines before the first header are left to
+    # the previous range and lines after end_block are read until the next header
+    total_blocks = num_blocks(path)
+    end_block = total_blocks if end_block is None else end_block
+    skipping = header is not None and start_block > 0
+    rest = b''
+    for block_idx, block in enumerate(iter_blocks(path, start_block, total_blocks if header is not None else end_block)):
+        lines = (rest + block).split(b'\n')
+        rest = lines.pop()
+        past_end = start_block + block_idx >= end_block
+        for line in lines:
+            if header is not None and line.startswith(header):
+                if past_end:
+                    return
+                skipping = False
+            if not skipping:
+                yield line.decode(encoding, errors)
+    if rest and not skipping:
+        yield rest.decode(encoding, errors)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Restart points of the long dump and aggregation jobs.
+#
+# A checkpoint is a pickled dict next to the output ('<output>.ckpt'), replaced atomically (temp file, fsync,
+# rename), so a crash leaves either the previous or the new one. The jobs save
+#   dump          the next corpus line, the byte offset of the output after the last flush (and the block index
+#                 of a .gz output, or the sizes and vocab of a SAN band dump)
+#   aggregation   the number of '###' aligned dump ranges done and the partial co-occurrence tables
+# at most every --checkpoint_interval seconds, and mark the checkpoint complete at the end. With --resume a job
+# with a complete checkpoint is skipped, an unfinished one truncates its output to the saved offset and goes on
+# from the saved line or range; without --resume the jobs start over as before.
+#
+#   python src/bert_cooccur_mindspore.py --corpus_name xaa --model_name bert-large-uncased --mlm_glove --sweep_windows 5,10 --resume
+import os
+import pickle
+import time
+import metrics
+from block_io import BlockWriter
+
+SUFFIX = '.ckpt'
+
+settings = {'interval': 900.0, 'resume': False}
+last_save = {'time': 0.0}
+
+
+def configure(interval=900.0, resume=False):
+    # interval <= 0 switches checkpoints off
+    settings.update(interval=interval, resume=resume)
+    last_save['time'] = time.time()
+
+
+def checkpoint_path(path, job=''):
+    return '%s%s%s' % (path, '.' + job if job else '', SUFFIX)
+
+
+def enabled():
+    return settings['interval'] > 0
+
+
+def due():
+    return enabled() and time.time() - last_save['time'] >= settings['interval']
+
+
+def load(path, key):
+    # the saved state when resuming and it was written for the same key (job, input, settings), else None
+    if not settings['resume'] or not os.path.exists(path):
+        return None
+    with open(path, 'rb') as fin:
+        state = pickle.load(fin)
+    if state.get('key') != key:
+        print('checkpoint %s was written for %s, starting over' % (path, state.get('key')))
+        return None
+    print('resuming from checkpoint %s%s' % (path, ' (complete)' if state.get('complete') else ''))
+    return state
+
+
+def save(path, key, complete=False, **state):
+    if not enabled():
+        return
+    with metrics.timer('checkpoint'):
+        state.update(key=key, complete=complete, time=time.strftime('%Y-%m-%d %H:%M:%S'))
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as fout:
+            pickle.dump(state, fout, protocol=pickle.HIGHEST_PROTOCOL)
+            fout.flush()
+            os.fsync(fout.fileno())
+        os.replace(temp_path, path)
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    metrics.count('checkpoints')
+    last_save['time'] = time.time()
+
+
+def output_offset(fout):
+    # (bytes of the flushed output, block index of a .gz output or None)
+    if isinstance(fout, BlockWriter):
+        return fout.offsets[-1], list(fout.offsets)
+    return fout.tell(), None
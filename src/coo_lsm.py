@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+# Incremental co-occurrence store: new corpus shards are added as sorted delta segments instead of re-running
+# the dump and merge_coo_matrix over the whole corpus.
+#
+# A store is a directory with
+#   MANIFEST.json   vocab (path, sha1, number of ids), the shards that were added and the live segments of every
+#                   (window, weighting) setting, replaced atomically on every change
+#   seg-N.keys      int64 word1 * num_cols + word2 (ids of build_vocab), sorted and unique
+#   seg-N.vals      float64 summed co-occurrence values
+# add() turns a word\tword\tvalue file of one shard into a level 0 segment. Segments are merged LSM style: when a
+# level holds --fanout segments they are merged into one segment of the next level, in bounded key ranges so a merge
+# never loads whole segments. Compaction runs in a background thread after add() (or with the compact command), and
+# export writes the sum of all segments of a setting as the CREC .bin of glove (sorted, or shuffled as crec_shuffle).
+#
+#   python src/coo_lsm.py add --root coo.lsm --vocab data/vocab/vocab.wiki.word.txt --shard news-2020-06 --coo mlm.word.coo.news.2020-06 --window 10 --weighting divide
+#   python src/coo_lsm.py export --root coo.lsm --window 10 --weighting divide --output mlm.word.coo.bin --shuffle
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import numpy as np
+from coo_store import CREC_DTYPE, read_vocab
+from parallel_reader import iter_lines
+
+MANIFEST = 'MANIFEST.json'
+CHUNK_RECORDS = 1 << 22
+
+
+def file_sha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as fin:
+        for block in iter(lambda: fin.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def setting_key(window_size, weighting):
+    return 'window%d.%s' % (window_size, weighting)
+
+
+def reduce_keys(keys, vals):
+    uniq_keys, inverse = np.unique(keys, return_inverse=True)
+    return uniq_keys, np.bincount(inverse, weights=vals)
+
+
+def read_coo_keys(coo_path, vocab, num_cols, chunk_lines=CHUNK_RECORDS):
+    # word\tword\tvalue text -> sorted unique keys and summed values, words outside the vocab are dropped
+    parts_keys, parts_vals = [], []
+    keys, vals = [], []
+    for line in iter_lines(coo_path):
+        parts = line.strip().split('\t')
+        if len(parts) == 3 and parts[0] in vocab and parts[1] in vocab:
+            keys.append(vocab[parts[0]] * num_cols + vocab[parts[1]])
+            vals.append(float(parts[2]))
+        if len(keys) >= chunk_lines:
+            parts_keys.append(np.array(keys, dtype=np.int64))
+            parts_vals.append(np.array(vals, dtype=np.float64))
+            keys, vals = [], []
+    parts_keys.append(np.array(keys, dtype=np.int64))
+    parts_vals.append(np.array(vals, dtype=np.float64))
+    return reduce_keys(np.concatenate(parts_keys), np.concatenate(parts_vals))
+
+
+class Segment(object):
+    def __init__(self, root, name):
+        self.name = name
+        size = os.path.getsize(os.path.join(root, name + '.keys')) // 8
+        self.keys = np.memmap(os.path.join(root, name + '.keys'), dtype=np.int64, mode='r') if size else np.zeros(0, np.int64)
+        self.vals = np.memmap(os.path.join(root, name + '.vals'), dtype=np.float64, mode='r') if size else np.zeros(0)
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def iter_merged(segments, chunk_records=CHUNK_RECORDS):
+    # (keys, vals) chunks of the sum of sorted segments, in key order; every chunk covers a key range that holds
+    # about chunk_records input records
+    total = sum(len(seg) for seg in segments)
+    if total == 0:
+        return
+    samples = np.sort(np.concatenate([np.asarray(seg.keys[::max(1, len(seg) // 1024)]) for seg in segments if len(seg)]))
+    num_chunks = max(1, int(np.ceil(total / float(chunk_records))))
+    bounds = np.unique(samples[np.linspace(0, len(samples), num_chunks + 1)[1:-1].astype(np.int64)])
+    bounds = np.concatenate([[np.iinfo(np.int64).min], bounds, [np.iinfo(np.int64).max]])
+    starts = [0] * len(segments)
+    for hi_key in bounds[1:]:
+        keys, vals = [], []
+        for idx, seg in enumerate(segments):
+            end = len(seg) if hi_key == bounds[-1] else int(np.searchsorted(seg.keys, hi_key, side='left'))
+            keys.append(np.asarray(seg.keys[starts[idx]: end]))
+            vals.append(np.asarray(seg.vals[starts[idx]: end]))
+            starts[idx] = end
+        keys = np.concatenate(keys)
+        if len(keys):
+            yield reduce_keys(keys, np.concatenate(vals))
+
+
+class CooLSM(object):
+    def __init__(self, root, vocab_path='', fanout=4):
+        self.root = root
+        self.fanout = fanout
+        self.lock = threading.Lock()
+        self.compactor = None
+        if not os.path.exists(root):
+            os.makedirs(root)
+        if os.path.exists(self.path(MANIFEST)):
+            self.manifest = self.read_manifest()
+            if vocab_path and file_sha1(vocab_path) != self.manifest['vocab']['sha1']:
+                raise ValueError('%s was built with another vocab (%s)' % (root, self.manifest['vocab']['path']))
+        else:
+            if not vocab_path:
+                raise ValueError('a new store needs a vocab')
+            num_cols = len(read_vocab(vocab_path)) + 1
+            self.manifest = {'vocab': {'path': vocab_path, 'sha1': file_sha1(vocab_path), 'num_cols': num_cols},
+                             'shards': {}, 'settings': {}, 'next_segment': 0}
+            self.write_manifest()
+        self.vocab_path = vocab_path or self.manifest['vocab']['path']
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def read_manifest(self):
+        with open(self.path(MANIFEST)) as fin:
+            return json.load(fin)
+
+    def write_manifest(self):
+        tmp_path = self.path(MANIFEST + '.tmp')
+        with open(tmp_path, 'w') as fout:
+            json.dump(self.manifest, fout, indent=1, sort_keys=True)
+            fout.flush()
+            os.fsync(fout.fileno())
+        os.replace(tmp_path, self.path(MANIFEST))
+
+    def locked(self):
+        # serializes manifest changes between threads and between processes sharing the store
+        return StoreLock(self)
+
+    def new_segment(self, keys_iter, level, shards):
+        with self.locked():
+            name = 'seg-%06d' % self.manifest['next_segment']
+            self.manifest['next_segment'] += 1
+            self.write_manifest()
+        num_records = 0
+        with open(self.path(name + '.keys.tmp'), 'wb') as f_keys, open(self.path(name + '.vals.tmp'), 'wb') as f_vals:
+            for keys, vals in keys_iter:
+                keys.tofile(f_keys)
+                vals.tofile(f_vals)
+                num_records += len(keys)
+        os.replace(self.path(name + '.keys.tmp'), self.path(name + '.keys'))
+        os.replace(self.path(name + '.vals.tmp'), self.path(name + '.vals'))
+        return {'name': name, 'level': level, 'records': num_records, 'shards': sorted(shards)}
+
+    def add(self, shard, coo_path, window_size, weighting, background=True):
+        key = setting_key(window_size, weighting)
+        with self.locked():
+            added = key in self.manifest['shards'].get(shard, {})
+        if added:
+            print('shard %s is already in %s for %s, skipping' % (shard, self.root, key))
+            return False
+        start = time.time()
+        vocab = read_vocab(self.vocab_path)
+        keys, vals = read_coo_keys(coo_path, vocab, self.manifest['vocab']['num_cols'])
+        segment = self.new_segment([(keys, vals)], 0, [shard])
+        with self.locked():
+            setting = self.manifest['settings'].setdefault(key, {'window_size': window_size, 'weighting': weighting, 'segments': []})
+            setting['segments'].append(segment)
+            self.manifest['shards'].setdefault(shard, {})[key] = {'coo_path': coo_path, 'added': time.strftime('%Y-%m-%d %H:%M:%S')}
+            self.write_manifest()
+        print('added shard %s (%s) to %s: %d pairs in %s, %.1fs' % (shard, key, self.root, len(keys), segment['name'], time.time() - start))
+        sys.stdout.flush()
+        if background:
+            self.compact_in_background()
+        return True
+
+    def compaction_candidates(self):
+        # (setting key, level, segments) of the first level holding fanout segments
+        for key, setting in sorted(self.manifest['settings'].items()):
+            levels = {}
+            for segment in setting['segments']:
+                levels.setdefault(segment['level'], []).append(segment)
+            for level in sorted(levels):
+                if len(levels[level]) >= self.fanout:
+                    return key, level, levels[level][:self.fanout]
+        return None
+
+    def compact(self, chunk_records=CHUNK_RECORDS):
+        # size tiered: merge fanout segments of a level into one of the next level until no level is full;
+        # one compaction at a time per store, so two processes never merge the same segments
+        with CompactionLock(self):
+            return self.compact_locked(chunk_records)
+
+    def compact_locked(self, chunk_records):
+        num_merges = 0
+        while True:
+            with self.locked():
+                candidate = self.compaction_candidates()
+            if candidate is None:
+                return num_merges
+            key, level, inputs = candidate
+            start = time.time()
+            segments = [Segment(self.root, item['name']) for item in inputs]
+            shards = [shard for item in inputs for shard in item['shards']]
+            merged = self.new_segment(iter_merged(segments, chunk_records), level + 1, shards)
+            with self.locked():
+                names = set(item['name'] for item in inputs)
+                setting = self.manifest['settings'][key]
+                live = names <= set(item['name'] for item in setting['segments'])
+                if live:
+                    setting['segments'] = [item for item in setting['segments'] if item['name'] not in names] + [merged]
+                    self.write_manifest()
+            del segments
+            # inputs merged by someone else meanwhile would be counted twice, so the merged segment is dropped
+            for name in (names if live else [merged['name']]):
+                for suffix in ('.keys', '.vals'):
+                    os.remove(self.path(name + suffix))
+            if not live:
+                print('inputs of %s were compacted elsewhere, dropped it' % merged['name'])
+                continue
+            num_merges += 1
+            print('compacted %d level %d segments of %s into %s (%d pairs), %.1fs' %
+                  (len(inputs), level, key, merged['name'], merged['records'], time.time() - start))
+            sys.stdout.flush()
+
+    def compact_in_background(self):
+        if self.compactor is not None and self.compactor.is_alive():
+            return
+        self.compactor = threading.Thread(target=self.compact, name='coo-lsm-compaction')
+        self.compactor.daemon = False
+        self.compactor.start()
+
+    def wait(self):
+        if self.compactor is not None:
+            self.compactor.join()
+
+    def segments(self, window_size, weighting):
+        with self.locked():
+            setting = self.manifest['settings'].get(setting_key(window_size, weighting))
+            names = [item['name'] for item in setting['segments']] if setting else []
+            return [Segment(self.root, name) for name in names]
+
+    def export(self, window_size, weighting, out_path, shuffle=False, memory_mb=2048, seed=1):
+        # CREC .bin of the summed segments for glove, sorted by (word1, word2) like cooccur, or shuffled
+        start = time.time()
+        segments = self.segments(window_size, weighting)
+        num_cols = self.manifest['vocab']['num_cols']
+        if shuffle:
+            from crec_shuffle import ShuffledRecordWriter
+            fout = ShuffledRecordWriter(out_path, memory_mb, seed, sum(len(seg) for seg in segments))
+        else:
+            fout = open(out_path, 'wb')
+        num_records = 0
+        for keys, vals in iter_merged(segments):
+            records = np.empty(len(keys), dtype=CREC_DTYPE)
+            records['word1'], records['word2'], records['val'] = keys // num_cols, keys % num_cols, vals
+            fout.write(records)
+            num_records += len(records)
+        fout.close()
+        print('exported %d pairs of %d segments to %s, %.1fs' % (num_records, len(segments), out_path, time.time() - start))
+        return num_records
+
+    def status(self):
+        print('store %s, vocab %s' % (self.root, self.manifest['vocab']['path']))
+        for key, setting in sorted(self.manifest['settings'].items()):
+            shards = sorted(shard for shard, keys in self.manifest['shards'].items() if key in keys)
+            print('%s: %d shards, %d segments (levels %s), %d records' %
+                  (key, len(shards), len(setting['segments']), ','.join(str(item['level']) for item in setting['segments']),
+                   sum(item['records'] for item in setting['segments'])))
+        sys.stdout.flush()
+
+
+class StoreLock(object):
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        self.store.lock.acquire()
+        self.fd = open(self.store.path('LOCK'), 'w')
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        # another process may have changed the store since we last read it
+        self.store.manifest = self.store.read_manifest()
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.fd.close()
+        self.store.lock.release()
+
+
+class CompactionLock(object):
+    # held for a whole compaction, apart from the manifest lock so adds and exports go on meanwhile
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        self.fd = open(self.store.path('COMPACT.LOCK'), 'w')
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.fd.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Incremental co-occurrence store')
+    parser.add_argument('command', choices=['add', 'compact', 'export', 'status'])
+    parser.add_argument('--root', required=True)
+    parser.add_argument('--vocab', default='', help='vocab of a new store (checked against the manifest otherwise)')
+    parser.add_argument('--shard', default='', help='add: name of the corpus shard, e.g. news-2020-06')
+    parser.add_argument('--coo', default='', help='add: word\\tword\\tvalue file of the shard')
+    parser.add_argument('--window', default=10, type=int)
+    parser.add_argument('--weighting', default='divide')
+    parser.add_argument('--fanout', default=4, type=int)
+    parser.add_argument('--output', default='')
+    parser.add_argument('--shuffle', action='store_true', help='export: write the records shuffled')
+    parser.add_argument('--memory_mb', default=2048, type=float)
+    args = parser.parse_args()
+
+    store = CooLSM(args.root, args.vocab, args.fanout)
+    if args.command == 'add':
+        store.add(args.shard, args.coo, args.window, args.weighting)
+        store.wait()
+    elif args.command == 'compact':
+        store.compact()
+    elif args.command == 'export':
+        store.export(args.window, args.weighting, args.output, args.shuffle, args.memory_mb)
+    store.status()
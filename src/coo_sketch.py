@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# Bounded memory co-occurrence aggregation.
+#
+# Every increment goes to a count-min sketch of fixed size. Only candidate pairs are kept exactly in
+# a dict: a new pair is admitted when its sketch estimate reaches the smallest value kept so far, and
+# when the dict outgrows its budget it is compacted to the top-N contexts of every target word and then
+# to the globally largest pairs. Values of admitted pairs over-estimate the exact count by at most the
+# count-min bound e / width * total mass with probability 1 - exp(-depth).
+import codecs
+import heapq
+import sys
+import numpy as np
+
+
+class CountMinSketch(object):
+    def __init__(self, width, depth=4, seed=1234):
+        # rounded down to a power of two, so the table stays within the width it was given
+        log_width = max(1, int(np.floor(np.log2(max(2, width)))))
+        self.width = 1 << log_width
+        self.depth = depth
+        self.shift = np.uint64(64 - log_width)
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, 1 << 62, size=depth, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.randint(0, 1 << 62, size=depth, dtype=np.uint64)
+        self.table = np.zeros((depth, self.width), dtype=np.float64)
+        self.total = 0.0
+
+    def indices(self, codes):
+        # multiply-shift hashing, one odd multiplier per row
+        codes = np.asarray(codes, dtype=np.int64).view(np.uint64)
+        with np.errstate(over='ignore'):
+            return ((self.a[:, None] * codes[None, :] + self.b[:, None]) >> self.shift).astype(np.int64)
+
+    def add(self, codes, values):
+        values = np.asarray(values, dtype=np.float64)
+        idx = self.indices(codes)
+        for row in range(self.depth):
+            np.add.at(self.table[row], idx[row], values)
+        self.total += values.sum()
+
+    def query(self, codes):
+        idx = self.indices(codes)
+        return self.table[np.arange(self.depth)[:, None], idx].min(0)
+
+    def error_bound(self):
+        # (additive error, probability that an estimate exceeds it)
+        return np.e / self.width * self.total, np.exp(-self.depth)
+
+    def nbytes(self):
+        return self.table.nbytes
+
+
+def pair_row(key):
+    return key[0]
+
+
+class BoundedPairTable(object):
+    ENTRY_BYTES = 200  # rough size of one dict entry with a (str, str) key and a float value
+
+    def __init__(self, memory_mb, top_n=0, depth=4, row_of=None, flush_size=1 << 16):
+        budget = int(memory_mb * (1 << 20))
+        self.sketch = CountMinSketch(budget // 2 // (8 * depth), depth)
+        self.max_pairs = max(1, budget // 2 // self.ENTRY_BYTES)
+        self.top_n = top_n
+        self.row_of = row_of or pair_row
+        self.flush_size = flush_size
+        self.table = {}
+        self.threshold = 0.0
+        self.pending_keys, self.pending_values = [], []
+
+    def add(self, key, value):
+        if key in self.table:
+            self.table[key] += value
+        self.pending_keys.append(key)
+        self.pending_values.append(value)
+        if len(self.pending_keys) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending_keys:
+            return
+        keys, values = self.pending_keys, self.pending_values
+        self.pending_keys, self.pending_values = [], []
+        self.sketch.add(np.fromiter((hash(key) for key in keys), dtype=np.int64, count=len(keys)), values)
+
+        candidates = list(set(key for key in keys if key not in self.table))
+        if candidates:
+            estimates = self.sketch.query(np.fromiter((hash(key) for key in candidates), dtype=np.int64, count=len(candidates)))
+            for key, estimate in zip(candidates, estimates.tolist()):
+                if estimate >= self.threshold:
+                    self.table[key] = estimate
+
+        if len(self.table) > self.max_pairs:
+            self.compact(self.max_pairs * 3 // 4)
+
+    def compact(self, target_size):
+        if self.top_n > 0:
+            rows = {}
+            for key, value in self.table.items():
+                rows.setdefault(self.row_of(key), []).append((value, key))
+            self.table = {key: value for row in rows.values() for value, key in heapq.nlargest(self.top_n, row, key=lambda x: x[0])}
+        if len(self.table) > target_size:
+            kept = heapq.nlargest(target_size, self.table.items(), key=lambda x: x[1])
+            self.table = dict(kept)
+            self.threshold = kept[-1][1]
+
+    def items(self):
+        self.flush()
+        if self.top_n > 0:
+            self.compact(self.max_pairs)
+        return self.table.items()
+
+    def __len__(self):
+        return len(self.table)
+
+    def report(self):
+        bound, prob = self.sketch.error_bound()
+        print('sketch %dx%d (%.1f MB), %d candidate pairs, admission threshold %.4f' %
+              (self.sketch.depth, self.sketch.width, self.sketch.nbytes() / float(1 << 20), len(self.table), self.threshold))
+        print('count-min error bound: +%.4f with probability %.4f' % (bound, 1 - prob))
+
+
+def error_report(exact, approx, top_k=10000):
+    # compare an approximate table against exact counts on the same corpus
+    exact_mass = sum(exact.values())
+    kept = [key for key in approx if key in exact]
+    errors = np.array([approx[key] - exact[key] for key in kept]) if kept else np.zeros(1)
+    rel_errors = np.array([abs(approx[key] - exact[key]) / exact[key] for key in kept if exact[key] > 0]) if kept else np.zeros(1)
+    top_exact = set(key for key, _ in heapq.nlargest(top_k, exact.items(), key=lambda x: x[1]))
+    report = {
+        'exact_pairs': len(exact),
+        'approx_pairs': len(approx),
+        'spurious_pairs': len(approx) - len(kept),
+        'mass_coverage': sum(exact[key] for key in kept) / exact_mass if exact_mass else 0.0,
+        'top_k': top_k,
+        'top_k_recall': len(top_exact & set(kept)) / float(len(top_exact)) if top_exact else 0.0,
+        'max_abs_error': float(np.abs(errors).max()),
+        'mean_abs_error': float(np.abs(errors).mean()),
+        'mean_rel_error': float(rel_errors.mean()),
+        'min_error': float(errors.min()),
+    }
+    for k, v in report.items():
+        print('%s: %s' % (k, v))
+    return report
+
+
+def read_table(path):
+    table = {}
+    for line in codecs.open(path, 'r', 'utf-8'):
+        parts = line.rstrip('\n').split('\t')
+        if len(parts) == 3:
+            table[(parts[0], parts[1])] = float(parts[2])
+    return table
+
+
+if __name__ == '__main__':
+    # python src/coo_sketch.py exact.coo approx.coo [top_k]
+    exact_path, approx_path = sys.argv[1], sys.argv[2]
+    top_k = int(sys.argv[3]) if len(sys.argv) > 3 else 10000
+    error_report(read_table(exact_path), read_table(approx_path), top_k)
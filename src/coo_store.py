@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+# Indexed binary co-occurrence store.
+#
+# A CSR matrix over GloVe vocab ids (the ids of build_vocab, i.e. line number + 1), with prefix P:
+#   P.indptr   int64   [num_rows + 1], row r holds entries indptr[r]: indptr[r + 1]
+#   P.indices  int32   [nnz], context ids, sorted inside every row
+#   P.data     float32 [nnz], co-occurrence values, duplicates of the input are summed
+#   P.vocab    word of every id, one per line (line 0 is the unused id 0)
+#   P.meta     json with sizes
+# All arrays are memory-mapped, so a row or pair lookup costs one slice and one binary search.
+#
+#   python src/coo_store.py build --vocab vocab.txt --input coo.bin --output store
+#   python src/coo_store.py query --store store target_word [context_word ...]
+import argparse
+import codecs
+import json
+import os
+import sys
+import time
+import numpy as np
+from block_io import uncompressed_size
+from parallel_reader import iter_lines
+
+CREC_DTYPE = np.dtype([('word1', np.int32), ('word2', np.int32), ('val', np.float64)])  # CREC of glove.c
+
+
+def read_vocab(vocab_path):
+    # same ids as build_vocab in bert_cooccur_mindspore.py
+    vocab = {}
+    for index, line in enumerate(iter_lines(vocab_path)):
+        parts = line.strip().rsplit(maxsplit=1)
+        if len(parts) != 2:
+            print('Error line:', line)
+            continue
+        vocab[parts[0]] = index + 1
+    if '[UNK]' not in vocab:
+        vocab['[UNK]'] = len(vocab)
+    return vocab
+
+
+def id_to_word(vocab):
+    ivocab = [''] * (max(vocab.values()) + 1)
+    for word, idx in vocab.items():
+        if not ivocab[idx]:
+            ivocab[idx] = word  # build_vocab may give [UNK] the id of the last word, keep the word
+    return ivocab
+
+
+def text_to_records(coo_path, vocab, out_path, chunk_lines=1 << 22, shuffle_seed=None, memory_mb=2048, extend_vocab=False):
+    # convert_txt_to_bin without the per record ctypes objects; with a shuffle_seed the records are written in
+    # a random order that glove can train on directly (see crec_shuffle.py). Pairs with a word outside vocab are
+    # dropped, or with extend_vocab the word is added to vocab (in place) with the next free id
+    if shuffle_seed is not None:
+        from crec_shuffle import ShuffledRecordWriter
+        # a text line is longer than the 16 bytes of its record, so this over-estimates the records
+        fout = ShuffledRecordWriter(out_path, memory_mb, shuffle_seed, uncompressed_size(coo_path) // CREC_DTYPE.itemsize)
+    else:
+        fout = open(out_path, 'wb')
+    word1, word2, vals = [], [], []
+    next_id = max(vocab.values()) + 1 if vocab else 1
+    for line in iter_lines(coo_path):
+        parts = line.strip().split('\t')
+        if extend_vocab and len(parts) == 3:
+            for word in parts[:2]:
+                if word not in vocab:
+                    vocab[word] = next_id
+                    next_id += 1
+        if len(parts) == 3 and parts[0] in vocab and parts[1] in vocab:
+            word1.append(vocab[parts[0]])
+            word2.append(vocab[parts[1]])
+            vals.append(float(parts[2]))
+        if len(word1) >= chunk_lines:
+            write_records(fout, word1, word2, vals)
+            word1, word2, vals = [], [], []
+    write_records(fout, word1, word2, vals)
+    fout.close()
+    return out_path
+
+
+def write_records(fout, word1, word2, vals):
+    records = np.empty(len(word1), dtype=CREC_DTYPE)
+    records['word1'], records['word2'], records['val'] = word1, word2, vals
+    fout.write(records)  # a binary file or a ShuffledRecordWriter
+
+
+def reduce_sorted(rows, cols, vals, num_cols):
+    keys = rows.astype(np.int64) * num_cols + cols
+    uniq_keys, inverse = np.unique(keys, return_inverse=True)
+    return (uniq_keys // num_cols).astype(np.int64), (uniq_keys % num_cols).astype(np.int32), np.bincount(inverse, weights=vals)
+
+
+def build_from_bin(bin_path, prefix, ivocab, chunk_records=1 << 24):
+    start = time.time()
+    records = np.memmap(bin_path, dtype=CREC_DTYPE, mode='r')
+    num_records = len(records)
+    num_rows, num_cols = len(ivocab), len(ivocab)
+
+    # pass 1: row sizes
+    counts = np.zeros(num_rows, dtype=np.int64)
+    for lo in range(0, num_records, chunk_records):
+        chunk = records[lo: lo + chunk_records]
+        num_rows = max(num_rows, int(chunk['word1'].max()) + 1)
+        num_cols = max(num_cols, int(chunk['word2'].max()) + 1)
+        counts = np.concatenate([counts, np.zeros(num_rows - len(counts), dtype=np.int64)])
+        counts += np.bincount(chunk['word1'], minlength=num_rows)
+    starts = np.concatenate([[0], np.cumsum(counts)])
+
+    # pass 2: counting sort of the records by row into temporary arrays
+    tmp_cols = np.memmap(prefix + '.tmp.indices', dtype=np.int32, mode='w+', shape=(max(1, num_records),))
+    tmp_vals = np.memmap(prefix + '.tmp.data', dtype=np.float64, mode='w+', shape=(max(1, num_records),))
+    cursor = starts[:-1].copy()
+    for lo in range(0, num_records, chunk_records):
+        chunk = records[lo: lo + chunk_records]
+        order = np.argsort(chunk['word1'], kind='stable')
+        rows = chunk['word1'][order]
+        group_start = np.searchsorted(rows, rows, side='left')
+        positions = cursor[rows] + (np.arange(len(rows)) - group_start)
+        tmp_cols[positions] = chunk['word2'][order]
+        tmp_vals[positions] = chunk['val'][order]
+        cursor += np.bincount(rows, minlength=num_rows)
+
+    # pass 3: sort every row by context id and sum duplicates, a block of rows at a time
+    indptr = np.zeros(num_rows + 1, dtype=np.int64)
+    with open(prefix + '.indices', 'wb') as f_cols, open(prefix + '.data', 'wb') as f_vals:
+        row = 0
+        while row < num_rows:
+            end_row = max(row + 1, int(np.searchsorted(starts, starts[row] + chunk_records, side='right')) - 1)
+            end_row = min(end_row, num_rows)
+            lo, hi = starts[row], starts[end_row]
+            rows = np.repeat(np.arange(row, end_row), counts[row: end_row])
+            uniq_rows, cols, vals = reduce_sorted(rows, np.asarray(tmp_cols[lo: hi]), np.asarray(tmp_vals[lo: hi]), num_cols)
+            indptr[row + 1: end_row + 1] = np.bincount(uniq_rows - row, minlength=end_row - row)
+            cols.tofile(f_cols)
+            vals.astype(np.float32).tofile(f_vals)
+            row = end_row
+    indptr = np.cumsum(indptr)
+    indptr.tofile(prefix + '.indptr')
+    del tmp_cols, tmp_vals
+    os.remove(prefix + '.tmp.indices')
+    os.remove(prefix + '.tmp.data')
+
+    with codecs.open(prefix + '.vocab', 'w', 'utf-8') as fout:
+        for idx in range(num_rows):
+            fout.write((ivocab[idx] if idx < len(ivocab) else '') + '\n')
+    with open(prefix + '.meta', 'w') as fout:
+        json.dump({'num_rows': num_rows, 'nnz': int(indptr[-1]), 'num_records': num_records}, fout)
+    print('%.2fs building co-occurrence store %s: %d records, %d rows, %d pairs.' %
+          (time.time() - start, prefix, num_records, num_rows, indptr[-1]))
+
+
+def build_store(input_path, vocab_path, prefix, chunk_records=1 << 24, keep_oov=False):
+    # input_path is a CREC bin (.bin) or a word\tword\tvalue text file; keep_oov keeps the text pairs of words
+    # outside the vocab file, which then get ids after it
+    vocab = read_vocab(vocab_path)
+    if input_path.endswith('.bin'):
+        build_from_bin(input_path, prefix, id_to_word(vocab), chunk_records)
+    else:
+        bin_path = text_to_records(input_path, vocab, prefix + '.tmp.bin', extend_vocab=keep_oov)
+        build_from_bin(bin_path, prefix, id_to_word(vocab), chunk_records)
+        os.remove(bin_path)
+
+
+def store_exists(prefix):
+    return os.path.exists(prefix + '.indptr') and os.path.exists(prefix + '.meta')
+
+
+class CooStore(object):
+    def __init__(self, prefix):
+        with open(prefix + '.meta') as fin:
+            meta = json.load(fin)
+        self.indptr = np.memmap(prefix + '.indptr', dtype=np.int64, mode='r', shape=(meta['num_rows'] + 1,))
+        nnz = max(1, meta['nnz'])
+        self.indices = np.memmap(prefix + '.indices', dtype=np.int32, mode='r', shape=(nnz,)) if meta['nnz'] else np.zeros(0, np.int32)
+        self.data = np.memmap(prefix + '.data', dtype=np.float32, mode='r', shape=(nnz,)) if meta['nnz'] else np.zeros(0, np.float32)
+        self.ivocab = [line for line in iter_lines(prefix + '.vocab')]
+        self.vocab = {word: idx for idx, word in enumerate(self.ivocab) if word}
+
+    def __len__(self):
+        return int(np.count_nonzero(np.diff(self.indptr)))
+
+    def nnz(self):
+        return int(self.indptr[-1])
+
+    def row_ids(self, word_id):
+        lo, hi = self.indptr[word_id], self.indptr[word_id + 1]
+        return self.indices[lo: hi], self.data[lo: hi]
+
+    def row(self, word):
+        # [(context_word, value)] of a target word
+        if word not in self.vocab:
+            return []
+        cols, vals = self.row_ids(self.vocab[word])
+        return [(self.ivocab[col], val) for col, val in zip(cols.tolist(), vals.tolist())]
+
+    def row_sum(self, word):
+        if word not in self.vocab:
+            return 0.0
+        return float(self.row_ids(self.vocab[word])[1].sum(dtype=np.float64))
+
+    def get(self, word1, word2):
+        if word1 not in self.vocab or word2 not in self.vocab:
+            return 0.0
+        cols, vals = self.row_ids(self.vocab[word1])
+        pos = np.searchsorted(cols, self.vocab[word2])
+        return float(vals[pos]) if pos < len(cols) and cols[pos] == self.vocab[word2] else 0.0
+
+    def ratio(self, target_word, context_words):
+        # the (word count, co-occurrence count, ratio) triple printed by script.analysis
+        word_count = self.row_sum(target_word)
+        c_word_count = {word: self.get(target_word, word) for word in context_words}
+        c_word_count = {k: v for k, v in c_word_count.items() if v != 0}
+        c_word_ratio = {k: v / word_count for k, v in c_word_count.items()}
+        return word_count, c_word_count, c_word_ratio
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Indexed binary co-occurrence store')
+    parser.add_argument('command', choices=['build', 'query'])
+    parser.add_argument('words', nargs='*')
+    parser.add_argument('--input', default='')
+    parser.add_argument('--vocab', default='data/vocab/vocab.wiki.word.txt')
+    parser.add_argument('--output', default='')
+    parser.add_argument('--store', default='')
+    parser.add_argument('--chunk_records', default=1 << 24, type=int)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_store(args.input, args.vocab, args.output, args.chunk_records)
+    else:
+        store = CooStore(args.store)
+        start = time.time()
+        word_count, c_word_count, c_word_ratio = store.ratio(args.words[0], args.words[1:])
+        print('word count:', word_count)
+        print('co-occurrence count:', c_word_count)
+        print('ratio:', c_word_ratio)
+        print('query time: %.1fus' % ((time.time() - start) * 1e6))
+        sys.stdout.flush()
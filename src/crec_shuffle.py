@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# CREC records written directly in shuffled order, so the co-occurrence .bin can go to glove without build/shuffle.
+#
+# Every record gets a seeded random bucket while it is written. Buckets are appended to temp runs (one file per
+# bucket, buffered), and on close every run is loaded, permuted and appended to the output. The number of buckets
+# keeps a run within the memory budget, so the whole file never has to fit in memory; with a single bucket nothing
+# touches the disk before the output. A uniform bucket followed by a uniform permutation inside the bucket is a
+# uniform permutation of all the records.
+#
+# mixing_check tests the result: in a random order the means of log(word1) over contiguous blocks only differ by
+# sampling noise (dispersion index ~1) and neighbouring records are uncorrelated, while the output of cooccur
+# (sorted by word1) fails both by orders of magnitude.
+#
+#   python src/crec_shuffle.py shuffle --input cooccurrence.bin --output cooccurrence.shuf.bin --memory_mb 2048
+#   python src/crec_shuffle.py check --input cooccurrence.shuf.bin
+import argparse
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+from coo_store import CREC_DTYPE
+
+CHUNK_RECORDS = 1 << 22
+
+
+class ShuffledRecordWriter(object):
+    def __init__(self, out_path, memory_mb=2048, seed=1, estimated_records=0, temp_dir=''):
+        self.out_path = out_path
+        self.rng = np.random.RandomState(seed)
+        budget = max(1, int(memory_mb * 1048576 / CREC_DTYPE.itemsize))
+        # a run is read back with its permutation and a copy, so it gets half of the budget
+        self.num_buckets = max(1, int(math.ceil(estimated_records / (budget / 2.0))))
+        self.buffer_records = max(1 << 12, budget // (4 * self.num_buckets))
+        self.buffers = [[] for _ in range(self.num_buckets)]
+        self.buffered = [0] * self.num_buckets
+        self.num_records = 0
+        self.temp_dir = None
+        if self.num_buckets > 1:
+            self.temp_dir = tempfile.mkdtemp(prefix='crec_shuffle_', dir=temp_dir or os.path.dirname(os.path.abspath(out_path)))
+            self.runs = [open(os.path.join(self.temp_dir, 'run.%05d' % b), 'wb') for b in range(self.num_buckets)]
+
+    def write(self, records):
+        self.num_records += len(records)
+        if self.num_buckets == 1:
+            self.buffers[0].append(records.copy())
+            return
+        buckets = self.rng.randint(0, self.num_buckets, len(records))
+        order = np.argsort(buckets, kind='stable')
+        bounds = np.searchsorted(buckets[order], np.arange(self.num_buckets + 1))
+        records = records[order]
+        for b in range(self.num_buckets):
+            part = records[bounds[b]: bounds[b + 1]]
+            if len(part):
+                self.buffers[b].append(part)
+                self.buffered[b] += len(part)
+            if self.buffered[b] >= self.buffer_records:
+                self.flush(b)
+
+    def flush(self, b):
+        for part in self.buffers[b]:
+            part.tofile(self.runs[b])
+        self.buffers[b], self.buffered[b] = [], 0
+
+    def close(self):
+        with open(self.out_path, 'wb') as fout:
+            if self.num_buckets == 1:
+                records = np.concatenate(self.buffers[0]) if self.buffers[0] else np.zeros(0, dtype=CREC_DTYPE)
+                records[self.rng.permutation(len(records))].tofile(fout)
+            else:
+                for b in range(self.num_buckets):
+                    self.flush(b)
+                    self.runs[b].close()
+                    run_path = self.runs[b].name
+                    records = np.fromfile(run_path, dtype=CREC_DTYPE)
+                    records[self.rng.permutation(len(records))].tofile(fout)
+                    os.remove(run_path)
+                shutil.rmtree(self.temp_dir, ignore_errors=True)
+        self.buffers = [[] for _ in range(self.num_buckets)]
+        print('wrote %d shuffled records to %s (%d temp runs)' % (self.num_records, self.out_path, self.num_buckets))
+        return self.num_records
+
+
+def shuffle_file(in_path, out_path, memory_mb=2048, seed=1, temp_dir=''):
+    # shuffle.c on a CREC file
+    if os.path.getsize(in_path) == 0:  # np.memmap cannot map an empty file
+        open(out_path, 'wb').close()
+        print('wrote 0 shuffled records to %s' % out_path)
+        return 0
+    records = np.memmap(in_path, dtype=CREC_DTYPE, mode='r')
+    writer = ShuffledRecordWriter(out_path, memory_mb, seed, len(records), temp_dir)
+    for lo in range(0, len(records), CHUNK_RECORDS):
+        writer.write(np.asarray(records[lo: lo + CHUNK_RECORDS]))
+    return writer.close()
+
+
+def mixing_check(path, num_blocks=100):
+    # -> (dispersion index of the block means of log(word1), lag-1 autocorrelation, passed)
+    if os.path.getsize(path) == 0:
+        return 1.0, 0.0, True
+    records = np.memmap(path, dtype=CREC_DTYPE, mode='r')
+    n = len(records)
+    if n < 2 * num_blocks:
+        return 1.0, 0.0, True
+    block_size = n // num_blocks
+    block_sums = np.zeros(num_blocks)
+    total, total_sq, lag_sum, prev = 0.0, 0.0, 0.0, None
+    for lo in range(0, block_size * num_blocks, CHUNK_RECORDS):
+        x = np.log(np.asarray(records['word1'][lo: min(lo + CHUNK_RECORDS, block_size * num_blocks)], dtype=np.float64) + 1)
+        block_ids = (lo + np.arange(len(x))) // block_size
+        block_sums += np.bincount(block_ids, weights=x, minlength=num_blocks)
+        total += x.sum()
+        total_sq += np.dot(x, x)
+        lag_sum += np.dot(x[1:], x[:-1]) + (prev * x[0] if prev is not None else 0.0)
+        prev = x[-1]
+    m = block_size * num_blocks
+    mean = total / m
+    var = total_sq / m - mean * mean
+    if var <= 0:
+        return 1.0, 0.0, True
+    dispersion = np.var(block_sums / block_size, ddof=1) * block_size / var
+    autocorr = (lag_sum / (m - 1) - mean * mean) / var
+    # dispersion * (num_blocks - 1) is chi-square with num_blocks - 1 degrees of freedom in a random order
+    passed = dispersion < 1 + 4 * math.sqrt(2.0 / (num_blocks - 1)) and abs(autocorr) < 4 / math.sqrt(m)
+    return float(dispersion), float(autocorr), bool(passed)
+
+
+def report_mixing(path, num_blocks=100):
+    dispersion, autocorr, passed = mixing_check(path, num_blocks)
+    print('%s: block dispersion %.3f (1 is random), lag-1 autocorrelation %.5f -> %s' %
+          (path, dispersion, autocorr, 'well mixed' if passed else 'NOT well mixed'))
+    sys.stdout.flush()
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Shuffled CREC output and mixing check')
+    parser.add_argument('command', choices=['shuffle', 'check'])
+    parser.add_argument('--input', required=True)
+    parser.add_argument('--output', default='')
+    parser.add_argument('--memory_mb', default=2048, type=float)
+    parser.add_argument('--seed', default=1, type=int)
+    parser.add_argument('--temp_dir', default='')
+    parser.add_argument('--num_blocks', default=100, type=int)
+    args = parser.parse_args()
+
+    if args.command == 'shuffle':
+        start = time.time()
+        shuffle_file(args.input, args.output, args.memory_mb, args.seed, args.temp_dir)
+        print('shuffled in %.1fs' % (time.time() - start))
+        report_mixing(args.output, args.num_blocks)
+    else:
+        report_mixing(args.input, args.num_blocks)
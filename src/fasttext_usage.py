@@ -9,6 +9,8 @@ from gensim.models.fasttext import FastText
 import fasttext
 import datetime
 import argparse
+from vector_tools import load_vectors, merge, read_word_pieces, piece_matrix, compose, write_text
+from parallel_tokenize import tokenize_corpus
 
 EN_VOCAB_PATH = '/mnt/data2/ganleilei/data/wwm_bert/wwm_uncased_L-24_H-1024_A-16/vocab.txt'
 
@@ -28,75 +30,46 @@ def gen_bpe_vocab(path, outpath):
 
     fout.close()
 
-def gen_bpe_corpus(path, outpath):
-    print('in path:', path)
-    print('out path:', outpath)
-    tokenizer = BertTokenizer.from_pretrained(EN_VOCAB_PATH)
-    fout = codecs.open(outpath, 'w+', 'utf-8')
-    for linenum, line in enumerate(codecs.open(path, 'r', 'utf-8')):
-        if linenum % 1000 == 0:
-            print('processing %d lines.' % linenum)
-        tokenized_text = tokenizer.tokenize(line.strip())
-        fout.write(' '.join(tokenized_text) + '\n')
-
-    fout.close()
+def gen_bpe_corpus(path, outpath, num_workers=8, with_ids=False):
+    # ordered multi-process tokenization with a per-worker word cache, see parallel_tokenize.py
+    tokenize_corpus(path, outpath, EN_VOCAB_PATH, num_workers, with_ids=with_ids)
 
 def gen_vec_from_bpe(vocab_path, bpe_vectors_path, outpath):
     print('vocab path:', vocab_path)
     print('bpe vectors path:', bpe_vectors_path)
     tokenizer = BertTokenizer.from_pretrained(EN_VOCAB_PATH)
-    bpe_vectors = KeyedVectors.load_word2vec_format(bpe_vectors_path, binary=False)
-    fout = codecs.open(outpath, 'w+', 'utf-8')
+    bpe_W, bpe_vocab, _ = load_vectors(bpe_vectors_path, normalize=False)
+    words, word_pieces = [], {}
     for line in codecs.open(vocab_path, 'r', 'utf-8'):
         parts = line.strip().split()
         if len(parts) != 2:
             print('error line: ', line)
             continue
-        word = parts[0]
-        subwords = tokenizer.tokenize(word)
-        word_vec = np.zeros(50, dtype=np.float16)
-        for bpe_token in subwords:
-            word_vec += bpe_vectors[bpe_token]
-        fout.write(word + ' ' + ' '.join([str(item) for item in word_vec.tolist() / len(subwords)]) + '\n')
-
-    fout.close()
+        words.append(parts[0])
+        word_pieces[parts[0]] = tokenizer.tokenize(parts[0])
+    write_text(outpath, words, compose(bpe_W, piece_matrix(words, word_pieces, bpe_vocab, 'mean')))
 
 
 def concat_bpe_vectors(bpe_vectors_path, word_bpe_pair_path, output_path):
     print('bpe vectors:', bpe_vectors_path)
     print('word bpe pair path:', word_bpe_pair_path)
     print('output path:', output_path)
-    word_bpe_pair = {}
-    fout = codecs.open(output_path, 'w+', 'utf-8')
-    for line in codecs.open(word_bpe_pair_path, 'r', 'utf-8'):
-        parts = line.strip().split('\t')
-        word_bpe_pair[parts[0]] = parts[1:]
-    bpe_vectors = KeyedVectors.load_word2vec_format(bpe_vectors_path)
-    for word, bpes in word_bpe_pair.items():
-        first = bpe_vectors[bpes[0]]
-        fout.write(word + ' ' + ' '.join('%.8f' % item for item in first) + '\n')
-    fout.close()
+    word_bpe_pair = read_word_pieces(word_bpe_pair_path)
+    bpe_W, bpe_vocab, _ = load_vectors(bpe_vectors_path, normalize=False)
+    words = list(word_bpe_pair)
+    write_text(output_path, words, compose(bpe_W, piece_matrix(words, word_bpe_pair, bpe_vocab, 'first')))
 
 
 def average_word_vectors(vec1_path, vec2_path, outputpath):
     print('vec1 path:', vec1_path)
     print('vec2 path:', vec2_path)
     print('output path:', outputpath)
-    vec1 = KeyedVectors.load_word2vec_format(vec1_path, binary=False)
-    vec2 = KeyedVectors.load_word2vec_format(vec2_path, binary=False)
-    fout = codecs.open(outputpath, 'w+', 'utf-8')
-
-    count = 0
-    for word in vec1.wv.vocab:
-        if word not in vec2.wv.vocab:
-            ave_vectors = vec1[word]
-        else:
-            count += 1
-            ave_vectors = vec2[word]
-        fout.write(word + ' ' + ' '.join(["%.8f" % item for item in ave_vectors]) + '\n')
+    vec1 = load_vectors(vec1_path, normalize=False)
+    vec2 = load_vectors(vec2_path, normalize=False)
+    ave_vectors, count = merge(vec1, vec2)
+    write_text(outputpath, vec1[2], ave_vectors)
 
     print('loading %d overlap words...' % count)
-    fout.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# GloVe training in NumPy on a memory-mapped CREC co-occurrence file (the .bin input of glove.c).
+#
+# Same model as glove_thread in glove.c: weighted least squares on log co-occurrences with
+# f(x) = min(1, (x / x_max) ^ alpha), separate word / context vectors and biases, AdaGrad with gradsq
+# initialised to 1. Records are processed in file order in minibatches; every batch gathers its rows,
+# computes the gradients in float32 against the batch-start parameters, sums them per row and takes one
+# AdaGrad step per touched row. gradsq accumulates the squared gradient of every record, as glove.c does.
+# The summed step of a row seen in n records of a batch is damped to what n sequential steps would move
+# (each one closes a fraction eta of the remaining error), since the n gradients were all taken at the same
+# stale point. The first batches start at WARMUP_BATCH records and double up to --batch_size, so the large
+# errors of the initial parameters are corrected in small steps. Output follows save_params: -model 0/1/2
+# text, optional <unk> row and header, and the float64 -binary layout.
+#
+#   python src/glove_train.py --input mlm.word.coo.bin.shuf --vocab data/vocab/vocab.wiki.word.txt --save_file vectors
+#   python src/glove_train.py bench --glove_bin build/glove
+import argparse
+import codecs
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from coo_store import CREC_DTYPE
+from vector_tools import write_text
+
+WARMUP_BATCH = 64
+
+
+def read_vocab_words(vocab_file):
+    words = []
+    for line in codecs.open(vocab_file, 'r', 'utf-8'):
+        parts = line.split()
+        if parts:
+            words.append(parts[0])
+    return words
+
+
+def initialize_parameters(vocab_size, vector_size, seed=1):
+    rng = np.random.RandomState(seed)
+    W = ((rng.random_sample((2 * vocab_size, vector_size + 1)) - 0.5) / (vector_size + 1)).astype(np.float32)
+    gradsq = np.ones((2 * vocab_size, vector_size + 1), dtype=np.float32)
+    return W, gradsq
+
+
+def segment_sum(idx, rows):
+    # -> (unique idx, rows summed per idx)
+    order = np.argsort(idx, kind='stable')
+    sorted_idx = idx[order]
+    starts = np.flatnonzero(np.concatenate([[True], sorted_idx[1:] != sorted_idx[:-1]]))
+    return sorted_idx[starts], np.add.reduceat(rows[order], starts, axis=0)
+
+
+def train_batch(W, gradsq, word1, word2, val, vocab_size, x_max, alpha, eta):
+    keep = (word1 >= 1) & (word2 >= 1) & (np.abs(val) > 1e-8)
+    l1 = word1[keep].astype(np.int64) - 1
+    l2 = word2[keep].astype(np.int64) - 1 + vocab_size
+    val = val[keep]
+    Wi, Wj = W[l1], W[l2]
+
+    diff = np.einsum('ij,ij->i', Wi[:, :-1], Wj[:, :-1]) + Wi[:, -1] + Wj[:, -1] - np.log(val).astype(np.float32)
+    fdiff = np.where(val > x_max, diff, np.power(val / x_max, alpha).astype(np.float32) * diff)
+    finite = np.isfinite(diff) & np.isfinite(fdiff)
+    cost = 0.5 * float(np.dot(fdiff[finite], diff[finite]))
+    fdiff = np.where(finite, fdiff * eta, 0).astype(np.float32)
+
+    # gradients of the vectors (with the bias as last column, whose gradient is fdiff itself)
+    grad1 = fdiff[:, None] * Wj
+    grad2 = fdiff[:, None] * Wi
+    grad1[:, -1] = grad2[:, -1] = fdiff
+    record_grads = np.concatenate([grad1, grad2])
+    record_grads[~np.isfinite(record_grads)] = 0
+    dim = record_grads.shape[1]
+    # per row: summed gradient, summed squared gradients and number of records
+    rows, sums = segment_sum(np.concatenate([l1, l2]), np.hstack([record_grads, record_grads * record_grads,
+                                                                   np.ones((len(record_grads), 1), dtype=np.float32)]))
+    grads, counts = sums[:, :dim], sums[:, -1:]
+    rate = min(eta, 1.0)
+    damping = (1 - (1 - rate) ** counts) / (counts * rate) if rate > 0 else 1.0
+    gradsq[rows] += sums[:, dim: 2 * dim]
+    W[rows] -= grads * damping / np.sqrt(gradsq[rows])
+    return cost
+
+
+def train(input_file, vocab_size, vector_size=50, num_iter=25, x_max=100.0, alpha=0.75, eta=0.05,
+          batch_size=1 << 12, seed=1, verbose=2):
+    # input_file is a CREC file or an array of CREC records already in memory
+    records = np.memmap(input_file, dtype=CREC_DTYPE, mode='r') if isinstance(input_file, str) else input_file
+    num_lines = len(records)
+    W, gradsq = initialize_parameters(vocab_size, vector_size, seed)
+    if verbose > 0:
+        print('Read %d lines.' % num_lines)
+        print('vector size: %d\nvocab size: %d\nx_max: %f\nalpha: %f\nlearning rate: %f' % (vector_size, vocab_size, x_max, alpha, eta))
+    history = []
+    size = min(batch_size, WARMUP_BATCH)
+    for it in range(num_iter):
+        start, total_cost = time.time(), 0.0
+        lo = 0
+        while lo < num_lines:
+            batch = records[lo: lo + size]
+            lo += size
+            total_cost += train_batch(W, gradsq, batch['word1'], batch['word2'], batch['val'], vocab_size, x_max, alpha, eta)
+            size = min(batch_size, 2 * size)
+        seconds = time.time() - start
+        history.append((total_cost / num_lines, seconds))
+        if verbose > 0:
+            print('%s, iter: %03d, cost: %f, num_lines: %d, total_cost: %f, %.0f lines/s' %
+                  (time.strftime('%x - %I:%M.%S%p'), it + 1, total_cost / num_lines, num_lines, total_cost, num_lines / seconds))
+            sys.stdout.flush()
+    return W, history
+
+
+def save_params(W, words, save_file, model=2, use_binary=0, use_unk_vec=True, write_header=False):
+    vocab_size, vector_size = len(words), W.shape[1] - 1
+    if use_binary > 0:
+        W.astype(np.float64).tofile(save_file + '.bin')
+    if use_binary == 1:
+        return
+    word_rows, context_rows = W[:vocab_size], W[vocab_size:]
+    if model == 0:
+        out = np.hstack([word_rows, context_rows])
+    elif model == 1:
+        out = word_rows[:, :vector_size]
+    else:
+        out = word_rows[:, :vector_size] + context_rows[:, :vector_size]
+    out_words = list(words)
+    if use_unk_vec:
+        num_rare_words = min(vocab_size, 100)
+        out = np.vstack([out, out[vocab_size - num_rare_words:].mean(0, keepdims=True)])
+        out_words.append('<unk>')
+    write_text(save_file + '.txt', out_words, out, precision=6, header=write_header)
+
+
+############################# benchmark #############################
+
+def write_synthetic_crec(path, vocab_size, num_records, seed=1234):
+    # zipf-like word ids with counts that decay with the id product, shuffled like the output of shuffle.c
+    rng = np.random.RandomState(seed)
+    records = np.empty(num_records, dtype=CREC_DTYPE)
+    records['word1'] = np.minimum(rng.zipf(1.3, num_records), vocab_size)
+    records['word2'] = np.minimum(rng.zipf(1.3, num_records), vocab_size)
+    records['val'] = 1000.0 / np.sqrt(records['word1'] * records['word2']) * rng.uniform(0.5, 1.5, num_records)
+    records.tofile(path)
+    return path
+
+
+def run_c_glove(glove_bin, input_file, vocab_file, save_file, vector_size, num_iter, x_max, num_threads):
+    cmd = [glove_bin, '-input-file', input_file, '-vocab-file', vocab_file, '-save-file', save_file, '-verbose', '2',
+           '-vector-size', str(vector_size), '-iter', str(num_iter), '-x-max', str(x_max), '-threads', str(num_threads),
+           '-binary', '0']
+    start = time.time()
+    proc = subprocess.run(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+    seconds = time.time() - start
+    costs = [float(x) for x in re.findall(r'iter: \d+, cost: ([-\d.eE+naif]+)', proc.stderr)]
+    return costs, seconds
+
+
+def benchmark(glove_bin='', vocab_size=20000, num_records=2000000, vector_size=50, num_iter=10, x_max=10.0,
+              batch_sizes=(1 << 10, 1 << 12, 1 << 14), num_threads=1, tmp_dir=''):
+    tmp_dir = tmp_dir or tempfile.mkdtemp(prefix='semglove_train_')
+    input_file = write_synthetic_crec(os.path.join(tmp_dir, 'synthetic.crec.bin'), vocab_size, num_records)
+    vocab_file = os.path.join(tmp_dir, 'vocab.txt')
+    with open(vocab_file, 'w') as f:
+        f.write(''.join('w%d %d\n' % (idx, vocab_size - idx) for idx in range(vocab_size)))
+    if not glove_bin:
+        glove_bin = os.path.join(tmp_dir, 'glove')
+        subprocess.check_call(['gcc', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'glove.c'), '-o', glove_bin,
+                               '-lm', '-pthread', '-Ofast', '-march=native', '-funroll-loops'])
+    results = []
+    costs, seconds = run_c_glove(glove_bin, input_file, vocab_file, os.path.join(tmp_dir, 'c.vectors'), vector_size,
+                                 num_iter, x_max, num_threads)
+    results.append(('glove.c x%d threads' % num_threads, costs, seconds))
+    for batch_size in batch_sizes:
+        start = time.time()
+        _, history = train(input_file, vocab_size, vector_size, num_iter, x_max, batch_size=batch_size, verbose=0)
+        results.append(('numpy batch %d' % batch_size, [cost for cost, _ in history], time.time() - start))
+
+    print('%d records, vocab %d, dim %d, %d iterations' % (num_records, vocab_size, vector_size, num_iter))
+    print('trainer\tseconds\tlines/s\t' + '\t'.join('iter%d' % (it + 1) for it in range(num_iter)))
+    for name, costs, seconds in results:
+        print('%s\t%.1f\t%.0f\t%s' % (name, seconds, num_records * num_iter / seconds, '\t'.join('%.4f' % c for c in costs)))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='NumPy GloVe trainer on CREC co-occurrence files')
+    parser.add_argument('command', nargs='?', default='train', choices=['train', 'bench'])
+    parser.add_argument('--input', default='')
+    parser.add_argument('--vocab', default='data/vocab/vocab.wiki.word.txt')
+    parser.add_argument('--save_file', default='vectors')
+    parser.add_argument('--vector_size', default=50, type=int)
+    parser.add_argument('--iter', default=25, type=int)
+    parser.add_argument('--x_max', default=100.0, type=float)
+    parser.add_argument('--alpha', default=0.75, type=float)
+    parser.add_argument('--eta', default=0.05, type=float)
+    parser.add_argument('--batch_size', default=1 << 12, type=int)
+    parser.add_argument('--model', default=2, type=int, help='same as glove.c -model')
+    parser.add_argument('--binary', default=0, type=int, help='same as glove.c -binary')
+    parser.add_argument('--write_header', action='store_true')
+    parser.add_argument('--seed', default=1, type=int)
+    parser.add_argument('--glove_bin', default='', help='bench: glove.c binary, compiled from src/glove.c if empty')
+    parser.add_argument('--records', default=2000000, type=int)
+    parser.add_argument('--threads', default=1, type=int, help='bench: glove.c threads')
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        benchmark(args.glove_bin, num_records=args.records, vector_size=args.vector_size, num_iter=min(args.iter, 10),
+                  num_threads=args.threads)
+    else:
+        words = read_vocab_words(args.vocab)
+        W, _ = train(args.input, len(words), args.vector_size, args.iter, args.x_max, args.alpha, args.eta,
+                     args.batch_size, args.seed)
+        save_params(W, words, args.save_file, args.model if args.model in (0, 1) else 2, args.binary,
+                    write_header=args.write_header)
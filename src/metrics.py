@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+# Stage timers, counters and memory samples of the dump and co-occurrence jobs, written as JSON lines.
+#
+# Module level state like block_io: configure() once from the command line, then the jobs call
+#   start(job) ... finish(job)         one job (resets the timers and counters, writes a final record)
+#   with timer('forward'): ...         wall time per stage
+#   for x in timed_iter('collate', it)  time spent in next() of an iterator
+#   count('sentences', n)              counters, reported with their rate per second
+#   report(job)                        a record every --metrics_interval seconds (cheap to call per batch)
+# Every record holds the elapsed time, the stage seconds and calls, the counters and rates, the current RSS and the
+# peak RSS. With --profile cprofile the job runs under cProfile (stats in <metrics_file>.<job>.prof); with
+# --profile sample a thread samples the main thread stack every few ms and the final record lists the hottest
+# functions. Without a metrics file only the timers and counters are kept, so the calls stay cheap.
+#
+#   python src/bert_cooccur_mindspore.py ... --metrics_file dump.metrics.jsonl --profile sample
+import cProfile
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+state = {'path': '', 'profile': '', 'interval': 30.0, 'sample_ms': 5.0}
+job = {'name': '', 'start': 0.0, 'last_report': 0.0, 'timers': {}, 'calls': {}, 'counters': {}, 'max_rss_mb': 0.0,
+       'profiler': None, 'sampler': None}
+
+
+def configure(path='', profile='', interval=30.0, sample_ms=5.0):
+    state.update(path=path, profile=profile, interval=interval, sample_ms=sample_ms)
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/status') as fin:
+            for line in fin:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    return peak_rss_mb()
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1048576.0 if sys.platform == 'darwin' else 1024.0)
+
+
+class StackSampler(threading.Thread):
+    # counts the function at the top of the main thread stack (and its caller) every sample_ms
+    def __init__(self, sample_ms):
+        threading.Thread.__init__(self, name='metrics-sampler')
+        self.daemon = True
+        self.sample_seconds = sample_ms / 1000.0
+        self.thread_id = threading.main_thread().ident
+        self.samples = Counter()
+        self.running = True
+
+    def run(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                caller = frame.f_back
+                self.samples['%s:%d %s <- %s' % (os.path.basename(frame.f_code.co_filename), frame.f_lineno or 0, frame.f_code.co_name,
+                                                 caller.f_code.co_name if caller is not None else '')] += 1
+            time.sleep(self.sample_seconds)
+
+    def stop(self, top=20):
+        self.running = False
+        self.join()  # the sampler may still be adding to samples
+        total = float(max(1, sum(self.samples.values())))
+        return [{'where': where, 'share': n / total} for where, n in self.samples.most_common(top)]
+
+
+def start(name):
+    job.update(name=name, start=time.time(), last_report=time.time(), timers={}, calls={}, counters={}, max_rss_mb=0.0,
+               profiler=None, sampler=None)
+    if state['path'] and state['profile'] == 'cprofile':
+        job['profiler'] = cProfile.Profile()
+        job['profiler'].enable()
+    elif state['path'] and state['profile'] == 'sample':
+        job['sampler'] = StackSampler(state['sample_ms'])
+        job['sampler'].start()
+
+
+def add_time(stage, seconds):
+    job['timers'][stage] = job['timers'].get(stage, 0.0) + seconds
+    job['calls'][stage] = job['calls'].get(stage, 0) + 1
+
+
+@contextmanager
+def timer(stage):
+    start_time = time.time()
+    try:
+        yield
+    finally:
+        add_time(stage, time.time() - start_time)
+
+
+def timed_iter(stage, iterable):
+    iterator = iter(iterable)
+    while True:
+        start_time = time.time()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            add_time(stage, time.time() - start_time)
+            return
+        add_time(stage, time.time() - start_time)
+        yield item
+
+
+def count(name, n=1):
+    job['counters'][name] = job['counters'].get(name, 0) + n
+
+
+def snapshot(final=False, **extra):
+    elapsed = time.time() - job['start']
+    rss = rss_mb()
+    job['max_rss_mb'] = max(job['max_rss_mb'], rss)
+    record = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'job': job['name'], 'final': final, 'elapsed_s': elapsed,
+              'timers_s': dict(job['timers']), 'calls': dict(job['calls']), 'counters': dict(job['counters']),
+              'rates_per_s': {k: v / elapsed for k, v in job['counters'].items()} if elapsed > 0 else {},
+              'rss_mb': rss, 'max_rss_mb': max(job['max_rss_mb'], peak_rss_mb() if final else 0.0)}
+    record.update(extra)
+    return record
+
+
+def write(record):
+    if not state['path']:
+        return
+    with open(state['path'], 'a') as fout:
+        fout.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+def report(force=False, **extra):
+    # writes a record when --metrics_interval seconds passed since the last one
+    if not state['path']:
+        return
+    now = time.time()
+    if force or now - job['last_report'] >= state['interval']:
+        job['last_report'] = now
+        write(snapshot(**extra))
+
+
+def finish(**extra):
+    if job['profiler'] is not None:
+        job['profiler'].disable()
+        profile_path = '%s.%s.prof' % (state['path'], job['name'])
+        job['profiler'].dump_stats(profile_path)
+        extra['profile'] = profile_path
+    if job['sampler'] is not None:
+        extra['hot_spots'] = job['sampler'].stop()
+    record = snapshot(final=True, **extra)
+    write(record)
+    return record
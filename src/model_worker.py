@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+# Resident worker: load the model once and run the MLM / SAN sweeps of many corpus shards from a spool directory.
+#
+# Every bert_cooccur_mindspore.py call pays the imports, the model load and the first (warm-up) forward again; with
+# hundreds of shards (xaa, xab, ...) that is a large part of the run. A job is a JSON file (task, corpus, save path,
+# windows, weightings, ...) in <spool>/pending. Workers claim jobs by renaming them to <spool>/running (atomic, so
+# several workers can share a spool), run them through mlm_sem_glove_sweep / self_attention_sem_glove_sweep and move
+# them to done/ (with timings) or failed/ (with the traceback). While a shard runs on the model, the corpus of the
+# next job is claimed and read in a thread, so the model does not wait for the disk between shards. Jobs that were
+# running when a worker died stay in running/; `requeue` moves them back and --resume continues them from their
+# checkpoints.
+#
+#   python src/model_worker.py serve --spool spool --model_name bert-large-uncased --batch_size 64
+#   python src/model_worker.py submit --spool spool --task mlm --corpus_path /data/wiki --corpus_names xaa,xab,xac --sweep_windows 5,10
+#   python src/model_worker.py status --spool spool
+#   python src/benchmark.py --task worker --shards 8
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUES = ('pending', 'running', 'done', 'failed')
+JOB_DEFAULTS = {'task': 'mlm', 'corpus_path': '', 'corpus_name': '', 'save_path': '', 'model_name': '', 'window_size': 5,
+                'sweep_windows': '', 'sweep_weightings': 'divide,reciprocal', 'batch_size': 64, 'san_band': False,
+                'approx_memory_mb': 0.0, 'approx_top_n': 0, 'num_workers': 1, 'san_layers': ''}
+
+
+def spool_dirs(spool):
+    dirs = {}
+    for queue in QUEUES:
+        dirs[queue] = os.path.join(spool, queue)
+        if not os.path.exists(dirs[queue]):
+            os.makedirs(dirs[queue])
+    return dirs
+
+
+def write_json_atomic(path, record):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as fout:
+        json.dump(record, fout, indent=1)
+    os.replace(temp_path, path)
+
+
+def submit(spool, jobs):
+    # jobs: dicts of JOB_DEFAULTS keys, named by submit time so they run in order
+    dirs = spool_dirs(spool)
+    names = []
+    for idx, job in enumerate(jobs):
+        record = dict(JOB_DEFAULTS)
+        record.update(job)
+        record['submitted'] = time.time()
+        name = '%.6f-%04d-%s-%s.json' % (record['submitted'], idx, record['task'], record['corpus_name'])
+        write_json_atomic(os.path.join(dirs['pending'], name), record)
+        names.append(name)
+    print('submitted %d jobs to %s' % (len(names), dirs['pending']))
+    return names
+
+
+def claim_next(dirs):
+    # -> (name, job) moved from pending to running, or None
+    for name in sorted(os.listdir(dirs['pending'])):
+        if not name.endswith('.json'):
+            continue
+        try:
+            os.rename(os.path.join(dirs['pending'], name), os.path.join(dirs['running'], name))
+        except OSError:
+            continue  # claimed by another worker
+        with open(os.path.join(dirs['running'], name)) as fin:
+            return name, json.load(fin)
+    return None
+
+
+def requeue(spool):
+    dirs = spool_dirs(spool)
+    names = sorted(os.listdir(dirs['running']))
+    for name in names:
+        os.rename(os.path.join(dirs['running'], name), os.path.join(dirs['pending'], name))
+    print('requeued %d jobs' % len(names))
+
+
+def status(spool):
+    dirs = spool_dirs(spool)
+    for queue in QUEUES:
+        names = sorted(name for name in os.listdir(dirs[queue]) if name.endswith('.json'))
+        print('%s\t%d' % (queue, len(names)))
+        if queue == 'running':
+            for name in names:
+                print('\t' + name)
+    done = []
+    for name in sorted(os.listdir(dirs['done'])):
+        with open(os.path.join(dirs['done'], name)) as fin:
+            done.append(json.load(fin))
+    if done:
+        print('done jobs: %.1fs per shard, %.1fs waiting for the model between shards on average' %
+              (sum(item['seconds'] for item in done) / len(done), sum(item['idle_s'] for item in done) / len(done)))
+    sys.stdout.flush()
+
+
+class ModelWorker(object):
+    def __init__(self, spool, model_name, model, masked_model, tokenizer, poll_seconds=5.0, exit_when_idle=False):
+        import bert_cooccur_mindspore as bc
+        self.bc = bc
+        self.dirs = spool_dirs(spool)
+        self.model_name = model_name
+        self.model, self.masked_model, self.tokenizer = model, masked_model, tokenizer
+        self.poll_seconds = poll_seconds
+        self.exit_when_idle = exit_when_idle
+        self.worker_id = '%s:%d' % (socket.gethostname(), os.getpid())
+        # the dump functions read the model name set in __main__ of bert_cooccur_mindspore
+        bc.model_name = model_name
+
+    def warm_up(self):
+        # one forward of both heads, so the first shard does not pay the graph building
+        start = time.time()
+        dataset = self.bc.CustomDataset(self.model_name, [('warm up the model', 0)], self.tokenizer)
+        batch = self.bc.collate_fn([dataset[0]])
+        self.masked_model(input_ids=batch['wordpiece_ids'], attention_mask=batch['wordpiece_masks'])
+        self.model(input_ids=batch['wordpiece_ids'], attention_mask=batch['wordpiece_masks'], output_attentions=True)
+        print('warm-up forward: %.2fs' % (time.time() - start))
+        return time.time() - start
+
+    def prefetch(self):
+        # claim the next job and read its corpus -> (name, job, dataset, seconds) or None
+        claimed = claim_next(self.dirs)
+        if claimed is None:
+            return None
+        name, job = claimed
+        start = time.time()
+        corpus = os.path.join(job['corpus_path'], job['corpus_name'])
+        dataset = self.bc.load_data(corpus) if os.path.exists(corpus) else None
+        return name, job, dataset, time.time() - start
+
+    def run_job(self, job, dataset=None):
+        bc = self.bc
+        if job['model_name'] and job['model_name'] != self.model_name:
+            raise ValueError('job wants model %s, this worker serves %s' % (job['model_name'], self.model_name))
+        sweep_configs = bc.parse_sweep_configs(job['sweep_windows'] or str(job['window_size']), job['sweep_weightings'])
+        corpus_path = os.path.join(job['corpus_path'], job['corpus_name'])
+        model_dir = os.path.basename(os.path.normpath(self.model_name))
+        task_dir = 'san' if job['task'] == 'san' else 'mlm'
+        dump_path = os.path.join(job['save_path'], model_dir, task_dir, 'dump_weights')
+        if not os.path.exists(dump_path):
+            os.makedirs(dump_path)
+        coo_root = os.path.join(job['save_path'], model_dir, task_dir, 'cooccur')
+        if job['task'] == 'san':
+            bc.self_attention_sem_glove_sweep(self.model_name, job['corpus_name'], corpus_path, dump_path, coo_root,
+                                              job['batch_size'], self.model, self.tokenizer, sweep_configs,
+                                              banded=job['san_band'], memory_mb=job['approx_memory_mb'],
+                                              top_n=job['approx_top_n'], num_workers=job['num_workers'], dataset=dataset,
+                                              layer_range=bc.parse_layer_range(job['san_layers']))
+        elif job['task'] == 'mlm':
+            bc.mlm_sem_glove_sweep(job['corpus_name'], corpus_path, dump_path, coo_root, job['batch_size'], self.masked_model,
+                                   self.tokenizer, sweep_configs, memory_mb=job['approx_memory_mb'],
+                                   top_n=job['approx_top_n'], num_workers=job['num_workers'], dataset=dataset)
+        else:
+            raise ValueError('Unknown task: %s' % job['task'])
+
+    def finish_job(self, name, job, queue, **extra):
+        job.update(extra, worker=self.worker_id)
+        write_json_atomic(os.path.join(self.dirs[queue], name), job)
+        os.remove(os.path.join(self.dirs['running'], name))
+
+    def serve(self):
+        # -> number of jobs run; the next job is prefetched while the current one runs
+        num_jobs, last_finish = 0, time.time()
+        with ThreadPoolExecutor(1) as pool:
+            pending = pool.submit(self.prefetch)
+            while True:
+                claimed = pending.result()
+                if claimed is None:
+                    if self.exit_when_idle:
+                        break
+                    time.sleep(self.poll_seconds)
+                    pending = pool.submit(self.prefetch)
+                    continue
+                pending = pool.submit(self.prefetch)
+                name, job, dataset, load_seconds = claimed
+                print('=' * 20 + ' job %s (%s %s)' % (name, job['task'], job['corpus_name']))
+                sys.stdout.flush()
+                start = time.time()
+                idle = start - max(last_finish, job['submitted'])
+                try:
+                    self.run_job(job, dataset)
+                    self.finish_job(name, job, 'done', started=start, seconds=time.time() - start, idle_s=idle,
+                                    prefetch_s=load_seconds, queued_s=start - job['submitted'])
+                except Exception:
+                    traceback.print_exc()
+                    self.finish_job(name, job, 'failed', started=start, seconds=time.time() - start,
+                                    error=traceback.format_exc())
+                claimed = dataset = None
+                last_finish = time.time()
+                num_jobs += 1
+        print('worker %s ran %d jobs' % (self.worker_id, num_jobs))
+        return num_jobs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Resident model worker for SemGloVe co-occurrence shards')
+    parser.add_argument('command', choices=['serve', 'submit', 'status', 'requeue'])
+    parser.add_argument('--spool', required=True)
+    parser.add_argument('--model_name', default='bert-large-uncased')
+    parser.add_argument('--bert_path', default='/home/ganleilei/data/bert')
+    parser.add_argument('--poll', default=5.0, type=float, help='seconds between looks at an empty spool')
+    parser.add_argument('--exit_when_idle', action='store_true')
+    parser.add_argument('--compress', action='store_true')
+    parser.add_argument('--compress_level', default=6, type=int)
+    parser.add_argument('--compress_threads', default=4, type=int)
+    parser.add_argument('--metrics_file', default='')
+    parser.add_argument('--metrics_interval', default=30.0, type=float)
+    parser.add_argument('--checkpoint_interval', default=900.0, type=float)
+    parser.add_argument('--resume', action='store_true', help='continue requeued jobs from their checkpoints')
+    parser.add_argument('--static_graph', action='store_true', help='compiled bucketed forward, kept across shards')
+    parser.add_argument('--buckets', default='32,64,128,256,512')
+    # submit
+    parser.add_argument('--task', default='mlm', choices=['mlm', 'san'])
+    parser.add_argument('--corpus_path', default='/home/ganleilei/data/BertGloVe/wiki/')
+    parser.add_argument('--corpus_names', default='', help='comma separated shards, e.g. xaa,xab')
+    parser.add_argument('--save_path', default='/home/ganleilei/data/BertGloVe/wiki/')
+    parser.add_argument('--window_size', default=5, type=int)
+    parser.add_argument('--sweep_windows', default='')
+    parser.add_argument('--sweep_weightings', default='divide,reciprocal')
+    parser.add_argument('--batch_size', default=64, type=int)
+    parser.add_argument('--san_band', action='store_true')
+    parser.add_argument('--approx_memory_mb', default=0, type=float)
+    parser.add_argument('--approx_top_n', default=0, type=int)
+    parser.add_argument('--num_workers', default=1, type=int)
+    parser.add_argument('--san_layers', default='', help='san: sum the attention of layers FIRST-LAST only')
+    args = parser.parse_args()
+
+    if args.command == 'submit':
+        submit(args.spool, [{'task': args.task, 'corpus_path': args.corpus_path, 'corpus_name': corpus_name,
+                             'save_path': args.save_path, 'model_name': args.model_name, 'window_size': args.window_size,
+                             'sweep_windows': args.sweep_windows, 'sweep_weightings': args.sweep_weightings,
+                             'batch_size': args.batch_size, 'san_band': args.san_band,
+                             'approx_memory_mb': args.approx_memory_mb, 'approx_top_n': args.approx_top_n,
+                             'num_workers': args.num_workers, 'san_layers': args.san_layers}
+                            for corpus_name in args.corpus_names.split(',') if corpus_name.strip()])
+    elif args.command == 'status':
+        status(args.spool)
+    elif args.command == 'requeue':
+        requeue(args.spool)
+    else:
+        import torch
+        import block_io
+        import checkpoint
+        import metrics
+        import static_graph
+        import bert_cooccur_mindspore as bc
+        torch.multiprocessing.set_start_method('spawn')
+        block_io.configure(args.compress, args.compress_level, args.compress_threads)
+        metrics.configure(args.metrics_file, '', args.metrics_interval)
+        checkpoint.configure(args.checkpoint_interval, args.resume)
+        static_graph.configure(args.static_graph, static_graph.parse_buckets(args.buckets))
+        start = time.time()
+        model, masked_model, tokenizer = bc.init_model(args.model_name, args.bert_path)
+        worker = ModelWorker(args.spool, args.model_name, model, masked_model, tokenizer, args.poll, args.exit_when_idle)
+        worker.warm_up()
+        print('model ready in %.1fs' % (time.time() - start))
+        worker.serve()
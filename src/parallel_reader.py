@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# Parallel parsing of large text files.
+#
+# A file is split into byte ranges that start at a line boundary (or at a '###' sentence header for
+# dump files), every range is parsed in a worker process with plain binary reads, and the partial
+# results are combined in range order, so the result is the same as a single sequential pass.
+# Block compressed '.gz' files (block_io.py) are split by compressed blocks instead of bytes.
+import os
+import sys
+from multiprocessing import Pool
+import block_io
+
+READ_BLOCK = 1 << 24
+DUMP_HEADER = b'###'
+
+
+def next_line_start(fin, pos, size, header=None):
+    if pos <= 0:
+        return 0
+    fin.seek(pos - 1)
+    fin.readline()
+    while header is not None:
+        line_start = fin.tell()
+        line = fin.readline()
+        if not line:
+            return size
+        if line.startswith(header):
+            return line_start
+    return fin.tell()
+
+
+def split_ranges(path, num_chunks, header=None):
+    if block_io.is_compressed(path):
+        total_blocks = block_io.num_blocks(path)
+        bounds = sorted(set(total_blocks * chunk_idx // num_chunks for chunk_idx in range(num_chunks + 1)))
+        return list(zip(bounds[:-1], bounds[1:]))
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, 'rb') as fin:
+        for chunk_idx in range(1, num_chunks):
+            pos = max(size * chunk_idx // num_chunks, bounds[-1])
+            bounds.append(next_line_start(fin, pos, size, header))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+
+def iter_lines(path, start=0, end=None, encoding='utf-8', errors='strict', header=None):
+    # lines of path[start:end] without the trailing newline, read in large binary blocks
+    # for compressed files start and end are block numbers from split_ranges
+    if block_io.is_compressed(path):
+        yield from block_io.iter_block_lines(path, start, end, header, encoding, errors)
+        return
+    if end is None:
+        end = os.path.getsize(path)
+    with open(path, 'rb') as fin:
+        fin.seek(start)
+        remain, rest = end - start, b''
+        while remain > 0:
+            block = fin.read(min(READ_BLOCK, remain))
+            if not block:
+                break
+            remain -= len(block)
+            lines = (rest + block).split(b'\n')
+            rest = lines.pop()
+            for line in lines:
+                yield line.decode(encoding, errors)
+        if rest:
+            yield rest.decode(encoding, errors)
+
+
+def _run_range(task):
+    parse_fn, path, start, end, header, args = task
+    return parse_fn(iter_lines(path, start, end, header=header), *args)
+
+
+def parallel_parse(path, parse_fn, combine_fn, num_workers, args=(), header=None, ranges=None, total=None,
+                   on_partial=None):
+    # parse_fn(lines, *args) -> partial result, combine_fn(total, partial) -> total; both must be picklable
+    # ranges (from split_ranges) and a starting total let a caller continue a partly parsed file, on_partial(n, total)
+    # is called after the first n ranges are combined
+    if num_workers <= 1 and ranges is None:
+        return parse_fn(iter_lines(path), *args)
+    ranges = split_ranges(path, num_workers * 4, header) if ranges is None else ranges
+    tasks = [(parse_fn, path, start, end, header, args) for start, end in ranges]
+    with Pool(max(1, num_workers)) as pool:
+        for range_idx, partial in enumerate(pool.imap(_run_range, tasks)):
+            total = partial if total is None else combine_fn(total, partial)
+            if on_partial is not None:
+                on_partial(range_idx + 1, total)
+    return total if total is not None else parse_fn(iter(()), *args)
+
+
+############################# co-occurrence text files #############################
+
+def parse_pair_count(lines):
+    pair_count = {}
+    for idx, line in enumerate(lines):
+        if (idx + 1) % 1e6 == 0:
+            print('processing %d number lines...' % (idx + 1))
+            sys.stdout.flush()
+        parts = line.strip().split('\t')
+        if len(parts) != 3:
+            print('Read error line for pair count:', line)
+            continue
+        pair_count[(parts[0], parts[1])] = float(parts[2])
+    return pair_count
+
+
+def parse_word_pair(lines):
+    word_pairs = set()
+    for idx, line in enumerate(lines):
+        if (idx + 1) % 1e6 == 0:
+            print('processing %d number lines...' % (idx + 1))
+        parts = line.strip().split('\t')
+        if len(parts) != 3:
+            print('Read error line for pair count:', line)
+            continue
+        word_pairs.add((parts[0], parts[1]))
+    return word_pairs
+
+
+def parse_coo_matrix(lines):
+    res_coo = {}
+    for line in lines:
+        parts = line.strip().split('\t')
+        k = (parts[0], parts[1])
+        res_coo[k] = res_coo.get(k, 0) + float(parts[-1])
+    return res_coo
+
+
+def update_dict(total, partial):
+    total.update(partial)
+    return total
+
+
+def update_set(total, partial):
+    total |= partial
+    return total
+
+
+def sum_dict(total, partial):
+    if len(partial) > len(total):
+        total, partial = partial, total
+    for k, v in partial.items():
+        total[k] = total.get(k, 0) + v
+    return total
+
+
+def sum_dict_list(total, partial):
+    return [sum_dict(t, p) for t, p in zip(total, partial)]
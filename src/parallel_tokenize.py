@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# Multi-process wordpiece tokenization of a corpus, one output line per input line in the original order.
+#
+# The corpus is split into byte ranges at line boundaries (parallel_reader.split_ranges), every range is
+# tokenized in a worker and the results are written back in range order. BERT's basic tokenizer never
+# joins text across a space, so tokenizing a line is the same as tokenizing its space separated words one
+# by one, which lets every worker cache the pieces of each word in an LRU. With --ids the wordpiece ids
+# are also written as int32 to P.ids, with the int64 end offset of every line in P.lines.
+#
+#   python src/parallel_tokenize.py --corpus wiki.txt --output wiki.bpe.txt --vocab vocab.txt --num_workers 8
+#   python src/parallel_tokenize.py --corpus wiki.txt --vocab vocab.txt --bench 1,2,4,8
+import argparse
+import codecs
+import os
+import sys
+import time
+from functools import lru_cache
+from multiprocessing import Pool
+import numpy as np
+from parallel_reader import iter_lines, split_ranges
+
+CHUNK_BYTES = 32 << 20
+
+worker = {}
+
+
+def load_tokenizer(vocab_path):
+    from pytorch_pretrained_bert import BertTokenizer
+    return BertTokenizer.from_pretrained(vocab_path)
+
+
+def init_worker(vocab_path, cache_size, with_ids):
+    tokenizer = load_tokenizer(vocab_path)
+    worker['tokenizer'] = tokenizer
+    worker['with_ids'] = with_ids
+    if cache_size > 0:
+        worker['tokenize_word'] = lru_cache(maxsize=cache_size)(lambda word: tuple(tokenizer.tokenize(word)))
+    else:
+        worker['tokenize_word'] = tokenizer.tokenize
+
+
+def tokenize_range(task):
+    # -> (text of the range, int32 ids, int64 number of ids per line, number of lines)
+    path, start, end = task
+    tokenize_word = worker['tokenize_word']
+    texts, ids, lengths = [], [], []
+    for line in iter_lines(path, start, end, errors='ignore'):
+        pieces = [piece for word in line.strip().split(' ') if word for piece in tokenize_word(word)]
+        texts.append(' '.join(pieces) + '\n')
+        if worker['with_ids']:
+            ids.extend(worker['tokenizer'].convert_tokens_to_ids(pieces))
+            lengths.append(len(pieces))
+    return ''.join(texts), np.array(ids, dtype=np.int32), np.array(lengths, dtype=np.int64), len(texts)
+
+
+def tokenize_corpus(path, outpath, vocab_path, num_workers=4, cache_size=1 << 20, with_ids=False, chunk_bytes=CHUNK_BYTES):
+    print('in path:', path)
+    print('out path:', outpath)
+    start = time.time()
+    num_chunks = max(num_workers * 4, os.path.getsize(path) // chunk_bytes)
+    tasks = [(path, lo, hi) for lo, hi in split_ranges(path, num_chunks)]
+    fout = codecs.open(outpath, 'w+', 'utf-8') if outpath else None
+    fids = open(outpath + '.ids', 'wb') if outpath and with_ids else None
+    line_ends, num_lines, num_ids = [], 0, 0
+    init_args = (vocab_path, cache_size, with_ids)
+    if num_workers > 1:
+        pool = Pool(num_workers, initializer=init_worker, initargs=init_args)
+        results = pool.imap(tokenize_range, tasks)
+    else:
+        pool = None
+        init_worker(*init_args)
+        results = map(tokenize_range, tasks)
+    for text, ids, lengths, count in results:
+        if fout is not None:
+            fout.write(text)
+        if fids is not None:
+            ids.tofile(fids)
+            line_ends.append(num_ids + np.cumsum(lengths))
+        num_ids += int(lengths.sum())
+        num_lines += count
+        print('processing %d lines, %.0f lines/s.' % (num_lines, num_lines / (time.time() - start)))
+        sys.stdout.flush()
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if fout is not None:
+        fout.close()
+    if fids is not None:
+        fids.close()
+        (np.concatenate(line_ends) if line_ends else np.zeros(0, np.int64)).tofile(outpath + '.lines')
+    seconds = time.time() - start
+    print('tokenized %d lines in %.1fs (%.0f lines/s, %.1f MB/s)' %
+          (num_lines, seconds, num_lines / seconds, os.path.getsize(path) / float(1 << 20) / seconds))
+    return num_lines, seconds
+
+
+def read_ids(outpath, line_idx):
+    # wordpiece ids of one line of a --ids output
+    ends = np.memmap(outpath + '.lines', dtype=np.int64, mode='r')
+    ids = np.memmap(outpath + '.ids', dtype=np.int32, mode='r')
+    return ids[ends[line_idx - 1] if line_idx > 0 else 0: ends[line_idx]]
+
+
+def benchmark(path, vocab_path, worker_counts, cache_sizes=(0, 1 << 20)):
+    size_mb = os.path.getsize(path) / float(1 << 20)
+    print('workers\tcache\tlines/s\tMB/s')
+    for cache_size in cache_sizes:
+        for num_workers in worker_counts:
+            num_lines, seconds = tokenize_corpus(path, '', vocab_path, num_workers, cache_size)
+            print('%d\t%d\t%.0f\t%.2f' % (num_workers, cache_size, num_lines / seconds, size_mb / seconds))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parallel wordpiece tokenization of a corpus')
+    parser.add_argument('--corpus', required=True)
+    parser.add_argument('--output', default='')
+    parser.add_argument('--vocab', default='bert-base-uncased', help='BertTokenizer vocab path or model name')
+    parser.add_argument('--num_workers', default=4, type=int)
+    parser.add_argument('--cache_size', default=1 << 20, type=int, help='LRU entries per worker, 0 disables the cache')
+    parser.add_argument('--ids', action='store_true', help='also write int32 wordpiece ids')
+    parser.add_argument('--bench', default='', help='worker counts to benchmark, e.g. 1,2,4,8')
+    args = parser.parse_args()
+
+    if args.bench:
+        benchmark(args.corpus, args.vocab, [int(x) for x in args.bench.split(',')])
+    else:
+        tokenize_corpus(args.corpus, args.output, args.vocab, args.num_workers, args.cache_size, args.ids)
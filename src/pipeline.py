@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+# End-to-end training from co-occurrence text files without the intermediate .coo/.bin/.shuf copies.
+#
+#   aggregate  sum the word\tword\tvalue files (a file or a directory, like merge_coo_matrix) as int64 keys
+#              word1 * num_cols + word2 of the build_vocab ids (pairs outside the vocab are dropped, as
+#              convert_txt_to_bin); the sums are held in memory up to the --memory_mb budget, beyond it they are
+#              written as sorted runs in a temp directory and merged in bounded key ranges as coo_lsm.py does
+#   encode     summed keys -> CREC records, streamed in chunks
+#   shuffle    in memory with a seeded permutation when the records fit --memory_mb, otherwise the records are
+#              piped into build/shuffle (stdin -> stdout), so the unshuffled .bin never exists
+#   train      build/glove or the NumPy trainer (src/glove_train.py)
+#
+# glove.c seeks in its input, so the shuffled records are a file: in /dev/shm when they fit the memory budget,
+# otherwise next to the save file, removed after training. The NumPy trainer takes the in-memory records
+# directly. Per-stage wall time and the disk bytes that were not written are printed at the end.
+#
+#   python src/pipeline.py --coo mlm.word.coo --vocab data/vocab/vocab.wiki.word.txt --save_file mlm.glove.vectors --memory_mb 4096
+import argparse
+import itertools
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from coo_lsm import Segment, iter_merged, reduce_keys
+from coo_store import CREC_DTYPE, id_to_word, read_vocab
+from parallel_reader import iter_lines, parallel_parse
+import block_io
+import glove_train
+
+CHUNK_RECORDS = 1 << 20
+SHM_DIR = '/dev/shm'
+MIN_SHUFFLE_MB = 1.0  # shuffle.c sizes its array from -memory, with a near zero budget it reads nothing
+RUN_IDS = itertools.count()
+
+
+class StageTimer(object):
+    def __init__(self):
+        self.stages = []
+
+    def run(self, name, fn, *args, **kwargs):
+        print('==> %s' % name)
+        sys.stdout.flush()
+        start = time.time()
+        res = fn(*args, **kwargs)
+        self.stages.append((name, time.time() - start))
+        return res
+
+    def report(self, bytes_avoided):
+        print('stage\tseconds')
+        for name, seconds in self.stages:
+            print('%s\t%.2f' % (name, seconds))
+        print('total\t%.2f' % sum(seconds for _, seconds in self.stages))
+        for name, num_bytes in bytes_avoided:
+            print('not written: %s %.1f MB' % (name, num_bytes / 1048576.0))
+        print('disk bytes avoided: %d' % sum(num_bytes for _, num_bytes in bytes_avoided))
+        sys.stdout.flush()
+
+
+def coo_files(path):
+    if os.path.isdir(path):
+        return [os.path.join(path, f) for f in sorted(os.listdir(path)) if not f.endswith(block_io.INDEX_SUFFIX)]
+    return [path]
+
+
+class MemoryRun(object):
+    # summed keys still in memory, read by iter_merged like a spilled Segment
+    def __init__(self, keys, vals):
+        self.keys, self.vals = keys, vals
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class KeySpiller(object):
+    # sums (key, value) chunks in memory; past budget_records pairs they are written to run_dir as a sorted run
+    def __init__(self, run_dir, budget_records):
+        self.run_dir, self.budget_records = run_dir, budget_records
+        self.runs = []
+        self.keys, self.vals, self.size = [], [], 0
+
+    def add(self, keys, vals):
+        if len(keys):
+            self.keys.append(keys)
+            self.vals.append(vals)
+            self.size += len(keys)
+        if self.size > self.budget_records:
+            self.spill()
+
+    def reduce(self):
+        if not self.size:
+            return np.zeros(0, np.int64), np.zeros(0)
+        keys, vals = reduce_keys(np.concatenate(self.keys), np.concatenate(self.vals))
+        self.keys, self.vals, self.size = [], [], 0
+        return keys, vals
+
+    def spill(self):
+        keys, vals = self.reduce()
+        name = 'run-%d-%d' % (os.getpid(), next(RUN_IDS))
+        keys.tofile(os.path.join(self.run_dir, name + '.keys'))
+        vals.tofile(os.path.join(self.run_dir, name + '.vals'))
+        self.runs.append(name)
+
+    def segments(self):
+        # the spilled runs and what is left in memory, summed by iter_merged
+        segments = [Segment(self.run_dir, name) for name in self.runs]
+        if self.size:
+            segments.append(MemoryRun(*self.reduce()))
+        return segments
+
+
+def encode_coo_lines(lines, vocab, num_cols, run_dir, budget_records, chunk_lines):
+    # word\tword\tvalue lines -> (spilled run names, keys, vals of the rest); parse_fn of parallel_parse
+    spiller = KeySpiller(run_dir, budget_records)
+    keys, vals = [], []
+    for line in lines:
+        parts = line.strip().split('\t')
+        if len(parts) == 3 and parts[0] in vocab and parts[1] in vocab:
+            keys.append(vocab[parts[0]] * num_cols + vocab[parts[1]])
+            vals.append(float(parts[2]))
+        if len(keys) >= chunk_lines:
+            spiller.add(np.array(keys, dtype=np.int64), np.array(vals, dtype=np.float64))
+            keys, vals = [], []
+    spiller.add(np.array(keys, dtype=np.int64), np.array(vals, dtype=np.float64))
+    return (spiller.runs,) + spiller.reduce()
+
+
+def add_partial(spiller, partial):
+    runs, keys, vals = partial
+    spiller.runs.extend(runs)
+    spiller.add(keys, vals)
+    return spiller
+
+
+def aggregate(paths, vocab, num_cols, run_dir, memory_mb=4096, num_workers=1):
+    # -> segments whose sum is the co-occurrence table; every worker (and the main process) keeps at most its share
+    # of memory_mb: 16 bytes a pair plus the sort of np.unique, and about 64 bytes a line while parsing
+    budget_bytes = memory_mb * 1048576 / (max(1, num_workers) + int(num_workers > 1))
+    budget_records = max(1024, int(budget_bytes // 64))
+    chunk_lines = max(1024, int(budget_bytes // 256))
+    spiller = KeySpiller(run_dir, budget_records)
+    for path in paths:
+        print('aggregate coo path:', path)
+        sys.stdout.flush()
+        args = (vocab, num_cols, run_dir, budget_records, chunk_lines)
+        if num_workers <= 1:
+            add_partial(spiller, encode_coo_lines(iter_lines(path), *args))
+        else:
+            parallel_parse(path, encode_coo_lines, add_partial, num_workers, args, total=spiller)
+    segments = spiller.segments()
+    print('co-occurrence pairs: at most %d, %d runs spilled to %s' %
+          (sum(len(seg) for seg in segments), len(spiller.runs), run_dir))
+    return segments
+
+
+def iter_record_chunks(segments, vocab, num_cols, chunk_records=CHUNK_RECORDS, stats=None):
+    # CREC chunks of the summed segments; stats['text_bytes'] counts the size the merged word\tword\tvalue file
+    # would have had ('%.8f' values)
+    word_bytes = np.array([len(w.encode('utf-8')) for w in id_to_word(vocab)], dtype=np.int64)
+    text_bytes = 0
+    for keys, vals in iter_merged(segments, chunk_records):
+        records = make_records(keys // num_cols, keys % num_cols, vals)
+        int_digits = np.floor(np.log10(np.maximum(np.abs(vals), 1))).astype(np.int64) + 1
+        text_bytes += int(np.sum(word_bytes[records['word1']] + word_bytes[records['word2']] + int_digits + (vals < 0) + 12))
+        yield records
+    if stats is not None:
+        stats['text_bytes'] = text_bytes
+
+
+def make_records(word1, word2, vals):
+    records = np.empty(len(word1), dtype=CREC_DTYPE)
+    records['word1'], records['word2'], records['val'] = word1, word2, vals
+    return records
+
+
+def shuffle_in_memory(chunks, seed=1):
+    chunks = list(chunks)
+    records = np.concatenate(chunks) if chunks else np.zeros(0, dtype=CREC_DTYPE)
+    return records[np.random.RandomState(seed).permutation(len(records))]
+
+
+def shuffle_external(chunks, out_path, build_dir='build', memory_mb=4096, temp_dir=''):
+    # records -> build/shuffle stdin, its stdout -> out_path
+    cmd = [os.path.join(build_dir, 'shuffle'), '-memory', '%.6f' % (max(memory_mb, MIN_SHUFFLE_MB) / 1024.0), '-verbose', '2',
+           '-temp-file', os.path.join(temp_dir or tempfile.gettempdir(), 'temp_shuffle.%d' % os.getpid())]
+    print('$ %s < (pipe) > %s' % (' '.join(cmd), out_path))
+    num_records = 0
+    with open(out_path, 'wb') as fout:
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=fout)
+        for records in chunks:
+            proc.stdin.write(records.tobytes())
+            num_records += len(records)
+        proc.stdin.close()
+        if proc.wait() != 0:
+            raise RuntimeError('shuffle failed with exit code %d' % proc.returncode)
+    if os.path.getsize(out_path) != num_records * CREC_DTYPE.itemsize:
+        raise RuntimeError('shuffle wrote %d of %d records' % (os.path.getsize(out_path) // CREC_DTYPE.itemsize, num_records))
+    return num_records
+
+
+def train_c(input_file, vocab_file, save_file, build_dir='build', vector_size=300, num_iter=15, x_max=10.0,
+            num_threads=8, binary=0, model=2):
+    cmd = [os.path.join(build_dir, 'glove'), '-save-file', save_file, '-threads', str(num_threads), '-input-file', input_file,
+           '-x-max', str(x_max), '-iter', str(num_iter), '-vector-size', str(vector_size), '-binary', str(binary),
+           '-model', str(model), '-vocab-file', vocab_file, '-verbose', '2']
+    print('$ ' + ' '.join(cmd))
+    sys.stdout.flush()
+    subprocess.check_call(cmd)
+
+
+def train_numpy(records, vocab_file, save_file, vector_size=300, num_iter=15, x_max=10.0, binary=0, model=2):
+    words = glove_train.read_vocab_words(vocab_file)
+    W, _ = glove_train.train(records, len(words), vector_size, num_iter, x_max)
+    glove_train.save_params(W, words, save_file, model, binary)
+
+
+def ensure_tools(build_dir):
+    if not all(os.path.exists(os.path.join(build_dir, tool)) for tool in ('shuffle', 'glove')):
+        subprocess.check_call(['make'])
+
+
+def run_pipeline(coo_path, vocab_file, save_file, memory_mb=4096, trainer='glove', build_dir='build', vector_size=300,
+                 num_iter=15, x_max=10.0, num_threads=8, binary=0, model=2, num_workers=1, seed=1, temp_dir=''):
+    timer = StageTimer()
+    bytes_avoided = []
+    paths = coo_files(coo_path)
+    if trainer == 'glove':
+        ensure_tools(build_dir)
+
+    vocab = read_vocab(vocab_file)
+    num_cols = max(vocab.values()) + 1
+    run_dir = tempfile.mkdtemp(prefix='pipeline-runs.', dir=temp_dir or os.path.dirname(os.path.abspath(save_file)))
+    shuf_path = None
+    try:
+        segments = timer.run('aggregate', aggregate, paths, vocab, num_cols, run_dir, memory_mb, num_workers)
+        stats = {}
+        chunks = iter_record_chunks(segments, vocab, num_cols, stats=stats)
+        # the records, their permuted copy and the summed keys and values in memory, 16 bytes a pair each
+        fits = sum(len(seg) for seg in segments) * CREC_DTYPE.itemsize * 3 <= memory_mb * 1048576
+
+        shuf_dir = SHM_DIR if fits and os.path.isdir(SHM_DIR) else (temp_dir or os.path.dirname(os.path.abspath(save_file)))
+        shuf_path = os.path.join(shuf_dir, '%s.%d.shuf.bin' % (os.path.basename(save_file), os.getpid()))
+        if fits:
+            records = timer.run('encode + shuffle (memory)', shuffle_in_memory, chunks, seed)
+            num_records = len(records)
+        else:
+            records = None
+            num_records = timer.run('encode + shuffle (pipe)', shuffle_external, chunks, shuf_path, build_dir, memory_mb, temp_dir)
+        del segments, chunks
+        shutil.rmtree(run_dir)
+        if num_records == 0:
+            raise ValueError('no co-occurrence pairs of %s are in the vocab %s' % (coo_path, vocab_file))
+
+        if len(paths) > 1:
+            bytes_avoided.append(('merged coo text', stats.get('text_bytes', 0)))
+        bytes_avoided.append(('coo.bin', num_records * CREC_DTYPE.itemsize))
+        if trainer == 'numpy':
+            if records is None:
+                records = np.memmap(shuf_path, dtype=CREC_DTYPE, mode='r')
+            else:
+                bytes_avoided.append(('coo.bin.shuf', num_records * CREC_DTYPE.itemsize))
+            timer.run('train (numpy)', train_numpy, records, vocab_file, save_file, vector_size, num_iter, x_max, binary, model)
+        else:
+            if records is not None:
+                records.tofile(shuf_path)
+                del records
+            if shuf_dir == SHM_DIR:
+                bytes_avoided.append(('coo.bin.shuf', num_records * CREC_DTYPE.itemsize))
+            timer.run('train (glove)', train_c, shuf_path, vocab_file, save_file, build_dir, vector_size, num_iter, x_max,
+                      num_threads, binary, model)
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+        if shuf_path and os.path.exists(shuf_path):
+            os.remove(shuf_path)
+    timer.report(bytes_avoided)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Co-occurrence text to GloVe vectors without intermediate files')
+    parser.add_argument('--coo', required=True, help='word\\tword\\tvalue file or directory of files to sum')
+    parser.add_argument('--vocab', default='data/vocab/vocab.wiki.word.txt')
+    parser.add_argument('--save_file', required=True)
+    parser.add_argument('--memory_mb', default=4096, type=float, help='budget for the aggregation, the in-memory shuffle, /dev/shm and shuffle -memory')
+    parser.add_argument('--trainer', default='glove', choices=['glove', 'numpy'])
+    parser.add_argument('--build_dir', default='build')
+    parser.add_argument('--vector_size', default=300, type=int)
+    parser.add_argument('--iter', default=15, type=int)
+    parser.add_argument('--x_max', default=10.0, type=float)
+    parser.add_argument('--threads', default=8, type=int)
+    parser.add_argument('--binary', default=0, type=int)
+    parser.add_argument('--model', default=2, type=int)
+    parser.add_argument('--num_workers', default=1, type=int, help='processes used to parse the co-occurrence files')
+    parser.add_argument('--seed', default=1, type=int)
+    parser.add_argument('--temp_dir', default='', help='shuffle temp files and the on-disk .shuf, default next to save_file')
+    args = parser.parse_args()
+
+    run_pipeline(args.coo, args.vocab, args.save_file, args.memory_mb, args.trainer, args.build_dir, args.vector_size,
+                 args.iter, args.x_max, args.threads, args.binary, args.model, args.num_workers, args.seed, args.temp_dir)
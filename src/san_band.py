@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# Banded self attention dump.
+#
+# Only the (2 * window + 1) wide diagonal band of every word-word attention row is kept, which is
+# all cal_san_word_coo ever reads. A dump with prefix P is made of:
+#   P.band     float16 [num_words, 2 * window + 1], column k holds the weight to word (i + k - window)
+#   P.ids      int32   [num_words], word id of every position (ids index P.vocab)
+#   P.offsets  int64   [num_sentences + 1], first row of every sentence in P.band / P.ids
+#   P.vocab    one word per line
+#   P.meta     json with window size and sizes
+# band, ids and offsets are raw little endian arrays so they can be appended and memory-mapped.
+import codecs
+import json
+import sys
+import time
+import numpy as np
+from block_io import open_output
+from coo_sketch import BoundedPairTable
+
+BAND_DTYPE = np.float16
+ID_DTYPE = np.int32
+OFFSET_DTYPE = np.int64
+
+
+def word_attention_band(piece_weights, offsets, length, window_size):
+    # average word piece weights inside every (word_i, word_j) block, as weight_sum does, then cut the band
+    num_pieces = piece_weights.shape[-1]
+    assign = np.zeros((length, num_pieces), dtype=np.float32)
+    for word_idx in range(length):
+        start, end = offsets[word_idx]
+        assign[word_idx, start: end + 1] = 1.0 / (end - start + 1)
+    word_weights = assign @ piece_weights.astype(np.float32) @ assign.T
+
+    rows = np.arange(length)[:, None]
+    cols = rows + np.arange(-window_size, window_size + 1)[None, :]
+    valid = (cols >= 0) & (cols < length)
+    band = np.where(valid, word_weights[rows, np.clip(cols, 0, length - 1)], 0)
+    return band.astype(BAND_DTYPE)
+
+
+class BandDumpWriter(object):
+    def __init__(self, path, window_size, resume_state=None):
+        # resume_state: state() saved after a flush, the files are cut back to it and appended
+        self.path = path
+        self.window_size = window_size
+        self.vocab = {}
+        self.num_sentences = 0
+        self.num_words = 0
+        if resume_state is None:
+            self.f_band = open(path + '.band', 'wb')
+            self.f_ids = open(path + '.ids', 'wb')
+            self.f_offsets = open(path + '.offsets', 'wb')
+            self.f_offsets.write(np.zeros(1, dtype=OFFSET_DTYPE).tobytes())
+            return
+        self.vocab = {word: idx for idx, word in enumerate(resume_state['vocab'])}
+        self.num_sentences, self.num_words = resume_state['num_sentences'], resume_state['num_words']
+        sizes = (self.num_words * (2 * window_size + 1) * np.dtype(BAND_DTYPE).itemsize,
+                 self.num_words * np.dtype(ID_DTYPE).itemsize, (self.num_sentences + 1) * np.dtype(OFFSET_DTYPE).itemsize)
+        for suffix, size in zip(('.band', '.ids', '.offsets'), sizes):
+            with open(path + suffix, 'r+b') as fout:
+                fout.truncate(size)
+        self.f_band = open(path + '.band', 'ab')
+        self.f_ids = open(path + '.ids', 'ab')
+        self.f_offsets = open(path + '.offsets', 'ab')
+
+    def word_ids(self, words):
+        ids = []
+        for word in words:
+            if word not in self.vocab:
+                self.vocab[word] = len(self.vocab)
+            ids.append(self.vocab[word])
+        return np.array(ids, dtype=ID_DTYPE)
+
+    def add(self, words, band):
+        assert band.shape == (len(words), 2 * self.window_size + 1)
+        self.f_band.write(np.ascontiguousarray(band, dtype=BAND_DTYPE).tobytes())
+        self.f_ids.write(self.word_ids(words).tobytes())
+        self.num_sentences += 1
+        self.num_words += len(words)
+        self.f_offsets.write(np.array([self.num_words], dtype=OFFSET_DTYPE).tobytes())
+
+    def flush(self):
+        for f in (self.f_band, self.f_ids, self.f_offsets):
+            f.flush()
+
+    def state(self):
+        return {'vocab': list(self.vocab), 'num_sentences': self.num_sentences, 'num_words': self.num_words}
+
+    def close(self):
+        for f in (self.f_band, self.f_ids, self.f_offsets):
+            f.close()
+        with codecs.open(self.path + '.vocab', 'w', 'utf-8') as fout:
+            for word in self.vocab:
+                fout.write(word + '\n')
+        with open(self.path + '.meta', 'w') as fout:
+            json.dump({'window_size': self.window_size, 'num_sentences': self.num_sentences,
+                       'num_words': self.num_words, 'vocab_size': len(self.vocab)}, fout)
+
+
+class BandDump(object):
+    def __init__(self, path):
+        with open(path + '.meta') as fin:
+            meta = json.load(fin)
+        self.window_size = meta['window_size']
+        self.num_words = meta['num_words']
+        self.vocab = [line.rstrip('\n') for line in codecs.open(path + '.vocab', 'r', 'utf-8')]
+        width = 2 * self.window_size + 1
+        self.band = np.memmap(path + '.band', dtype=BAND_DTYPE, mode='r', shape=(self.num_words, width))
+        self.ids = np.memmap(path + '.ids', dtype=ID_DTYPE, mode='r', shape=(self.num_words,))
+        self.offsets = np.memmap(path + '.offsets', dtype=OFFSET_DTYPE, mode='r', shape=(meta['num_sentences'] + 1,))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def sentence(self, index):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.ids[start: end], self.band[start: end]
+
+    def row_positions(self, start, end):
+        # position of every row in [start, end) inside its sentence and the length of that sentence
+        sen_idx = np.searchsorted(self.offsets, np.arange(start, end), side='right') - 1
+        sen_start = self.offsets[sen_idx]
+        return np.arange(start, end) - sen_start, self.offsets[sen_idx + 1] - sen_start
+
+
+def window_top_scores(band, positions, lengths, full_window, window_size, weighting):
+    # vectorized version of the windowed top-k in cal_san_word_coo for a block of rows
+    cols = np.arange(full_window - window_size, full_window + window_size + 1)
+    rel = cols - full_window
+    scores = band[:, cols].astype(np.float32)
+    target = positions[:, None] + rel[None, :]
+    valid = (target >= 0) & (target < lengths[:, None]) & (rel[None, :] != 0)
+    scores[~valid] = -np.inf
+
+    top_cols = np.argsort(scores, axis=1)[:, ::-1][:, : window_size + 1]
+    top_scores = np.take_along_axis(scores, top_cols, axis=1)
+    keep = np.isfinite(top_scores)
+    if weighting == 'reciprocal':
+        weights = np.broadcast_to(1.0 / np.arange(1, window_size + 2), top_scores.shape)
+    elif weighting == 'divide':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weights = top_scores / top_scores[:, :1]
+    else:
+        raise ValueError('Please specific reweight method!')
+    return rel[top_cols], np.where(keep, weights, 0), keep
+
+
+def reduce_pairs(keys, values):
+    uniq_keys, inverse = np.unique(keys, return_inverse=True)
+    return uniq_keys, np.bincount(inverse, weights=values)
+
+
+def cal_san_word_coo_banded(dump_path, configs, block_rows=1 << 20, memory_mb=0, top_n=0):
+    # configs: [(window_size, weighting, coo_path)], window_size must not exceed the dump window
+    # memory_mb > 0 aggregates into bounded approximate tables (see coo_sketch.py)
+    dump = BandDump(dump_path)
+    for window_size, _, _ in configs:
+        if window_size > dump.window_size:
+            raise ValueError('window %d exceeds the dump window %d' % (window_size, dump.window_size))
+
+    start = time.time()
+    vocab_size = len(dump.vocab)
+    if memory_mb > 0:
+        tables = [BoundedPairTable(memory_mb / float(len(configs)), top_n, row_of=lambda key: key // vocab_size)
+                  for _ in configs]
+    else:
+        tables = [([], []) for _ in configs]
+    for row_start in range(0, dump.num_words, block_rows):
+        row_end = min(row_start + block_rows, dump.num_words)
+        band = np.asarray(dump.band[row_start: row_end])
+        ids = np.asarray(dump.ids)
+        positions, lengths = dump.row_positions(row_start, row_end)
+        rows = np.arange(row_start, row_end)
+
+        for (window_size, weighting, _), table in zip(configs, tables):
+            rel, weights, keep = window_top_scores(band, positions, lengths, dump.window_size, window_size, weighting)
+            context_rows = np.where(keep, rows[:, None] + rel, 0)
+            pair_keys = ids[rows][:, None].astype(np.int64) * vocab_size + ids[context_rows]
+            block_keys, block_values = reduce_pairs(pair_keys[keep], weights[keep])
+            if isinstance(table, BoundedPairTable):
+                for key, value in zip(block_keys.tolist(), block_values.tolist()):
+                    table.add(key, value)
+                continue
+            keys, values = table
+            keys.append(block_keys)
+            values.append(block_values)
+            if len(keys) > 8:
+                merged = reduce_pairs(np.concatenate(keys), np.concatenate(values))
+                keys[:], values[:] = [merged[0]], [merged[1]]
+
+        print('%.2fs processing %d / %d words.' % (time.time() - start, row_end, dump.num_words))
+        sys.stdout.flush()
+
+    for (_, _, coo_path), table in zip(configs, tables):
+        if isinstance(table, BoundedPairTable):
+            items = sorted(table.items())
+            table.report()
+            keys, values = [key for key, _ in items], [value for _, value in items]
+        else:
+            keys, values = table
+            if keys:
+                keys, values = reduce_pairs(np.concatenate(keys), np.concatenate(values))
+        print('writing table to:%s' % coo_path)
+        with open_output(coo_path) as fout:
+            for key, value in zip(np.asarray(keys).tolist(), np.asarray(values).tolist()):
+                fout.write("%s\t%s\t%.8f\n" % (dump.vocab[key // vocab_size], dump.vocab[key % vocab_size], value))
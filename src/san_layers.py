@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# SAN attention from a range of encoder layers, and the comparison of its co-occurrences with the full-depth sum.
+#
+# --san_layers FIRST-LAST (0-based, inclusive) sums the attention of layers FIRST..LAST only. The dump then runs
+# static_graph.TruncatedEncoder instead of the model: the embeddings and the encoder layers up to LAST, so the layers
+# above it and the pooler are never computed, and the attention of the selected layers goes straight to the head /
+# layer sum (dynamic, or compiled with --static_graph).
+#
+# compare reads two co-occurrence files (the full-depth sum and a layer subset) and reports the pair overlap, the
+# overlap of the top contexts of every target word and the Spearman correlation of the weights of the shared pairs;
+# benchmark.py --task san_layers adds the dump speed of every range on a small random model.
+#
+#   python src/bert_cooccur_mindspore.py --corpus_name xaa --model_name bert-large-uncased --san_glove --sweep_windows 10 --san_layers 0-11
+#   python src/san_layers.py compare --full san.coo --subset san.layers0-11.coo --top_n 10
+import argparse
+import sys
+import numpy as np
+from parallel_reader import iter_lines, parse_coo_matrix
+
+def parse_layer_range(text):
+    # '' or 'all' -> None, '4-8' -> (4, 8), '6' -> (0, 6)
+    text = text.strip()
+    if not text or text == 'all':
+        return None
+    first, _, last = text.rpartition('-')
+    first, last = int(first or 0), int(last)
+    if first < 0 or last < first:
+        raise ValueError('bad layer range: %s' % text)
+    return first, last
+
+
+def layer_range_name(layer_range):
+    return 'all' if layer_range is None else 'layers%d-%d' % layer_range
+
+
+def spearman(x, y):
+    if len(x) < 2:
+        return 0.0
+    rank_x = np.argsort(np.argsort(x)).astype(np.float64)
+    rank_y = np.argsort(np.argsort(y)).astype(np.float64)
+    return float(np.corrcoef(rank_x, rank_y)[0, 1])
+
+
+def top_contexts(table, top_n):
+    rows = {}
+    for (target, context), value in table.items():
+        rows.setdefault(target, []).append((value, context))
+    return {target: set(context for _, context in sorted(items, reverse=True)[: top_n]) for target, items in rows.items()}
+
+
+def compare_coo(full_path, subset_path, top_n=10):
+    # -> {pairs_full, pairs_subset, pair_jaccard, top_overlap, spearman}
+    full = parse_coo_matrix(iter_lines(full_path))
+    subset = parse_coo_matrix(iter_lines(subset_path))
+    shared = [key for key in full if key in subset]
+    full_top, subset_top = top_contexts(full, top_n), top_contexts(subset, top_n)
+    overlaps = [len(contexts & subset_top.get(target, set())) / float(len(contexts)) for target, contexts in full_top.items()]
+    return {'pairs_full': len(full), 'pairs_subset': len(subset),
+            'pair_jaccard': len(shared) / float(max(1, len(full) + len(subset) - len(shared))),
+            'top_overlap': float(np.mean(overlaps)) if overlaps else 0.0,
+            'spearman': spearman(np.array([full[key] for key in shared]), np.array([subset[key] for key in shared]))}
+
+
+def print_comparison(name, res):
+    print('%s: %d / %d pairs, pair jaccard %.3f, top contexts overlap %.3f, spearman %.3f' %
+          (name, res['pairs_subset'], res['pairs_full'], res['pair_jaccard'], res['top_overlap'], res['spearman']))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare SAN co-occurrences of a layer range with the full-depth sum')
+    parser.add_argument('command', choices=['compare'])
+    parser.add_argument('--full', required=True, help='co-occurrence file of all layers')
+    parser.add_argument('--subset', required=True, help='co-occurrence file of a layer range')
+    parser.add_argument('--top_n', default=10, type=int)
+    args = parser.parse_args()
+
+    print_comparison(args.subset, compare_coo(args.full, args.subset, args.top_n))
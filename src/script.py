@@ -1,9 +1,17 @@
 # -*- coding: utf-8 -*-
 import codecs
 import sys
+import numpy as np
 from transformers import BertTokenizer
+from coo_store import CooStore, store_exists, build_store
+from parallel_reader import iter_lines
 
 def test(path):
+    # path is a co-occurrence text file or the prefix of a coo_store.py store
+    if store_exists(path):
+        print('vocabs len:', len(CooStore(path)))
+        return
+
     vocabs = set()
     for line in codecs.open(path, 'r', 'utf-8'):
         parts = line.strip().split('\t')
@@ -13,6 +21,13 @@ def test(path):
 
 
 def analysis(path, target_word, context_word):
+    if store_exists(path):
+        word_count, c_word_count, c_word_ratio = CooStore(path).ratio(target_word, context_word)
+        print('word count:', word_count)
+        print('co-occurrence count:', c_word_count)
+        print('ratio:', c_word_ratio)
+        return
+
     word_count = 0
     c_word_count = {}
     c_word_ratio = {}
@@ -63,9 +78,90 @@ def remove_noisy_word(mlm_word_coo_path, glove_word_coo_path, tokenizer):
             output.write(line) # write pure words
 
 
+def pure_word_bitmap(ivocab, tokenizer):
+    pure = np.zeros(len(ivocab), dtype=bool)
+    for idx, word in enumerate(ivocab):
+        if word:
+            pure[idx] = len(tokenizer._tokenize(word)) == 1
+    print('pure words: %d / %d' % (pure.sum(), len(ivocab)))
+    return pure
+
+
+def lookup_pairs(store, rows, cols):
+    # binary search of every (row, col) inside its CSR row at once, 0 for missing pairs
+    lo, end = store.indptr[rows], store.indptr[rows + 1]
+    hi = end.copy()
+    if store.nnz() == 0:
+        return np.zeros(len(rows))
+    while True:
+        active = lo < hi
+        if not active.any():
+            break
+        mid = (lo + hi) // 2
+        go_right = active & (store.indices[np.where(active, mid, 0)] < cols)
+        lo = np.where(go_right, mid + 1, lo)
+        hi = np.where(active & ~go_right, mid, hi)
+    pos = np.minimum(lo, store.nnz() - 1)
+    found = (lo < end) & (store.indices[pos] == cols)
+    return np.where(found, store.data[pos], 0)
+
+
+def filter_noisy_chunk(lines, store, pure, tokenizer, oov_pure, output):
+    pairs = [line.strip().split('\t') for line in lines]
+    ids1 = np.array([store.vocab.get(parts[0], 0) for parts in pairs], dtype=np.int64)
+    ids2 = np.array([store.vocab.get(parts[1], 0) if len(parts) > 1 else 0 for parts in pairs], dtype=np.int64)
+    glove_vals = lookup_pairs(store, ids1, ids2)
+
+    def is_pure(word, word_id):
+        if word_id > 0:
+            return pure[word_id]
+        if word not in oov_pure:
+            oov_pure[word] = len(tokenizer._tokenize(word)) == 1
+        return oov_pure[word]
+
+    for line, parts, id1, id2, glove_val in zip(lines, pairs, ids1.tolist(), ids2.tolist(), glove_vals.tolist()):
+        if glove_val > 1 or (len(parts) > 1 and is_pure(parts[0], id1) and is_pure(parts[1], id2)):
+            output.write(line + '\n')
+
+
+def remove_noisy_word_stream(mlm_word_coo_path, glove_word_coo_path, tokenizer, vocab_path='', memory_mb=1024):
+    # same filter as remove_noisy_word with the glove co-occurrences read from a coo_store.py store
+    # (built from the text file first if needed, keeping the pairs of words outside vocab_path) and the MLM file
+    # streamed in chunks, keeping line order
+    store_prefix = glove_word_coo_path
+    if not store_exists(store_prefix):
+        store_prefix = glove_word_coo_path + '.store'
+        if not store_exists(store_prefix):
+            build_store(glove_word_coo_path, vocab_path, store_prefix, keep_oov=True)
+    store = CooStore(store_prefix)
+    pure = pure_word_bitmap(store.ivocab, tokenizer)
+    chunk_lines = max(1, int(memory_mb * (1 << 20) / 512))  # ~512 bytes per buffered line and its arrays
+
+    print('mlm word coo path:', mlm_word_coo_path)
+    print('glove word coo store:', store_prefix)
+    output = codecs.open(mlm_word_coo_path + '.reduce1', mode='w+', encoding='utf-8')
+    buffer, oov_pure = [], {}
+    for idx, line in enumerate(iter_lines(mlm_word_coo_path)):
+        if (idx + 1) % 1e8 == 0:
+            print('processing %s lines.' % (idx + 1))
+            sys.stdout.flush()
+        buffer.append(line)
+        if len(buffer) >= chunk_lines:
+            filter_noisy_chunk(buffer, store, pure, tokenizer, oov_pure, output)
+            buffer = []
+    filter_noisy_chunk(buffer, store, pure, tokenizer, oov_pure, output)
+    output.close()
+
+
 if __name__=="__main__":
+    # python src/script.py mlm_word_coo glove_word_coo tokenizer_path [vocab_path]
+    # with a vocab path (or a store prefix as glove_word_coo) the streaming filter is used
     mlm_word_coo_path = sys.argv[1]
     glove_word_coo_path = sys.argv[2]
     tokenizer_path = sys.argv[3]
+    vocab_path = sys.argv[4] if len(sys.argv) > 4 else ''
     bert_tokenizer = BertTokenizer.from_pretrained(tokenizer_path)
-    remove_noisy_word(mlm_word_coo_path, glove_word_coo_path, bert_tokenizer)
+    if vocab_path or store_exists(glove_word_coo_path):
+        remove_noisy_word_stream(mlm_word_coo_path, glove_word_coo_path, bert_tokenizer, vocab_path)
+    else:
+        remove_noisy_word(mlm_word_coo_path, glove_word_coo_path, bert_tokenizer)
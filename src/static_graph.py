@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# Static-shape compiled forward passes for the MLM and SAN dumps.
+#
+# collate_fn pads every batch to its own longest sentence, so every batch has a new shape and the PyNative forward
+# never reuses a compiled graph. Here a batch is padded to the dump batch size and to the smallest length bucket
+# (32/64/128/256/512 by default) that holds it, and the forward runs as a mindspore.jit graph that is compiled once
+# per bucket and cached for the rest of the run (and across the shards of model_worker.py). The MLM graph ends with
+# TopK, so only the [batch, length, k] scores and ids leave the device instead of the [batch, length, vocab] logits;
+# the SAN graph sums the attention of all heads and layers (or of the --san_layers range, through TruncatedEncoder) on
+# the device. Padded positions get a zero attention mask, so the rows of the real wordpieces are those of the dynamic
+# forward.
+#
+# The first call of a bucket is timed as compile + run, later calls as steady state. report() prints the compile
+# seconds, steady ms per batch and padding per bucket; benchmark.py --task static_graph compares them with the
+# dynamic forward (break-even batches = compile seconds / saving per batch).
+#
+#   python src/bert_cooccur_mindspore.py --corpus_name xaa --model_name bert-large-uncased --mlm_glove --sweep_windows 5,10 --static_graph
+import time
+import numpy as np
+import mindspore
+from mindspore import nn, ops
+import metrics
+
+BUCKETS = (32, 64, 128, 256, 512)
+MAX_LEN = 512  # BERT_MAX_LEN of bert_cooccur_mindspore, the longest batch collate_fn can make
+
+settings = {'enabled': False, 'buckets': BUCKETS}
+forwards = {}
+
+
+def configure(enabled=True, buckets=BUCKETS):
+    # MAX_LEN is always a bucket, so a long sentence never stops a dump that was given only short buckets
+    buckets = sorted(buckets)
+    if not buckets or buckets[-1] < MAX_LEN:
+        buckets.append(MAX_LEN)
+    settings.update(enabled=enabled, buckets=tuple(buckets))
+
+
+def parse_buckets(text):
+    return tuple(int(item) for item in text.split(',') if item.strip())
+
+
+def bucket_length(length, buckets=None):
+    buckets = buckets or settings['buckets']
+    for bucket in buckets:
+        if length <= bucket:
+            return bucket
+    raise ValueError('%d wordpieces exceed the largest bucket %d' % (length, buckets[-1]))
+
+
+def pad_to(x, batch_size, length):
+    out = np.zeros((batch_size, length), dtype=x.dtype)
+    out[: x.shape[0], : x.shape[1]] = x
+    return out
+
+
+class MaskedLMTopK(nn.Cell):
+    def __init__(self, masked_model, top_k):
+        super(MaskedLMTopK, self).__init__()
+        self.masked_model = masked_model
+        self.top_k = top_k
+        self.topk = ops.TopK(sorted=True)
+
+    @mindspore.jit
+    def construct(self, input_ids, attention_mask):
+        logits = self.masked_model(input_ids=input_ids, attention_mask=attention_mask)[0]
+        return self.topk(logits, self.top_k)
+
+
+class TruncatedEncoder(nn.Cell):
+    # embeddings and encoder layers 0..last_layer of a BERT model, without the layers above and the pooler
+    # -> attentions (batch_size, head_num, max_len, max_len) of layers first_layer..last_layer
+    def __init__(self, model, first_layer, last_layer):
+        super(TruncatedEncoder, self).__init__()
+        num_layers = len(model.encoder.layer)
+        if last_layer >= num_layers:
+            raise ValueError('layer %d does not exist, the model has %d layers' % (last_layer, num_layers))
+        self.embeddings = model.embeddings
+        self.layers = nn.CellList([model.encoder.layer[idx] for idx in range(last_layer + 1)])
+        for layer in self.layers:
+            layer.attention.self.output_attentions = True
+        self.first_layer = first_layer
+        self.set_train(False)
+
+    def construct(self, input_ids, attention_mask):
+        # the extended mask of the full model: 0 for real wordpieces, -10000 for padding
+        extended_mask = (1.0 - attention_mask.astype(mindspore.float32).expand_dims(1).expand_dims(2)) * -10000.0
+        hidden_states = self.embeddings(input_ids)
+        attentions = ()
+        for layer_idx, layer in enumerate(self.layers):
+            layer_outputs = layer(hidden_states, extended_mask)
+            hidden_states = layer_outputs[0]
+            if layer_idx >= self.first_layer:
+                attentions += (layer_outputs[1],)
+        return attentions
+
+
+class AttentionSum(nn.Cell):
+    # attention weights summed over heads and layers (all, or a (first, last) range): [batch, length, length]
+    def __init__(self, model, layer_range=None):
+        super(AttentionSum, self).__init__()
+        self.truncated = layer_range is not None
+        self.model = truncated_encoder(model, layer_range) if self.truncated else model
+
+    @mindspore.jit
+    def construct(self, input_ids, attention_mask):
+        if self.truncated:
+            attentions = self.model(input_ids, attention_mask)
+        else:
+            attentions = self.model(input_ids=input_ids, attention_mask=attention_mask, output_attentions=True)[-1]
+        total = attentions[0].sum(1)
+        for layer_attention in attentions[1:]:
+            total = total + layer_attention.sum(1)
+        return total
+
+
+class BucketedForward(object):
+    # net(input_ids, attention_mask) on batches padded to (batch_size, bucket) -> numpy outputs cut back to the batch;
+    # length_axes is the number of leading wordpiece axes after the batch axis (1 for TopK, 2 for attention)
+    def __init__(self, net, batch_size, name, length_axes=1):
+        self.net = net
+        self.batch_size = batch_size
+        self.name = name
+        self.length_axes = length_axes
+        self.stats = {}
+
+    def __call__(self, input_ids, masks):
+        ids = input_ids.asnumpy() if hasattr(input_ids, 'asnumpy') else np.asarray(input_ids)
+        mask = masks.asnumpy() if hasattr(masks, 'asnumpy') else np.asarray(masks)
+        num_rows, length = ids.shape
+        bucket = bucket_length(length)
+        rows = max(num_rows, self.batch_size)
+        start = time.time()
+        outputs = self.net(mindspore.Tensor(pad_to(ids, rows, bucket)), mindspore.Tensor(pad_to(mask, rows, bucket)))
+        outputs = outputs if isinstance(outputs, (tuple, list)) else (outputs,)
+        cut = (slice(num_rows),) + (slice(length),) * self.length_axes
+        outputs = [item.asnumpy()[cut] for item in outputs]
+        seconds = time.time() - start
+
+        stats = self.stats.setdefault(bucket, {'first_s': 0.0, 'calls': 0, 'steady_s': 0.0, 'wordpieces': 0, 'padded': 0})
+        if stats['calls'] == 0:
+            stats['first_s'] = seconds
+            metrics.add_time('compile', seconds)
+        else:
+            stats['steady_s'] += seconds
+        stats['calls'] += 1
+        stats['wordpieces'] += int(mask.sum())
+        stats['padded'] += rows * bucket
+        metrics.count('bucket_padded_wordpieces', rows * bucket)
+        return outputs
+
+    def summary(self):
+        # -> [{bucket, calls, compile_s, steady_ms, padding}], compile_s is the first call minus a steady call
+        rows = []
+        for bucket in sorted(self.stats):
+            stats = self.stats[bucket]
+            steady = stats['steady_s'] / (stats['calls'] - 1) if stats['calls'] > 1 else 0.0
+            rows.append({'bucket': bucket, 'calls': stats['calls'], 'compile_s': max(0.0, stats['first_s'] - steady),
+                         'steady_ms': 1000 * steady, 'padding': 1 - stats['wordpieces'] / float(max(1, stats['padded']))})
+        return rows
+
+    def report(self):
+        print('%s\tbucket\tcalls\tcompile_s\tsteady_ms\tpadding' % self.name)
+        for row in self.summary():
+            print('%s\t%d\t%d\t%.2f\t%.1f\t%.3f' % (self.name, row['bucket'], row['calls'], row['compile_s'], row['steady_ms'],
+                                                   row['padding']))
+
+
+def masked_lm_topk(masked_model, top_k, batch_size):
+    # one compiled forward per (model, k, batch size), kept for the life of the process
+    key = ('mlm_topk', id(masked_model), top_k, batch_size)
+    if key not in forwards:
+        forwards[key] = BucketedForward(MaskedLMTopK(masked_model, top_k), batch_size, 'mlm_topk', length_axes=1)
+    return forwards[key]
+
+
+def attention_sum(model, batch_size, layer_range=None):
+    key = ('attention_sum', id(model), batch_size, layer_range)
+    if key not in forwards:
+        forwards[key] = BucketedForward(AttentionSum(model, layer_range), batch_size, 'attention_sum', length_axes=2)
+    return forwards[key]
+
+
+def truncated_encoder(model, layer_range):
+    key = ('truncated_encoder', id(model), layer_range)
+    if key not in forwards:
+        forwards[key] = TruncatedEncoder(model, *layer_range)
+    return forwards[key]
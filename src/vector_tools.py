@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# Batch post-processing of word vector matrices (see eval/python/vectors_io.py for loading).
+#
+# All operations work a chunk of rows at a time on float32 (memory-mapped) matrices:
+#   normalize   rows to unit L2 or L1 norm
+#   merge       rows of a base vocabulary overridden by a second model where it has the word
+#   compose     word vectors from BPE piece vectors through a word x piece CSR matrix
+#               (first piece or mean of the pieces, built once from a word\tpiece\tpiece... file)
+#   write_text / write_binary   glove text or word2vec binary output
+#
+#   python src/vector_tools.py bench --words 200000 --dim 300
+import argparse
+import codecs
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'eval', 'python'))
+from vectors_io import load_vectors
+
+CHUNK_ROWS = 1 << 15
+
+
+def new_matrix(shape, path=''):
+    if path:
+        return np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=shape)
+    return np.empty(shape, dtype=np.float32)
+
+
+def normalize(W, ord=2, out=None):
+    out = new_matrix(W.shape) if out is None else out
+    for lo in range(0, W.shape[0], CHUNK_ROWS):
+        chunk = np.asarray(W[lo: lo + CHUNK_ROWS], dtype=np.float32)
+        d = np.abs(chunk).sum(1) if ord == 1 else np.sqrt(np.einsum('ij,ij->i', chunk, chunk))
+        d[d == 0] = 1
+        out[lo: lo + CHUNK_ROWS] = chunk / d[:, None]
+    return out
+
+
+def merge(base, override, out=None):
+    # (W, vocab, ivocab) of base with the rows of words known to override replaced -> (W, overlap count)
+    W1, vocab1, ivocab1 = base
+    W2, vocab2, ivocab2 = override
+    src = np.array([vocab2.get(w, -1) for w in ivocab1], dtype=np.int64)
+    out = new_matrix(W1.shape) if out is None else out
+    for lo in range(0, W1.shape[0], CHUNK_ROWS):
+        chunk = np.array(W1[lo: lo + CHUNK_ROWS], dtype=np.float32)
+        rows = src[lo: lo + CHUNK_ROWS]
+        found = rows >= 0
+        chunk[found] = W2[rows[found]]
+        out[lo: lo + CHUNK_ROWS] = chunk
+    return out, int((src >= 0).sum())
+
+
+def read_word_pieces(path):
+    # word\tpiece\tpiece... as written by fasttext_usage.gen_bpe_vocab
+    word_pieces = {}
+    for line in codecs.open(path, 'r', 'utf-8'):
+        parts = line.rstrip('\n').split('\t')
+        if len(parts) >= 2:
+            word_pieces[parts[0]] = parts[1:]
+    return word_pieces
+
+
+def piece_matrix(words, word_pieces, piece_vocab, mode='mean'):
+    # CSR (indptr, indices, weights) of words x pieces; pieces without a vector are left out
+    indptr, indices, weights = [0], [], []
+    for word in words:
+        ids = [piece_vocab[p] for p in word_pieces.get(word, ()) if p in piece_vocab]
+        if mode == 'first':
+            ids = ids[:1]
+        indices.extend(ids)
+        weights.extend([1.0 / max(1, len(ids))] * len(ids))
+        indptr.append(len(indices))
+    return np.array(indptr, dtype=np.int64), np.array(indices, dtype=np.int64), np.array(weights, dtype=np.float32)
+
+
+def compose(piece_W, matrix, out=None):
+    # rows of the CSR matrix times piece_W, one pass per piece position; words without pieces get zero vectors
+    indptr, indices, weights = matrix
+    num_words = len(indptr) - 1
+    out = new_matrix((num_words, piece_W.shape[1])) if out is None else out
+    for lo in range(0, num_words, CHUNK_ROWS):
+        hi = min(lo + CHUNK_ROWS, num_words)
+        starts, lengths = indptr[lo: hi], np.diff(indptr[lo: hi + 1])
+        chunk = np.zeros((hi - lo, piece_W.shape[1]), dtype=np.float32)
+        for k in range(int(lengths.max()) if len(lengths) else 0):
+            rows = np.nonzero(lengths > k)[0]
+            pos = starts[rows] + k
+            chunk[rows] += np.asarray(piece_W[indices[pos]], dtype=np.float32) * weights[pos, None]
+        out[lo: hi] = chunk
+    return out
+
+
+def write_text(path, ivocab, W, precision=8, header=False):
+    row_format = ' '.join(['%%.%df' % precision] * W.shape[1])
+    with codecs.open(path, 'w+', 'utf-8') as fout:
+        if header:
+            fout.write('%d %d\n' % W.shape)
+        for lo in range(0, W.shape[0], CHUNK_ROWS):
+            rows = np.asarray(W[lo: lo + CHUNK_ROWS]).tolist()
+            fout.write(''.join('%s %s\n' % (word, row_format % tuple(row)) for word, row in zip(ivocab[lo: lo + CHUNK_ROWS], rows)))
+
+
+def write_binary(path, ivocab, W):
+    # word2vec binary format, readable by KeyedVectors.load_word2vec_format(path, binary=True)
+    with open(path, 'wb') as fout:
+        fout.write(('%d %d\n' % W.shape).encode('utf-8'))
+        for lo in range(0, W.shape[0], CHUNK_ROWS):
+            rows = np.asarray(W[lo: lo + CHUNK_ROWS], dtype='<f4')
+            fout.write(b''.join(word.encode('utf-8') + b' ' + row.tobytes() + b'\n'
+                                for word, row in zip(ivocab[lo: lo + CHUNK_ROWS], rows)))
+
+
+############################# benchmark #############################
+
+def loop_normalize(W, ord=2):
+    out = np.zeros(W.shape, dtype=np.float32)
+    for idx in range(W.shape[0]):
+        out[idx] = W[idx] / np.linalg.norm(W[idx], ord=ord)
+    return out
+
+
+def loop_compose(piece_W, piece_vocab, words, word_pieces):
+    out = np.zeros((len(words), piece_W.shape[1]), dtype=np.float32)
+    for idx, word in enumerate(words):
+        pieces = word_pieces[word]
+        for piece in pieces:
+            out[idx] += piece_W[piece_vocab[piece]]
+        out[idx] /= len(pieces)
+    return out
+
+
+def loop_write_text(path, ivocab, W):
+    with codecs.open(path, 'w+', 'utf-8') as fout:
+        for word, row in zip(ivocab, W):
+            fout.write(word + ' ' + ' '.join(['%.8f' % item for item in row]) + '\n')
+
+
+def benchmark(num_words, dim, num_pieces=30000, tmp_dir=''):
+    tmp_dir = tmp_dir or tempfile.mkdtemp(prefix='semglove_vectors_')
+    rng = np.random.RandomState(1234)
+    W = rng.randn(num_words, dim).astype(np.float32)
+    words = ['w%d' % idx for idx in range(num_words)]
+    vocab = {w: idx for idx, w in enumerate(words)}
+    piece_W = rng.randn(num_pieces, dim).astype(np.float32)
+    piece_vocab = {'p%d' % idx: idx for idx in range(num_pieces)}
+    word_pieces = {w: ['p%d' % p for p in rng.randint(0, num_pieces, rng.randint(1, 4))] for w in words}
+    override = (W[::2], {w: idx for idx, w in enumerate(words[::2])}, words[::2])
+
+    def timed(fn, *args):
+        start = time.time()
+        fn(*args)
+        return time.time() - start
+
+    matrix_seconds = timed(piece_matrix, words, word_pieces, piece_vocab, 'mean')
+    matrix = piece_matrix(words, word_pieces, piece_vocab, 'mean')
+    jobs = [
+        ('normalize', lambda: normalize(W), lambda: loop_normalize(W)),
+        ('merge', lambda: merge((W, vocab, words), override),
+         lambda: [override[0][override[1][w]] if w in override[1] else W[vocab[w]] for w in words]),
+        ('compose_mean', lambda: compose(piece_W, matrix), lambda: loop_compose(piece_W, piece_vocab, words, word_pieces)),
+        ('write_text', lambda: write_text(os.path.join(tmp_dir, 'fast.txt'), words, W),
+         lambda: loop_write_text(os.path.join(tmp_dir, 'loop.txt'), words, W)),
+        ('write_binary', lambda: write_binary(os.path.join(tmp_dir, 'fast.bin'), words, W),
+         lambda: loop_write_text(os.path.join(tmp_dir, 'loop.txt'), words, W)),
+    ]
+    print('piece matrix of %d words built in %.2fs' % (num_words, matrix_seconds))
+    print('task\tbatch_s\tloop_s\tspeedup')
+    for name, fast, loop in jobs:
+        fast_seconds = timed(fast)
+        loop_seconds = timed(loop)
+        print('%s\t%.3f\t%.3f\t%.1fx' % (name, fast_seconds, loop_seconds, loop_seconds / fast_seconds))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batch word vector post-processing')
+    parser.add_argument('command', choices=['normalize', 'merge', 'compose', 'bench'])
+    parser.add_argument('--vectors', default='', help='input vectors (base vectors for merge, piece vectors for compose)')
+    parser.add_argument('--override', default='', help='merge: vectors that replace the base rows')
+    parser.add_argument('--word_pieces', default='', help='compose: word\\tpiece... file of gen_bpe_vocab')
+    parser.add_argument('--mode', default='mean', choices=['mean', 'first'])
+    parser.add_argument('--ord', default=2, type=int)
+    parser.add_argument('--output', default='')
+    parser.add_argument('--binary', action='store_true', help='write word2vec binary instead of text')
+    parser.add_argument('--words', default=200000, type=int)
+    parser.add_argument('--dim', default=300, type=int)
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        benchmark(args.words, args.dim)
+        sys.exit(0)
+
+    start = time.time()
+    W, vocab, ivocab = load_vectors(args.vectors, normalize=False)
+    if args.command == 'normalize':
+        W = normalize(W, args.ord)
+    elif args.command == 'merge':
+        W, overlap = merge((W, vocab, ivocab), load_vectors(args.override, normalize=False))
+        print('replaced %d overlap words' % overlap)
+    else:
+        word_pieces = read_word_pieces(args.word_pieces)
+        ivocab = list(word_pieces)
+        W = compose(W, piece_matrix(ivocab, word_pieces, vocab, args.mode))
+    if args.binary:
+        write_binary(args.output, ivocab, W)
+    else:
+        write_text(args.output, ivocab, W)
+    print('%s done in %.1fs, wrote %s' % (args.command, time.time() - start, args.output))
@@ -3,15 +3,19 @@ from sklearn.manifold import TSNE
 import re
 import matplotlib.pyplot as plt
 import pandas as pd
-from gensim.models import KeyedVectors
 import seaborn as sns
 from gensim.models.word2vec import Text8Corpus
 from gensim.models.phrases import Phraser, Phrases
 import codecs
+import hashlib
+import os
 import sys
 import nltk
 import numpy as np
 import matplotlib.cm as cm
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'eval', 'python'))
+from vectors_io import Vectors
+from vector_tools import normalize, write_text
 
 def load_vocab(path):
     res = set()
@@ -22,15 +26,47 @@ def load_vocab(path):
     return res
 
 
-def tsne_plot(vocab, model):
+GROUP_FILES = ['time.txt', 'city.txt', 'medal.txt', 'moon.txt', 'animal.txt', 'party.txt', 'clothing.txt', 'creator.txt']
+
+
+def reduce_dims(tokens, dim=50, method='pca', seed=110):
+    # PCA (or a gaussian random projection for very wide inputs) before t-SNE
+    X = np.asarray(tokens, dtype=np.float32)
+    X = X - X.mean(0)
+    if X.shape[1] <= dim or X.shape[0] <= dim:
+        return X
+    if method == 'random':
+        proj = np.random.RandomState(seed).randn(X.shape[1], dim).astype(np.float32) / np.sqrt(dim)
+        return X.dot(proj)
+    _, _, vt = np.linalg.svd(X, full_matrices=False)
+    return X.dot(vt[:dim].T)
+
+
+def layout_cache_path(cache_dir, model_path, labels, params):
+    stat = os.stat(model_path)
+    key = '%s|%d|%d|%s|%s' % (os.path.abspath(model_path), stat.st_size, int(stat.st_mtime), params, '\n'.join(labels))
+    return os.path.join(cache_dir, 'tsne.%s.npy' % hashlib.sha1(key.encode('utf-8')).hexdigest())
 
-    tsne_model = TSNE(n_components=2, random_state=np.random.RandomState(110), learning_rate=1)
-    plt.figure(figsize=(10, 10))
-    ax1 = plt.axes(frameon=False)
-    ax1.get_xaxis().tick_bottom()
-    ax1.axes.get_yaxis().set_visible(False)
-    ax1.axes.get_xaxis().set_visible(False)
 
+def tsne_layout(tokens, labels, model_path='', cache_dir='.tsne_cache', reduce_dim=50, reduce_method='pca',
+                perplexity=30.0, learning_rate=1):
+    # 2-d Barnes-Hut t-SNE coordinates, cached by model file and word list
+    params = (reduce_dim, reduce_method, perplexity, learning_rate)
+    cache_path = layout_cache_path(cache_dir, model_path, labels, params) if model_path and cache_dir else ''
+    if cache_path and os.path.exists(cache_path):
+        print('loading cached layout:', cache_path)
+        return np.load(cache_path)
+    tsne_model = TSNE(n_components=2, random_state=np.random.RandomState(110), learning_rate=learning_rate,
+                      method='barnes_hut', init='pca', perplexity=min(perplexity, max(1.0, len(labels) - 1.0)))
+    new_values = tsne_model.fit_transform(reduce_dims(tokens, reduce_dim, reduce_method))
+    if cache_path:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        np.save(cache_path, new_values)
+    return new_values
+
+
+def collect_tokens(vocab, model):
     x = np.arange(len(vocab))
     ys = [i+x+(i*x)**2 for i in range(len(vocab))]
     colors = cm.rainbow(np.linspace(0, 1, len(ys)))
@@ -38,24 +74,37 @@ def tsne_plot(vocab, model):
 
     labels, tokens, c, m = [], [], [], []
     for i, item in enumerate(vocab):
-        for word in item:
-            if word in model.wv.vocab:
-                tokens.append(model.wv[word])
+        for word in sorted(item):
+            if word in model:
+                tokens.append(model[word])
                 labels.append(word)
                 c.append(colors[i])
-                m.append(marks[i])
+                m.append(marks[i % len(marks)])
+    return labels, tokens, c, m
 
-    new_values = tsne_model.fit_transform(tokens)
 
-    res_x, res_y, res_color, res_marker = [], [], [], []
+def draw_layout(ax, labels, new_values, c, m, annotate=True):
+    ax.set_frame_on(False)
+    ax.get_xaxis().tick_bottom()
+    ax.axes.get_yaxis().set_visible(False)
+    ax.axes.get_xaxis().set_visible(False)
     for index, label in enumerate(labels):
         x, y = new_values[index, :]
-        res_x.append(x)
-        res_y.append(y)
-        res_color.append(m[index])
-        res_marker.append(c[index])
-        plt.scatter(x, y, marker=m[index], color=c[index], s=450)
-        plt.annotate(label, xy=(x, y), xytext=(5, 2), textcoords='offset points', ha='right', va='bottom')
+        ax.scatter(x, y, marker=m[index], color=c[index], s=450 if annotate else 20)
+        if annotate:
+            ax.annotate(label, xy=(x, y), xytext=(5, 2), textcoords='offset points', ha='right', va='bottom')
+
+
+def tsne_plot(vocab, model, model_path='', cache_dir='.tsne_cache'):
+    plt.figure(figsize=(10, 10))
+    ax1 = plt.axes(frameon=False)
+
+    labels, tokens, c, m = collect_tokens(vocab, model)
+    new_values = tsne_layout(tokens, labels, model_path, cache_dir)
+    draw_layout(ax1, labels, new_values, c, m)
+
+    res_x, res_y = new_values[:, 0].tolist(), new_values[:, 1].tolist()
+    for x, y, label in zip(res_x, res_y, labels):
         print((x, y, label))
 
     print(res_x)
@@ -63,6 +112,19 @@ def tsne_plot(vocab, model):
     print(labels)
     plt.show()
 
+
+def plot_models(model_paths, vocab_dir=os.path.join('..', 'data', 'vocab'), group_files=GROUP_FILES,
+                cache_dir='.tsne_cache', annotate=True):
+    # the same word groups laid out for several models, one panel per model
+    vocab = [load_vocab(os.path.join(vocab_dir, name)) for name in group_files]
+    fig, axes = plt.subplots(1, len(model_paths), figsize=(10 * len(model_paths), 10), squeeze=False)
+    for ax, model_path in zip(axes[0], model_paths):
+        model = Vectors.load(model_path)
+        labels, tokens, c, m = collect_tokens(vocab, model)
+        draw_layout(ax, labels, tsne_layout(tokens, labels, model_path, cache_dir), c, m, annotate)
+        ax.set_title(os.path.basename(model_path))
+    plt.show()
+
 def uni_test(model):
     words = load_vocab('data/vocab/vocab.gigaword.txt')
     most_similar_words = {}
@@ -81,24 +143,8 @@ def remove_stop_words(vocab_path):
     print('count vocab len:', len(count_vocab))
     return count_vocab
 
-def tsne_plot(model_path):
-
-    model1 = KeyedVectors.load_word2vec_format(model_path, binary=False)
-
-    vocab1 = load_vocab('..\\data\\vocab\\time.txt')
-    vocab2 = load_vocab('..\\data\\vocab\\city.txt')
-    vocab3 = load_vocab('..\\data\\vocab\\medal.txt')
-    vocab4 = load_vocab('..\\data\\vocab\\moon.txt')
-    vocab5 = load_vocab('..\\data\\vocab\\animal.txt')
-    vocab6 = load_vocab('..\\data\\vocab\\party.txt')
-    vocab7 = load_vocab('..\\data\\vocab\\clothing.txt')
-    vocab8 = load_vocab('..\\data\\vocab\\creator.txt')
-
-    tsne_plot([vocab1, vocab2, vocab3, vocab4, vocab5, vocab6, vocab7, vocab8], model1)
-
-
 def similar_word(model_path, target_word, context_word):
-    vectors = KeyedVectors.load_word2vec_format(model_path, binary=False)
+    vectors = Vectors.load(model_path)
     return vectors.similarity(target_word, context_word)
 
 def gender_debias(target_word, context_word):
@@ -117,20 +163,16 @@ def gender_debias(target_word, context_word):
 
 def norm_to_unit(model_path):
     outpath = model_path + '.norm'
-    vectors = KeyedVectors.load_word2vec_format(model_path, binary=False)
-    f_w = codecs.open(outpath, mode='w+', encoding='utf-8')
-    for item in vectors.vocab:
-        len = np.linalg.norm(vectors.wv[item], ord=1)
-        uni_vectors = vectors.wv[item] / len
-        f_w.write(item + ' ' + ' '.join(str(item) for item in uni_vectors.tolist()) + '\n')
+    vectors = Vectors.load(model_path)
+    write_text(outpath, vectors.ivocab, normalize(vectors.W, ord=1))
 
 if __name__ == '__main__':
 
-    word2vec = KeyedVectors.load_word2vec_format('D:\\data\\wiki\\finalvectors\\wiki.basew2v.skipgram.dim300.iter5.vectors.txt')
-    model1 = KeyedVectors.load_word2vec_format('D:\\data\\wiki\\vectors\\wiki.word.glove.iter100.xmax10.dim300.vectors.txt', binary=False)
+    word2vec = Vectors.load('D:\\data\\wiki\\finalvectors\\wiki.basew2v.skipgram.dim300.iter5.vectors.txt')
+    model1 = Vectors.load('D:\\data\\wiki\\vectors\\wiki.word.glove.iter100.xmax10.dim300.vectors.txt')
     # model_path = 'D:\\data\\wiki\\vectors\\wiki.word.san.divide.window5.count.iter100.dim300.xmax10.vectors.txt'
     # model_path = 'D:\\data\\wiki\\vectors\\wiki.word.san.reciprocal.window5.count.iter100.dim300.xmax10.vectors.txt'
-    model2 = KeyedVectors.load_word2vec_format('D:\\data\\wiki\\vectors\\wiki.word.mlm.divide.count.iter100.dim300.xmax10.filter.purewords.vectors.txt', binary=False)
+    model2 = Vectors.load('D:\\data\\wiki\\vectors\\wiki.word.mlm.divide.count.iter100.dim300.xmax10.filter.purewords.vectors.txt')
     # model_path = 'D:\\data\\wiki\\vectors\\wiki.word.mlm.reciprocal.count.iter100.dim300.xmax10.filter.pure.vectors.txt'
     # count_vocab = remove_stop_words('..\\data\\vocab\\vocab.wiki.word.txt')
     she_pairs = ['homemaker', 'nurse', 'receptionist', 'librarian', 'socialite', 'hairdresser', 'nanny', 'bookkeeper', 'stylist', 'housekeeper']